@@ -0,0 +1,131 @@
+# SUPUESTOS UTILIZADOS (Buda falso para benchmarks):
+# - Imita solo los endpoints que usa BudaClient (/markets, /tickers,
+#   /markets/{id}/ticker, /markets/{id}/order_book) con el mismo formato de
+#   payload.
+# - Latencia, jitter, tasa de error y profundidad del libro son
+#   configurables para reproducir escenarios de carga.
+# - Los precios son fijos por mercado; no simula movimientos de mercado.
+#
+# Uso: python -m benchmarks.fake_buda --port 9100 --latency 0.05 --jitter 0.01
+
+import argparse
+import asyncio
+import random
+
+from fastapi import FastAPI, HTTPException
+
+from config.constants import VALID_PAIRS
+
+# Precio de referencia en CLP; las otras monedas se derivan con un tipo fijo.
+REFERENCE_PRICES_CLP = {
+    "BTC": 80000000.0,
+    "ETH": 3000000.0,
+    "BCH": 400000.0,
+    "LTC": 80000.0,
+    "USDC": 940.0,
+    "USDT": 940.0,
+}
+FIAT_PER_CLP = {"CLP": 1.0, "COP": 4.3, "PEN": 0.004}
+
+
+def market_prices() -> dict[str, float]:
+    prices = {}
+    for base, quotes in VALID_PAIRS.items():
+        for quote in quotes:
+            prices[f"{base}-{quote}"] = REFERENCE_PRICES_CLP[base] * FIAT_PER_CLP[quote]
+    return prices
+
+
+def create_fake_buda_app(
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    error_rate: float = 0.0,
+    depth: int = 50,
+    seed: int | None = None,
+) -> FastAPI:
+    """Crea una app que responde como la API v2 de Buda.
+
+    Args:
+        latency (float): Latencia media agregada a cada respuesta (s).
+        jitter (float): Variación uniforme ± sobre la latencia (s).
+        error_rate (float): Probabilidad de responder 503.
+        depth (int): Niveles por lado en cada order book.
+        seed (int | None): Semilla para respuestas reproducibles.
+    """
+    rng = random.Random(seed)
+    prices = market_prices()
+    app = FastAPI(title="Fake Buda")
+    app.state.requests = 0
+
+    async def simulate():
+        app.state.requests += 1
+        delay = latency + rng.uniform(-jitter, jitter) if jitter else latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if error_rate and rng.random() < error_rate:
+            raise HTTPException(status_code=503, detail="fake outage")
+
+    def ticker(market_id: str, price: float) -> dict:
+        base, quote = market_id.split("-")
+        return {
+            "market_id": market_id,
+            "last_price": [f"{price:.2f}", quote],
+            "max_bid": [f"{price * 0.999:.2f}", quote],
+            "min_ask": [f"{price * 1.001:.2f}", quote],
+            "volume": [f"{rng.uniform(1, 1000):.8f}", base],
+        }
+
+    @app.get("/markets")
+    async def markets():
+        await simulate()
+        return {"markets": [
+            {"id": market_id, "base_currency": market_id.split("-")[0], "quote_currency": market_id.split("-")[1]}
+            for market_id in prices
+        ]}
+
+    @app.get("/tickers")
+    async def tickers():
+        await simulate()
+        return {"tickers": [ticker(market_id, price) for market_id, price in prices.items()]}
+
+    @app.get("/markets/{market_id}/ticker")
+    async def market_ticker(market_id: str):
+        await simulate()
+        market_id = market_id.upper()
+        price = prices.get(market_id)
+        if price is None:
+            raise HTTPException(status_code=404, detail="not found")
+        return {"ticker": ticker(market_id, price)}
+
+    @app.get("/markets/{market_id}/order_book")
+    async def order_book(market_id: str):
+        await simulate()
+        price = prices.get(market_id.upper())
+        if price is None:
+            raise HTTPException(status_code=404, detail="not found")
+        step = price * 0.0005
+        bids = [[f"{price - step * (i + 1):.2f}", f"{rng.uniform(0.01, 5):.8f}"] for i in range(depth)]
+        asks = [[f"{price + step * (i + 1):.2f}", f"{rng.uniform(0.01, 5):.8f}"] for i in range(depth)]
+        return {"order_book": {"bids": bids, "asks": asks}}
+
+    return app
+
+
+def main(argv: list[str] | None = None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Servidor Buda falso para benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--depth", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    app = create_fake_buda_app(args.latency, args.jitter, args.error_rate, args.depth)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# SUPUESTOS UTILIZADOS (driver de carga):
+# - Por defecto levanta dos subprocesos: el Buda falso y la API (uvicorn)
+#   apuntando a él vía BUDA_BASE_URL. Con --target se mide una API ya
+#   levantada (que debe estar configurada por fuera).
+# - Para cada endpoint × tamaño de portafolio × concurrencia se envían
+#   --requests requests y se reportan RPS, p50/p95/p99 y errores.
+# - El resultado se escribe como JSON para comparar entre releases.
+#
+# Uso: python -m benchmarks.load_test --sizes 1,3,6 --concurrency 1,10,50 \
+#          --requests 500 --latency 0.02 --output bench.json
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from config.constants import VALID_PAIRS
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+ENDPOINTS = ("/v1/portfolio/value", "/v1/portfolio/value/exact")
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Percentil `q` (0-100) por interpolación lineal sobre valores ordenados."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def build_portfolio(size: int, fiat: str = "CLP") -> dict:
+    bases = [base for base, quotes in VALID_PAIRS.items() if fiat in quotes][:size]
+    return {"portfolio": {base: 0.1 * (i + 1) for i, base in enumerate(bases)}, "fiat_currency": fiat}
+
+
+async def run_scenario(client: httpx.AsyncClient, path: str, payload: dict, concurrency: int, total: int) -> dict:
+    """Envía `total` POST a `path` con `concurrency` workers y resume latencias."""
+    latencies: list[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=payload)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "endpoint": path,
+        "portfolio_size": len(payload["portfolio"]),
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "rps": total / elapsed if elapsed else 0.0,
+        "mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+    }
+
+
+async def run_suite(
+    client: httpx.AsyncClient,
+    sizes: list[int],
+    concurrencies: list[int],
+    total: int,
+    warmup: int = 0,
+    endpoints: tuple[str, ...] = ENDPOINTS,
+) -> list[dict]:
+    results = []
+    for path in endpoints:
+        for size in sizes:
+            payload = build_portfolio(size)
+            if warmup:
+                await run_scenario(client, path, payload, min(warmup, 10), warmup)
+            for concurrency in concurrencies:
+                results.append(await run_scenario(client, path, payload, concurrency, total))
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, timeout: float = 20.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} no respondió en {timeout}s")
+
+
+def _spawn(args: list[str], env: dict | None = None) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], cwd=PROJECT_ROOT, env=env)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de la API de valorización.")
+    parser.add_argument("--target", help="URL de una API ya levantada (no levanta subprocesos)")
+    parser.add_argument("--sizes", default="1,3,6", help="Tamaños de portafolio separados por coma")
+    parser.add_argument("--concurrency", default="1,10,50", help="Niveles de concurrencia separados por coma")
+    parser.add_argument("--requests", type=int, default=500, help="Requests por escenario")
+    parser.add_argument("--warmup", type=int, default=20, help="Requests de calentamiento por tamaño")
+    parser.add_argument("--latency", type=float, default=0.02, help="Latencia del Buda falso (s)")
+    parser.add_argument("--jitter", type=float, default=0.005, help="Jitter del Buda falso (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tasa de 503 del Buda falso")
+    parser.add_argument("--depth", type=int, default=50, help="Niveles por lado del order book falso")
+    parser.add_argument("--output", default="bench_output.json", help="Archivo JSON de resultados")
+    args = parser.parse_args(argv)
+
+    processes: list[subprocess.Popen] = []
+    target = args.target
+    try:
+        if target is None:
+            fake_port, app_port = _free_port(), _free_port()
+            processes.append(_spawn([
+                "-m", "benchmarks.fake_buda", "--port", str(fake_port),
+                "--latency", str(args.latency), "--jitter", str(args.jitter),
+                "--error-rate", str(args.error_rate), "--depth", str(args.depth),
+            ]))
+            env = {**os.environ, "BUDA_BASE_URL": f"http://127.0.0.1:{fake_port}"}
+            processes.append(_spawn(
+                ["-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"], env
+            ))
+            target = f"http://127.0.0.1:{app_port}"
+            _wait_ready(f"http://127.0.0.1:{fake_port}/tickers")
+        _wait_ready(f"{target}/")
+
+        async def run() -> list[dict]:
+            limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+            async with httpx.AsyncClient(base_url=target, limits=limits, timeout=30.0) as client:
+                return await run_suite(
+                    client,
+                    [int(v) for v in args.sizes.split(",")],
+                    [int(v) for v in args.concurrency.split(",")],
+                    args.requests,
+                    args.warmup,
+                )
+
+        results = asyncio.run(run())
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": args.target or "local",
+            "fake_buda": None if args.target else {
+                "latency": args.latency,
+                "jitter": args.jitter,
+                "error_rate": args.error_rate,
+                "depth": args.depth,
+            },
+        },
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    for row in results:
+        print(
+            f"{row['endpoint']:<28} size={row['portfolio_size']:<2} c={row['concurrency']:<4} "
+            f"rps={row['rps']:8.1f} p50={row['p50_ms']:7.2f}ms p95={row['p95_ms']:7.2f}ms "
+            f"p99={row['p99_ms']:7.2f}ms errors={row['errors']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
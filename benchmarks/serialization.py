@@ -0,0 +1,103 @@
+# SUPUESTOS UTILIZADOS (microbenchmark de serialización):
+# - Corre en proceso (ASGITransport) con un snapshot de tickers precargado:
+#   no hay red ni Buda, solo se mide el costo de FastAPI + validación de
+#   salida + serialización de la respuesta.
+# - Compara FAST_RESPONSES apagado y encendido sobre el mismo payload y
+#   reporta µs por request y el ahorro.
+#
+# Uso: python -m benchmarks.serialization --items 1,100,1000 --requests 200
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+import main
+from benchmarks.fake_buda import market_prices
+from benchmarks.load_test import build_portfolio
+
+
+def preload_snapshot() -> None:
+    main.service.client.cache.set({
+        "tickers": [
+            {"market_id": market_id, "last_price": [f"{price:.2f}", market_id.split("-")[1]]}
+            for market_id, price in market_prices().items()
+        ]
+    })
+
+
+def build_batch(items: int) -> dict:
+    return {"items": [build_portfolio(1 + i % 6) for i in range(items)]}
+
+
+async def measure(client: httpx.AsyncClient, path: str, payload: dict, requests: int) -> tuple[float, bytes]:
+    """Segundos promedio por request y el último cuerpo recibido."""
+    body = b""
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = await client.post(path, json=payload)
+        response.raise_for_status()
+        body = response.content
+    return (time.perf_counter() - start) / requests, body
+
+
+async def compare(path: str, payload: dict, requests: int) -> dict:
+    """Mide `path` con y sin FAST_RESPONSES; verifica que el JSON sea el mismo."""
+    previous = main.FAST_RESPONSES
+    results = {False: 0.0, True: 0.0}
+    bodies = {}
+    # Se alternan los modos por tandas para que el ruido (GC, calentamiento)
+    # afecte a ambos por igual.
+    rounds = max(1, requests // 50)
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://api") as client:
+            for fast in (False, True):
+                main.FAST_RESPONSES = fast
+                await measure(client, path, payload, min(requests, 10))
+            for _ in range(rounds):
+                for fast in (False, True):
+                    main.FAST_RESPONSES = fast
+                    elapsed, bodies[fast] = await measure(client, path, payload, max(1, requests // rounds))
+                    results[fast] += elapsed / rounds
+    finally:
+        main.FAST_RESPONSES = previous
+    if json.loads(bodies[False]) != json.loads(bodies[True]):
+        raise AssertionError(f"La ruta rápida cambió la respuesta de {path}")
+    return {
+        "endpoint": path,
+        "items": len(payload.get("items", [payload])),
+        "requests": requests,
+        "default_us": 1e6 * results[False],
+        "fast_us": 1e6 * results[True],
+        "saved_us": 1e6 * (results[False] - results[True]),
+        "speedup": results[False] / results[True] if results[True] else 0.0,
+    }
+
+
+async def run(sizes: list[int], requests: int) -> list[dict]:
+    preload_snapshot()
+    rows = [await compare("/v1/portfolio/value", build_portfolio(6), requests)]
+    for size in sizes:
+        rows.append(await compare("/v1/portfolio/value/batch", build_batch(size), requests))
+    return rows
+
+
+def main_cli(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmark de la ruta rápida de serialización.")
+    parser.add_argument("--items", default="1,100,1000", help="Tamaños de lote separados por coma")
+    parser.add_argument("--requests", type=int, default=200, help="Requests por medición")
+    args = parser.parse_args(argv)
+
+    rows = asyncio.run(run([int(v) for v in args.items.split(",")], args.requests))
+    print(f"serializador rápido: {'orjson' if main.orjson is not None else 'pydantic_core'}")
+    for row in rows:
+        print(
+            f"{row['endpoint']:<26} items={row['items']:<5} default={row['default_us']:9.1f}µs "
+            f"fast={row['fast_us']:9.1f}µs ahorro={row['saved_us']:8.1f}µs x{row['speedup']:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
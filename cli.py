@@ -0,0 +1,63 @@
+# SUPUESTOS UTILIZADOS (CLI de valorización masiva):
+# - Lee un archivo JSONL (un `PortfolioRequest` por línea, o `-` para stdin)
+#   y escribe un resultado NDJSON por línea, en el mismo orden.
+# - Procesa línea a línea con memoria acotada; todas las líneas usan un mismo
+#   snapshot de precios y, con --exact, cada order book se descarga una vez.
+#
+# Uso: python cli.py portafolios.jsonl [-o resultados.jsonl] [--exact]
+
+import argparse
+import asyncio
+import json
+import sys
+from typing import AsyncIterator, TextIO
+
+from services.portfolio_service import PortfolioService
+
+
+async def _read_lines(source: TextIO) -> AsyncIterator[str]:
+    for line in source:
+        if line.strip():
+            yield line
+
+
+async def run(source: TextIO, output: TextIO, exact: bool = False) -> int:
+    """Valoriza `source` y escribe los resultados en `output`.
+
+    Returns:
+        int: Cantidad de líneas con error.
+    """
+    service = PortfolioService()
+    await service.client.start()
+    errors = 0
+    try:
+        async for result in service.stream_values(_read_lines(source), exact=exact):
+            if "error" in result:
+                errors += 1
+            output.write(json.dumps(result) + "\n")
+    finally:
+        await service.client.aclose()
+    return errors
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Valoriza un archivo JSONL de portafolios.")
+    parser.add_argument("input", help="Archivo JSONL de entrada ('-' para stdin)")
+    parser.add_argument("-o", "--output", help="Archivo NDJSON de salida (stdout por defecto)")
+    parser.add_argument("--exact", action="store_true", help="Valorizar llenando contra los order books")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    output = sys.stdout if args.output is None else open(args.output, "w", encoding="utf-8")
+    try:
+        errors = asyncio.run(run(source, output, exact=args.exact))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
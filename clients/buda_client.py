@@ -2,63 +2,570 @@
 # - Se descarga el listado completo de /tickers y se cachea durante 30s.
 # - Esta aproximación es válida para la prueba; en producción preferiría
 #   consultas por par y/o un cache centralizado compartido entre réplicas.
-# - La caché es en memoria y por proceso; no cubre casos multi-replica.
-# - Se normalizan errores httpx a BudaAPIError con status_code apropiado.
+# - Por defecto la caché es en memoria y por proceso. Con SNAPSHOT_STORE=shm
+#   o redis el snapshot se comparte entre workers/réplicas (ver
+#   clients/snapshot_store.py) y lleva una versión común.
+# - Se normalizan errores httpx a BudaAPIError con status_code apropiado
+#   (mismo manejo para /tickers y order books, ver `_get_json`).
 # - Timeout 5s y manejo de errores (503/504/500) para comunicarse con Buda.
+# - El `httpx.AsyncClient` se crea y cierra en el lifespan de FastAPI (pool y
+#   timeouts configurables); si se usa sin lifespan se crea al primer uso.
+# - Cada refresco de /tickers se indexa una sola vez en un `TickerSnapshot`
+#   inmutable (market_id -> precios ya parseados); las consultas son O(1).
+# - El refresco es single-flight: con la caché expirada solo una corrutina
+#   llama a /tickers y el resto espera ese mismo resultado (o error).
+# - Con el refresco en segundo plano activo (ver clients/refresher.py) se
+#   acepta un snapshot hasta `max_staleness` segundos; pasado ese límite se
+#   vuelve al refresco bloqueante.
+# - Las llamadas HTTP a Buda pasan por un semáforo por cliente
+#   (BUDA_MAX_CONCURRENCY) para que un portafolio grande no sature la API.
+# - Los order books se cachean por mercado con TTL corto y LRU acotado; las
+#   descargas concurrentes del mismo mercado se comparten (single-flight).
+#   Se guardan ya parseados como `OrderBookDepth` (ver clients/order_book.py).
+# - Ante fallos de disponibilidad (5xx, 429, timeouts) se reintenta con
+#   backoff y jitter dentro de BUDA_REQUEST_BUDGET; un circuit breaker (ver
+#   clients/circuit_breaker.py) corta las llamadas mientras Buda está caído.
+#   En ese caso se sirve el último snapshot/libro bueno y la request queda
+#   marcada como `stale` (ver `track_stale_reads`).
+# - Se registra qué pares se consultan: con pocos mercados calientes el
+#   snapshot se refresca con /markets/{id}/ticker (snapshot parcial) en vez de
+#   /tickers completo, según el costo observado (ver clients/fetch_planner.py).
+#   Si un snapshot parcial no cubre un par pedido se descarga /tickers.
+# - Los pares sin mercado directo se valorizan por rutas con monedas
+#   intermedias (ver clients/market_graph.py); la tabla de rutas se recalcula
+#   con cada snapshot nuevo a partir de /markets y de los tickers.
+# - /tickers trae el precio del mejor bid (`max_bid`) pero no su tamaño. El
+#   tamaño del mejor nivel se recuerda de cada order book descargado; si el
+#   `max_bid` vigente sigue en ese precio y la observación tiene menos de
+#   TOP_OF_BOOK_MAX_AGE segundos, se asume que el nivel sigue cubriendo ese
+#   tamaño (ver `top_of_book_price`).
 
+import asyncio
+import dataclasses
+import hashlib
 import httpx
+import logging
+import random
 import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Iterable, Mapping
 
-from config.constants import BASE_URL, VALID_PAIRS
+from clients.circuit_breaker import CircuitBreaker
+from clients.fetch_planner import BULK, PER_MARKET, FetchPlanner
+from clients.local_books import OrderBookFeed
+from clients.market_graph import RouteTable
+from clients.order_book import EPSILON, OrderBookDepth
+from clients.singleflight import SingleFlight
+from clients.upstream_scheduler import QUEUE_FULL, UpstreamOverloaded, UpstreamScheduler
+from clients.snapshot_store import InProcessSnapshotStore, SnapshotStore, SnapshotStoreError
+from config.constants import (
+    BASE_URL,
+    BUDA_BREAKER_FAILURE_THRESHOLD,
+    BUDA_BREAKER_RESET_TIMEOUT,
+    BUDA_CONNECT_TIMEOUT,
+    BUDA_HTTP2,
+    BUDA_KEEPALIVE_EXPIRY,
+    BUDA_LAST_KNOWN_GOOD_MAX_AGE,
+    BUDA_MAX_CONCURRENCY,
+    BUDA_QUEUE_MAX,
+    BUDA_QUEUE_MAX_WAIT,
+    BUDA_RATE_BURST,
+    BUDA_RATE_LIMIT,
+    BUDA_POOL_MAX_CONNECTIONS,
+    BUDA_POOL_MAX_KEEPALIVE,
+    BUDA_READ_TIMEOUT,
+    BUDA_REQUEST_BUDGET,
+    BUDA_RETRY_ATTEMPTS,
+    BUDA_RETRY_BASE_DELAY,
+    BUDA_RETRY_MAX_DELAY,
+    MARKETS_CACHE_TTL,
+    TICKERS_FETCH_STRATEGY,
+    TICKERS_HOT_WINDOW,
+    TICKERS_PER_MARKET_MAX,
+    ORDER_BOOK_CACHE_MAX_LEVELS,
+    ORDER_BOOK_CACHE_MAX_MARKETS,
+    ORDER_BOOK_CACHE_TTL,
+    TOP_OF_BOOK_MAX_AGE,
+    SNAPSHOT_LEASE_TTL,
+    SNAPSHOT_POLL_INTERVAL,
+    VALID_PAIRS,
+)
+from monitoring.metrics import (
+    STALE_RESPONSES,
+    TICKERS_FETCHES,
+    TICKERS_CACHE_HIT,
+    TICKERS_CACHE_MISS,
+    TICKERS_REFRESHES,
+    UPSTREAM_ERRORS,
+    UPSTREAM_IN_FLIGHT,
+    UPSTREAM_SHED,
+    UPSTREAM_MARKET_TICKER_DURATION,
+    UPSTREAM_MARKETS_DURATION,
+    UPSTREAM_ORDER_BOOK_DURATION,
+    UPSTREAM_RETRIES,
+    UPSTREAM_TICKERS_DURATION,
+)
+from monitoring.profiling import phase
+
+logger = logging.getLogger(__name__)
+
+# Status que indican que Buda no está disponible (se reintentan y cuentan
+# para el circuit breaker); el resto son respuestas válidas de Buda.
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+# Monedas que se aceptan aunque todavía no se haya armado el grafo de rutas.
+STATIC_CURRENCIES = frozenset(VALID_PAIRS) | frozenset(q for quotes in VALID_PAIRS.values() for q in quotes)
+
+_stale_reads: ContextVar[list[str] | None] = ContextVar("buda_stale_reads", default=None)
+
+
+def track_stale_reads() -> list[str]:
+    """Empieza a registrar los datos servidos como `stale` en el contexto actual.
+
+    Devuelve la lista donde se anotan ("tickers" o el market_id del libro).
+    Las tareas hijas copian el contexto, así que comparten la misma lista.
+    """
+    reads: list[str] = []
+    _stale_reads.set(reads)
+    return reads
+
+
+def _mark_stale(kind: str, what: str) -> None:
+    STALE_RESPONSES.labels(kind).inc()
+    reads = _stale_reads.get()
+    if reads is not None:
+        reads.append(what)
+
+
+def _parse_amount(value) -> float | None:
+    """Parsea un campo monetario de Buda (`[monto, moneda]`) a float.
+
+    Devuelve None si el campo no viene o está vacío. Lanza ValueError si el
+    monto no es numérico.
+    """
+    if not value:
+        return None
+    return float(value[0])
+
+
+def _safe_amount(value) -> float | None:
+    try:
+        return _parse_amount(value)
+    except (ValueError, TypeError, IndexError):
+        return None
+
+
+@dataclass(frozen=True, slots=True)
+class TickerQuote:
+    """Precios ya parseados de un mercado dentro de un snapshot.
+
+    `last` es None cuando Buda envía un `last_price` que no se pudo parsear;
+    la consulta del precio falla recién al usarlo (igual que antes).
+    """
+
+    last: float | None
+    bid: float | None
+    ask: float | None
+    volume: float | None
+
+
+@dataclass(frozen=True, slots=True)
+class TickerSnapshot:
+    """Vista inmutable e indexada de un payload de `/tickers`.
+
+    `partial` indica que solo trae los mercados calientes (descarga por
+    mercado) y no todo el listado de Buda.
+    """
+
+    quotes: Mapping[str, TickerQuote]
+    version: int
+    fetched_at: float
+    partial: bool = False
+    # Hash del contenido de `quotes`: a diferencia de `version` (contador por
+    # proceso), significa lo mismo en todos los workers y tras reiniciar.
+    digest: str = dataclasses.field(default="", compare=False)
+
+    def __post_init__(self):
+        if not self.digest:
+            canonical = repr(sorted(
+                (market_id, quote.last, quote.bid, quote.ask, quote.volume)
+                for market_id, quote in self.quotes.items()
+            ))
+            object.__setattr__(self, "digest", hashlib.sha256(canonical.encode()).hexdigest())
+
+    @classmethod
+    def from_payload(cls, data: dict, version: int, fetched_at: float, partial: bool = False) -> "TickerSnapshot":
+        """Construye el índice market_id -> `TickerQuote` parseando una sola vez.
+
+        Los tickers sin `last_price` se omiten (el par se considera no
+        encontrado). Los campos secundarios inválidos se dejan en None.
+        """
+        quotes: dict[str, TickerQuote] = {}
+        for ticker in data.get('tickers', []):
+            market_id = ticker.get('market_id')
+            if not market_id or not ticker.get('last_price'):
+                continue
+            try:
+                last = _parse_amount(ticker.get('last_price'))
+            except (ValueError, TypeError, IndexError):
+                last = None
+            quotes[market_id] = TickerQuote(
+                last=last,
+                bid=_safe_amount(ticker.get('max_bid')),
+                ask=_safe_amount(ticker.get('min_ask')),
+                volume=_safe_amount(ticker.get('volume')),
+            )
+        return cls(quotes=MappingProxyType(quotes), version=version, fetched_at=fetched_at, partial=partial)
+
+    def to_document(self) -> dict:
+        """Documento JSON serializable para publicar en un `SnapshotStore`."""
+        return {
+            "version": self.version,
+            "fetched_at": self.fetched_at,
+            "partial": self.partial,
+            "quotes": {
+                market_id: [quote.last, quote.bid, quote.ask, quote.volume]
+                for market_id, quote in self.quotes.items()
+            },
+        }
+
+    @classmethod
+    def from_document(cls, document: dict) -> "TickerSnapshot":
+        quotes = {market_id: TickerQuote(*values) for market_id, values in document["quotes"].items()}
+        return cls(
+            quotes=MappingProxyType(quotes),
+            version=document["version"],
+            fetched_at=document["fetched_at"],
+            partial=document.get("partial", False),
+        )
+
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def last_price(self, market_id: str) -> float:
+        """Último precio de `market_id`.
+
+        Raises:
+            BudaAPIError: 500 si el precio no se pudo parsear; 404 si el par
+                no está en el snapshot.
+        """
+        quote = self.quotes.get(market_id)
+        if quote is None:
+            raise BudaAPIError(f"Par {market_id} no encontrado", status_code=404)
+        if quote.last is None:
+            raise BudaAPIError(f"Precio inválido para {market_id}", status_code=500)
+        return quote.last
 
 
 class TickersCache:
     CACHE_TTL = 30
     
-    def __init__(self):
-        self.data = None
-        self.timestamp = None
+    def __init__(self, store: SnapshotStore | None = None):
+        self.snapshot: TickerSnapshot | None = None
+        self.version = 0
+        self.store = store or InProcessSnapshotStore()
+        self._listeners: list[Callable[[TickerSnapshot | None, TickerSnapshot], None]] = []
     
-    def is_valid(self) -> bool:
-        if self.data is None or self.timestamp is None:
+    def is_valid(self, max_age: float | None = None) -> bool:
+        if self.snapshot is None:
             return False
-        elapsed = time.time() - self.timestamp
-        return elapsed < self.CACHE_TTL
+        return self.snapshot.age() < (self.CACHE_TTL if max_age is None else max_age)
     
-    def get(self):
-        if self.is_valid():
-            return self.data
+    def get(self, max_age: float | None = None) -> TickerSnapshot | None:
+        """Snapshot vigente, o None si no existe o supera `max_age` (TTL por defecto)."""
+        if self.is_valid(max_age):
+            return self.snapshot
         return None
     
-    def set(self, data):
-        self.data = data
-        self.timestamp = time.time()
+    def set(self, data: dict, partial: bool = False) -> TickerSnapshot:
+        """Indexa el payload de `/tickers` y lo publica como snapshot vigente."""
+        self.version += 1
+        return self._replace(TickerSnapshot.from_payload(data, self.version, time.time(), partial))
+    
+    async def sync(self) -> TickerSnapshot | None:
+        """Adopta el snapshot publicado en el backend compartido si es más nuevo.
+
+        Raises:
+            SnapshotStoreError: Si el backend compartido no responde.
+        """
+        if self.store.shared:
+            known_version = 0 if self.snapshot is None else self.snapshot.version
+            document = await self.store.load(known_version)
+            if document is not None:
+                self._replace(TickerSnapshot.from_document(document))
+        return self.snapshot
+
+    async def publish(self, data: dict) -> TickerSnapshot:
+        """Indexa el payload y lo publica en el backend (que asigna la versión).
+
+        Raises:
+            SnapshotStoreError: Si el backend compartido no responde.
+        """
+        if not self.store.shared:
+            return self.set(data)
+        snapshot = TickerSnapshot.from_payload(data, 0, time.time())
+        version = await self.store.publish(snapshot.to_document())
+        return self._replace(dataclasses.replace(snapshot, version=version))
+    
+    def add_listener(self, listener: Callable[[TickerSnapshot | None, TickerSnapshot], None]) -> None:
+        """Registra `listener(anterior, nuevo)`, invocado en cada snapshot nuevo."""
+        self._listeners.append(listener)
+
+    def _replace(self, snapshot: TickerSnapshot) -> TickerSnapshot:
+        previous, self.snapshot = self.snapshot, snapshot
+        TICKERS_REFRESHES.inc()
+        for listener in self._listeners:
+            try:
+                listener(previous, snapshot)
+            except Exception:
+                logger.exception("Listener de snapshot falló")
+        return snapshot
     
     def clear(self):
-        self.data = None
-        self.timestamp = None
+        self.snapshot = None
+
+
+class OrderBookCache:
+    """Caché por mercado de order books con TTL y desalojo LRU.
+
+    El tamaño se acota por cantidad de mercados y por total de niveles
+    retenidos; se desalojan primero los mercados usados hace más tiempo.
+    """
+
+    def __init__(self, ttl: float, max_markets: int, max_levels: int):
+        self.ttl = ttl
+        self.max_markets = max_markets
+        self.max_levels = max_levels
+        self._entries: OrderedDict[str, tuple[float, OrderBookDepth, int]] = OrderedDict()
+        self.levels = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, market_id: str) -> OrderBookDepth | None:
+        """Como `get`, pero sin contar aciertos/fallos ni tocar el orden LRU."""
+        entry = self._entries.get(market_id)
+        if entry is None or time.time() - entry[0] >= self.ttl:
+            return None
+        return entry[1]
+
+    def get(self, market_id: str) -> OrderBookDepth | None:
+        # Las entradas expiradas se conservan (hasta que el LRU las desaloje)
+        # como último libro bueno por si Buda no responde.
+        entry = self._entries.get(market_id)
+        if entry is not None and time.time() - entry[0] < self.ttl:
+            self._entries.move_to_end(market_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def get_stale(self, market_id: str, max_age: float) -> OrderBookDepth | None:
+        """Libro guardado aunque haya expirado, si tiene menos de `max_age` segundos."""
+        entry = self._entries.get(market_id)
+        if entry is None or time.time() - entry[0] >= max_age:
+            return None
+        return entry[1]
+
+    def set(self, market_id: str, order_book: OrderBookDepth) -> None:
+        if market_id in self._entries:
+            self._remove(market_id)
+        levels = order_book.levels
+        self._entries[market_id] = (time.time(), order_book, levels)
+        self.levels += levels
+        # Siempre se conserva al menos el libro recién insertado.
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_markets or self.levels > self.max_levels
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.levels = 0
+
+    def stats(self) -> dict:
+        return {
+            "markets": len(self._entries),
+            "levels": self.levels,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, market_id: str) -> None:
+        _, _, levels = self._entries.pop(market_id)
+        self.levels -= levels
 
 
 class BudaAPIError(Exception):
-    def __init__(self, message: str, status_code: int | None = None):
+    def __init__(self, message: str, status_code: int | None = None, retry_after: float | None = None):
         self.message = message
         self.status_code = status_code
+        # Segundos sugeridos antes de reintentar (header Retry-After).
+        self.retry_after = retry_after
         super().__init__(f"Buda API Error ({status_code}): {message}")
 
 class BudaClient:
-    def __init__(self):
-        self.client = httpx.AsyncClient(base_url=BASE_URL, timeout=5.0)
-        self.cache = TickersCache()
+    def __init__(self, base_url: str = BASE_URL, store: SnapshotStore | None = None):
+        self.base_url = base_url
+        self._http: httpx.AsyncClient | None = None
+        self.cache = TickersCache(store)
+        self._flights = SingleFlight()
+        # Edad máxima aceptada para servir desde memoria; la ajusta el
+        # refresco en segundo plano mientras está activo (None = CACHE_TTL).
+        self.max_staleness: float | None = None
+        self._upstream_limit = asyncio.Semaphore(BUDA_MAX_CONCURRENCY)
+        self.order_books = OrderBookCache(
+            ttl=ORDER_BOOK_CACHE_TTL,
+            max_markets=ORDER_BOOK_CACHE_MAX_MARKETS,
+            max_levels=ORDER_BOOK_CACHE_MAX_LEVELS,
+        )
+        self.breaker = CircuitBreaker(BUDA_BREAKER_FAILURE_THRESHOLD, BUDA_BREAKER_RESET_TIMEOUT)
+        # Mejor bid (precio, tamaño, instante) del último order book de cada mercado.
+        self._top_levels: dict[str, tuple[float, float, float]] = {}
+        # Order books locales por feed push (ver `start_order_book_feed`).
+        self.local_books: OrderBookFeed | None = None
+        self.scheduler = UpstreamScheduler(BUDA_RATE_LIMIT, BUDA_RATE_BURST, BUDA_QUEUE_MAX, BUDA_QUEUE_MAX_WAIT)
+        # Grafo de mercados: listado de /markets (ver `load_markets`) y tabla
+        # de rutas del último snapshot, recalculada en cada refresco.
+        self.markets: frozenset[str] = frozenset()
+        self.markets_loaded_at: float | None = None
+        self._markets_checked_at: float | None = None
+        self._routes: RouteTable | None = None
+        self.cache.add_listener(self._rebuild_routes)
+        self.planner = FetchPlanner(
+            TICKERS_FETCH_STRATEGY, TICKERS_HOT_WINDOW, TICKERS_PER_MARKET_MAX, BUDA_MAX_CONCURRENCY
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Cliente HTTP hacia Buda; se crea al primer uso si no se llamó `start`."""
+        if self._http is None:
+            self._http = self._build_http_client()
+        return self._http
+
+    def _build_http_client(self) -> httpx.AsyncClient:
+        http2 = BUDA_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("BUDA_HTTP2 activo pero falta el paquete 'h2'; se usa HTTP/1.1")
+                http2 = False
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(BUDA_READ_TIMEOUT, connect=BUDA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=BUDA_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=BUDA_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=BUDA_KEEPALIVE_EXPIRY,
+            ),
+            http2=http2,
+        )
+
+    async def start(self) -> None:
+        """Crea el pool de conexiones (se llama desde el lifespan)."""
+        if self._http is None:
+            self._http = self._build_http_client()
+
+    async def aclose(self) -> None:
+        """Cierra el pool de conexiones."""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def warm_up(self) -> None:
+        """Abre conexiones hacia Buda y precarga el snapshot de tickers.
+
+        Un fallo no impide arrancar: se registra y las primeras requests
+        harán el fetch como siempre.
+        """
+        try:
+            await self.refresh_snapshot()
+        except BudaAPIError as e:
+            logger.warning("Warm-up contra Buda falló: %s", e)
 
     # caso valor más exacto
-    async def calculate_total_value_exact(self, base_currency: str, quote_currency: str) -> dict:
-        """Devuelve el `order_book` del mercado sin procesarlo.
+    async def calculate_total_value_exact(self, base_currency: str, quote_currency: str) -> OrderBookDepth:
+        """Devuelve el `order_book` del mercado parseado como `OrderBookDepth`.
 
-        Se delega en `_fetch_order_book` para obtener el payload y se retorna
-        el diccionario `order_book` tal cual (contiene `asks` y `bids`).
+        Con el feed de order books activo se usa el libro local, sin llamar a
+        Buda. Si no, se sirve desde `OrderBookCache` si hay una copia
+        vigente; si no, se delega en `_fetch_order_book` (una sola descarga
+        por mercado aunque haya requests concurrentes) y se indexa una sola
+        vez con sumas prefijas de `bids` y `asks`.
         """
-        order_book = await self._fetch_order_book(f"{base_currency.upper()}-{quote_currency.upper()}")
+        market_id = f"{base_currency.upper()}-{quote_currency.upper()}"
+        with phase("cache"):
+            order_book = None if self.local_books is None else self.local_books.depth(market_id)
+            if order_book is None:
+                order_book = self.order_books.get(market_id)
+        if order_book is not None:
+            return order_book
+        try:
+            with phase("upstream"):
+                return await self._flights.do(("order_book", market_id), lambda: self._load_order_book(market_id))
+        except BudaAPIError as e:
+            if e.status_code not in RETRYABLE_STATUS:
+                raise
+            order_book = self.order_books.get_stale(market_id, BUDA_LAST_KNOWN_GOOD_MAX_AGE)
+            if order_book is None:
+                raise
+            logger.warning("Buda no disponible, se sirve el último order book de %s: %s", market_id, e)
+            _mark_stale("order_book", market_id)
+            return order_book
+
+    async def _load_order_book(self, market_id: str) -> OrderBookDepth:
+        order_book = self.order_books.peek(market_id)
+        if order_book is not None:
+            return order_book
+        order_book = OrderBookDepth.from_payload(await self._fetch_order_book(market_id))
+        self.order_books.set(market_id, order_book)
+        if order_book.bids.prices:
+            self._top_levels[market_id] = (order_book.bids.prices[0], order_book.bids.sizes[0], time.monotonic())
         return order_book
+
+    def book_source(self, market_id: str) -> str:
+        """De dónde saldría hoy el order book de `market_id`, sin consultar a Buda.
+
+        "local_book" (feed push), "cached_book" (caché vigente) u
+        "order_book" (requiere descarga).
+        """
+        if self.local_books is not None and self.local_books.depth(market_id) is not None:
+            return "local_book"
+        if self.order_books.peek(market_id) is not None:
+            return "cached_book"
+        return "order_book"
+
+    def top_of_book_price(self, market_id: str, quantity: float) -> float | None:
+        """`max_bid` vigente si el mejor nivel cubre `quantity`; None si no se sabe.
+
+        Solo usa memoria: el snapshot de tickers vigente y el tamaño del mejor
+        bid del último order book de `market_id`, que debe tener el mismo
+        precio y menos de TOP_OF_BOOK_MAX_AGE segundos.
+        """
+        level = self._top_levels.get(market_id)
+        snapshot = self.cache.get(self.max_staleness)
+        if level is None or snapshot is None:
+            return None
+        quote = snapshot.quotes.get(market_id)
+        price, size, seen_at = level
+        if (
+            quote is None
+            or quote.bid != price
+            or time.monotonic() - seen_at >= TOP_OF_BOOK_MAX_AGE
+            or float(quantity) - size > EPSILON
+        ):
+            return None
+        return price
     
     async def get_current_price(self, base_currency: str, quote_currency: str) -> float:
         """Obtiene el último precio para un par de mercado.
@@ -78,33 +585,266 @@ class BudaClient:
             BudaAPIError: Si el par no existe o si hay errores de red/HTTP al
                 obtener los datos. La excepción incluye `status_code`.
         """
+        snapshot = await self.get_snapshot([(base_currency, quote_currency)])
+        return self.price_from_snapshot(snapshot, base_currency, quote_currency)
+
+    def price_from_snapshot(self, snapshot: TickerSnapshot, base_currency: str, quote_currency: str) -> float:
+        """Precio de `base_currency` en `quote_currency` según `snapshot` (sin red).
+
+        Si Buda no lista el mercado directo se usa la tasa precalculada de la
+        mejor ruta con monedas intermedias (ver `route_table`).
+
+        Raises:
+            BudaAPIError: Igual que `_extract_price_from_tickers`; 404 si
+                tampoco hay ruta con precio.
+        """
+        base_upper = base_currency.upper()
+        quote_upper = quote_currency.upper()
+        market_id = f"{base_upper}-{quote_upper}"
+        if market_id in snapshot.quotes:
+            return self._extract_price_from_tickers(snapshot, market_id)
+        if base_upper == quote_upper:
+            return 1.0
+        route = self.route_table(snapshot).priced_route(base_upper, quote_upper)
+        if route is None:
+            raise BudaAPIError(f"No hay mercado ni ruta de conversión para {market_id}", status_code=404)
+        return route.rate
+
+    def route_markets(self, snapshot: TickerSnapshot, base_currency: str, quote_currency: str) -> list[str]:
+        """Mercados cuyo precio determina el valor de `base_currency` en `quote_currency`."""
         base_upper = base_currency.upper()
         quote_upper = quote_currency.upper()
         market_id = f"{base_upper}-{quote_upper}"
-        
-        tickers_data = self.cache.get()
-        
-        if tickers_data is None:
+        if market_id in snapshot.quotes:
+            return [market_id]
+        route = self.route_table(snapshot).priced_route(base_upper, quote_upper)
+        return [market_id] if route is None else route.markets
+
+    def route_table(self, snapshot: TickerSnapshot) -> RouteTable:
+        """Tabla de rutas de `snapshot` (normalmente ya calculada por el listener)."""
+        routes = self._routes
+        if routes is None or routes.version != snapshot.version:
+            routes = self._build_routes(snapshot)
+            if self.cache.snapshot is snapshot:
+                self._routes = routes
+        return routes
+
+    def known_currencies(self) -> frozenset[str]:
+        """Monedas que aparecen en algún mercado conocido."""
+        if self._routes is None:
+            return STATIC_CURRENCIES
+        return STATIC_CURRENCIES | self._routes.currencies
+
+    def _build_routes(self, snapshot: TickerSnapshot) -> RouteTable:
+        prices = {market_id: quote.last for market_id, quote in snapshot.quotes.items()}
+        return RouteTable.build(self.markets.union(snapshot.quotes), prices, snapshot.version)
+
+    def _rebuild_routes(self, previous: TickerSnapshot | None, snapshot: TickerSnapshot) -> None:
+        self._routes = self._build_routes(snapshot)
+
+    def markets_expired(self) -> bool:
+        """True si el último intento de `load_markets` tiene más de MARKETS_CACHE_TTL."""
+        return self._markets_checked_at is not None and time.time() - self._markets_checked_at >= MARKETS_CACHE_TTL
+
+    async def load_markets(self) -> None:
+        """Descarga el listado de /markets para el grafo de rutas.
+
+        Un fallo no es fatal: se conserva el listado anterior y el grafo se
+        arma solo con los mercados del snapshot de tickers.
+        """
+        self._markets_checked_at = time.time()
+        try:
+            data = await self._get_json("/markets", "markets", "markets", UPSTREAM_MARKETS_DURATION)
+        except BudaAPIError as e:
+            logger.warning("No se pudo descargar /markets: %s", e)
+            return
+        self.markets = frozenset(
+            market["id"].upper() for market in data["markets"] if isinstance(market, dict) and market.get("id")
+        )
+        self.markets_loaded_at = time.time()
+        if self.cache.snapshot is not None:
+            self._routes = self._build_routes(self.cache.snapshot)
+
+    async def get_snapshot(self, pairs: Iterable[tuple[str, str]] | None = None) -> TickerSnapshot:
+        """Devuelve el snapshot vigente de `/tickers`, refrescándolo si expiró.
+
+        El refresco es single-flight: si varias corrutinas encuentran la caché
+        expirada al mismo tiempo, solo una llama a `_fetch_tickers` y las
+        demás esperan ese mismo resultado o reciben la misma excepción.
+
+        `pairs` son los pares (base, quote) que el llamador va a valorizar:
+        se registran como demanda (solo los de monedas conocidas) y, si el
+        snapshot es parcial y no los cubre, se descarga `/tickers` completo.
+        Sin `pairs` se asume que se necesitan todos los mercados.
+
+        Si Buda no está disponible se devuelve el último snapshot bueno
+        (hasta BUDA_LAST_KNOWN_GOOD_MAX_AGE) y se marca la lectura como stale.
+
+        Raises:
+            BudaAPIError: Propaga los errores de `_fetch_tickers` cuando no
+                hay un snapshot anterior utilizable.
+        """
+        if pairs is not None:
+            pairs = [(base.upper(), quote.upper()) for base, quote in pairs]
+            known = self.known_currencies()
+            self.planner.record((base, quote) for base, quote in pairs if base in known and quote in known)
+        with phase("cache"):
+            snapshot = self.cache.get(self.max_staleness)
+            hit = snapshot is not None and self._covers(snapshot, pairs)
+        if hit:
+            TICKERS_CACHE_HIT.inc()
+            return snapshot
+        TICKERS_CACHE_MISS.inc()
+        try:
+            with phase("upstream"):
+                snapshot = await self._flights.do("tickers", lambda: self._refresh_snapshot(self.max_staleness))
+                if not self._covers(snapshot, pairs):
+                    snapshot = await self._flights.do(
+                        "tickers_bulk", lambda: self._refresh_snapshot(self.max_staleness, bulk=True)
+                    )
+            return snapshot
+        except BudaAPIError as e:
+            snapshot = self.cache.snapshot
+            if (
+                e.status_code not in RETRYABLE_STATUS
+                or snapshot is None
+                or snapshot.age() >= BUDA_LAST_KNOWN_GOOD_MAX_AGE
+            ):
+                raise
+            logger.warning("Buda no disponible, se sirve el snapshot v%s (%.0fs): %s", snapshot.version, snapshot.age(), e)
+            _mark_stale("tickers", "tickers")
+            return snapshot
+
+    async def refresh_snapshot(self, max_age: float = 0.0) -> TickerSnapshot:
+        """Fuerza un refresco de `/tickers` aunque el snapshot siga vigente.
+
+        Comparte el single-flight con `get_snapshot`, por lo que nunca hay más
+        de una descarga de `/tickers` en curso por proceso. Si ya hay un
+        snapshot con menos de `max_age` segundos (p. ej. publicado por otro
+        worker), se usa ese en lugar de descargar.
+        """
+        return await self._flights.do("tickers", lambda: self._refresh_snapshot(max_age))
+
+    def _covers(self, snapshot: TickerSnapshot, pairs: list[tuple[str, str]] | None) -> bool:
+        """True si `snapshot` permite valorizar todos los `pairs`."""
+        if not snapshot.partial:
+            return True
+        if pairs is None:
+            return False
+        routes = self.route_table(snapshot)
+        return all(
+            base == quote or f"{base}-{quote}" in snapshot.quotes or routes.priced_route(base, quote) is not None
+            for base, quote in pairs
+        )
+
+    async def _refresh_snapshot(self, max_age: float | None = None, bulk: bool = False) -> TickerSnapshot:
+        # Otra corrutina pudo completar el refresco justo antes de que esta
+        # tarea arrancara.
+        snapshot = self.cache.get(max_age)
+        if snapshot is not None and not (bulk and snapshot.partial):
+            return snapshot
+        if not self.cache.store.shared:
+            markets = None if bulk else self._plan_markets()
+            if markets:
+                try:
+                    tickers = await asyncio.gather(*(self._fetch_market_ticker(m) for m in markets))
+                except BudaAPIError as e:
+                    logger.info("Refresco por mercado falló, se descarga /tickers: %s", e)
+                else:
+                    TICKERS_FETCHES.labels(PER_MARKET).inc()
+                    return self.cache.set({"tickers": tickers}, partial=True)
             tickers_data = await self._fetch_tickers()
-            self.cache.set(tickers_data)
-        else:
-            pass
-        
-        return self._extract_price_from_tickers(tickers_data, market_id)
+            return self.cache.set(tickers_data)
+        return await self._refresh_shared(max_age)
+
+    def _plan_markets(self) -> list[str] | None:
+        """Mercados a refrescar uno a uno, o None si conviene /tickers."""
+        snapshot = self.cache.snapshot
+        pairs = self.planner.hot_pairs()
+        if snapshot is None or not pairs:
+            return None
+        markets: set[str] = set()
+        for base, quote in pairs:
+            if base != quote:
+                markets.update(self.route_markets(snapshot, base, quote))
+        # Un mercado desconocido (o un par sin ruta) se resuelve con /tickers.
+        if not markets.issubset(snapshot.quotes):
+            return None
+        if self.planner.choose(len(markets)) != PER_MARKET:
+            return None
+        return sorted(markets)
+
+    async def _refresh_shared(self, max_age: float | None) -> TickerSnapshot:
+        """Refresco coordinado entre workers a través del backend compartido.
+
+        Primero se adopta lo que otro worker haya publicado. Si sigue viejo,
+        solo quien obtiene el lease descarga y publica; el resto espera esa
+        publicación y, si no llega dentro del lease, descarga por su cuenta.
+        Si el backend falla se cae al comportamiento por proceso.
+        """
+        store = self.cache.store
+        try:
+            await self.cache.sync()
+            snapshot = self.cache.get(max_age)
+            if snapshot is not None:
+                return snapshot
+            known_version = 0 if self.cache.snapshot is None else self.cache.snapshot.version
+            leader = await store.acquire_lease(SNAPSHOT_LEASE_TTL)
+            if not leader:
+                snapshot = await self._wait_for_publish(known_version)
+                if snapshot is not None:
+                    return snapshot
+        except SnapshotStoreError as e:
+            logger.warning("Backend de snapshots no disponible, se usa caché local: %s", e)
+            leader = False
+
+        try:
+            tickers_data = await self._fetch_tickers()
+            try:
+                return await self.cache.publish(tickers_data)
+            except SnapshotStoreError as e:
+                logger.warning("No se pudo publicar el snapshot: %s", e)
+                return self.cache.set(tickers_data)
+        finally:
+            if leader:
+                try:
+                    await store.release_lease()
+                except SnapshotStoreError:
+                    pass
+
+    async def _wait_for_publish(self, known_version: int) -> TickerSnapshot | None:
+        deadline = time.time() + SNAPSHOT_LEASE_TTL
+        while time.time() < deadline:
+            await asyncio.sleep(SNAPSHOT_POLL_INTERVAL)
+            snapshot = await self.cache.sync()
+            if snapshot is not None and snapshot.version > known_version:
+                return snapshot
+        return None
     
+    def start_order_book_feed(self, url: str, markets: Iterable[str], max_silence: float) -> None:
+        """Mantiene order books locales de `markets` con el feed websocket `url`."""
+        self.local_books = OrderBookFeed(self._fetch_order_book, markets, max_silence)
+        if not self.local_books.start(url):
+            self.local_books = None
+
+    async def stop_order_book_feed(self) -> None:
+        if self.local_books is not None:
+            await self.local_books.stop()
+            self.local_books = None
+
     async def _fetch_order_book(self, market_id: str) -> dict:
-        try:
-            response = await self.client.get(f"/markets/{market_id}/order_book")
-            response.raise_for_status()
-            data = response.json()
-            if 'order_book' not in data:
-                raise BudaAPIError("Respuesta inválida", status_code=400)
-            return data['order_book']
-        except httpx.HTTPStatusError as e:
-            raise BudaAPIError(
-                f"Error API {e.response.status_code}",
-                status_code=e.response.status_code
-            ) from e
+        """Solicita el `order_book` de `market_id` desde Buda.
+
+        Returns:
+            dict: Diccionario `order_book` (con `bids` y `asks`).
+
+        Raises:
+            BudaAPIError: Igual que `_fetch_tickers`.
+        """
+        data = await self._get_json(
+            f"/markets/{market_id}/order_book", "order_book", "order_book", UPSTREAM_ORDER_BOOK_DURATION
+        )
+        return data['order_book']
             
     async def _fetch_tickers(self) -> dict:
         """Solicita y valida el payload de `/tickers` desde Buda.
@@ -120,13 +860,127 @@ class BudaClient:
             BudaAPIError: En caso de HTTP status no exitoso, timeout, problemas
                 de conexión o respuesta inválida/no JSON.
         """
+        data = await self._get_json(
+            "/tickers", "tickers", "tickers", UPSTREAM_TICKERS_DURATION,
+            observe=lambda nbytes, seconds: self.planner.observe(BULK, nbytes, seconds),
+        )
+        TICKERS_FETCHES.labels(BULK).inc()
+        self.planner.bulk_markets = len(data["tickers"])
+        return data
+
+    async def _fetch_market_ticker(self, market_id: str) -> dict:
+        """Ticker de un solo mercado (`/markets/{id}/ticker`) con el formato de `/tickers`.
+
+        Raises:
+            BudaAPIError: Igual que `_fetch_tickers`.
+        """
+        data = await self._get_json(
+            f"/markets/{market_id}/ticker", "ticker", "ticker", UPSTREAM_MARKET_TICKER_DURATION,
+            observe=lambda nbytes, seconds: self.planner.observe(PER_MARKET, nbytes, seconds),
+        )
+        return {**data["ticker"], "market_id": market_id}
+
+    async def _get_json(self, path: str, key: str, endpoint: str, duration, observe=None) -> dict:
+        """GET a Buda con el límite de concurrencia, métricas y errores normalizados.
+
+        Los fallos de disponibilidad (`RETRYABLE_STATUS`) se reintentan hasta
+        BUDA_RETRY_ATTEMPTS veces con backoff exponencial y jitter, sin pasar
+        de BUDA_REQUEST_BUDGET segundos en total. Con el circuit breaker
+        abierto falla de inmediato con 503 y `retry_after`. Cada intento
+        consume un token del presupuesto (`UpstreamScheduler`); si no alcanza
+        dentro de la espera máxima falla con 503 (cola llena) o 429, también
+        con `retry_after`.
+
+        Args:
+            path (str): Ruta relativa a `base_url`.
+            key (str): Clave que debe venir en el JSON de respuesta.
+            endpoint (str): Etiqueta del endpoint para las métricas.
+            duration: Hijo pre-ligado del histograma de latencia upstream.
+            observe: Callback opcional `(bytes, segundos)` con el tamaño del
+                payload y el tiempo hasta tenerlo parseado.
+        """
         try:
-            response = await self.client.get("/tickers")
+            return await self._get_json_with_retries(path, key, endpoint, duration, observe)
+        except BudaAPIError as e:
+            UPSTREAM_ERRORS.labels(endpoint, e.status_code).inc()
+            raise
+
+    async def _get_json_with_retries(self, path: str, key: str, endpoint: str, duration, observe=None) -> dict:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + BUDA_REQUEST_BUDGET
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise BudaAPIError(
+                    "API de Buda.com no disponible (circuit breaker abierto)",
+                    status_code=503,
+                    retry_after=self.breaker.retry_after(),
+                )
+            try:
+                await self.scheduler.acquire(max(0.0, deadline - loop.time()))
+            except UpstreamOverloaded as e:
+                self.breaker.release()
+                UPSTREAM_SHED.labels(e.reason).inc()
+                raise BudaAPIError(
+                    "Demasiadas solicitudes hacia Buda.com; reintentar más tarde",
+                    status_code=503 if e.reason == QUEUE_FULL else 429,
+                    retry_after=e.retry_after,
+                ) from None
+            except BaseException:
+                self.breaker.release()
+                raise
+            if deadline - loop.time() <= 0:
+                # El presupuesto se fue esperando turno: no es una falla de
+                # Buda y no cuenta para el circuit breaker.
+                self.breaker.release()
+                raise BudaAPIError(
+                    "Timeout al conectar con API de Buda.com (presupuesto agotado)", status_code=504
+                )
+            try:
+                data = await asyncio.wait_for(
+                    self._get_json_unmetered(path, key, duration, observe), max(0.0, deadline - loop.time())
+                )
+            except asyncio.TimeoutError:
+                error = BudaAPIError("Timeout al conectar con API de Buda.com", status_code=504)
+            except BudaAPIError as e:
+                error = e
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.record_success()
+                return data
+
+            if error.status_code not in RETRYABLE_STATUS:
+                # Buda respondió (p. ej. 404): el servicio está disponible.
+                self.breaker.record_success()
+                raise error
+            self.breaker.record_failure()
+            delay = min(BUDA_RETRY_MAX_DELAY, BUDA_RETRY_BASE_DELAY * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+            if attempt >= BUDA_RETRY_ATTEMPTS or loop.time() + delay >= deadline:
+                raise error
+            attempt += 1
+            UPSTREAM_RETRIES.labels(endpoint).inc()
+            await asyncio.sleep(delay)
+
+    async def _get_json_unmetered(self, path: str, key: str, duration, observe=None) -> dict:
+        try:
+            async with self._upstream_limit:
+                UPSTREAM_IN_FLIGHT.inc()
+                start = time.perf_counter()
+                try:
+                    response = await self.client.get(path)
+                finally:
+                    duration.observe(time.perf_counter() - start)
+                    UPSTREAM_IN_FLIGHT.dec()
             response.raise_for_status()
             data = response.json()
             
-            if 'tickers' not in data:
+            if key not in data:
                 raise BudaAPIError("Respuesta inválida", status_code=400)
+            if observe is not None:
+                observe(len(response.content), time.perf_counter() - start)
             
             return data
             
@@ -156,29 +1010,21 @@ class BudaClient:
                 status_code=500
             ) from e
     
-    def _extract_price_from_tickers(self, tickers_data: dict, market_id: str) -> float:
-        """Extrae el último precio para un `market_id` del payload de tickers.
+    def _extract_price_from_tickers(self, snapshot: TickerSnapshot, market_id: str) -> float:
+        """Obtiene el último precio para un `market_id` desde el snapshot.
 
-        Busca el ticker correspondiente y parsea `last_price` a float.
+        El payload ya viene indexado y parseado por `TickersCache.set`, por lo
+        que la búsqueda es O(1).
 
         Args:
-            tickers_data (dict): JSON con la lista `tickers`.
+            snapshot (TickerSnapshot): Snapshot vigente de `/tickers`.
             market_id (str): Identificador del mercado, p. ej. 'BTC-CLP'.
 
         Returns:
             float: Último precio registrado para el par.
 
         Raises:
-            BudaAPIError: 500 si el precio no se puede parsear; 404 si el par
-                no se encuentra en el payload.
-        """
-        for ticker in tickers_data.get('tickers', []):
-            if ticker.get('market_id') == market_id:
-                last_price = ticker.get('last_price')
-                if last_price and len(last_price) > 0:
-                    try:
-                        return float(last_price[0])
-                    except (ValueError, IndexError):
-                        raise BudaAPIError(f"Precio inválido para {market_id}", status_code=500)
-        
-        raise BudaAPIError(f"Par {market_id} no encontrado", status_code=404)
\ No newline at end of file
+            BudaAPIError: 500 si el precio no se pudo parsear; 404 si el par
+                no se encuentra en el snapshot.
+        """
+        return snapshot.last_price(market_id)
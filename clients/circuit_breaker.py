@@ -0,0 +1,70 @@
+# SUPUESTOS UTILIZADOS (circuit breaker):
+# - Un breaker por cliente (por proceso) para todas las llamadas a Buda.
+# - Solo cuentan como fallo los errores de disponibilidad (5xx, 429,
+#   timeouts, conexión); un 404 significa que Buda respondió bien.
+# - Tras `failure_threshold` fallos consecutivos se abre durante
+#   `reset_timeout` segundos; luego deja pasar una sola request de prueba
+#   (half-open) que decide si cierra o vuelve a abrir.
+
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.open_count = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """Indica si se puede llamar a Buda ahora (reserva la prueba en half-open)."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.open_count += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """Libera la prueba reservada sin registrar resultado (p. ej. al cancelar)."""
+        self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        """Segundos hasta que se permita la próxima prueba (0 si está cerrado)."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "open_count": self.open_count,
+            "retry_after": self.retry_after(),
+        }
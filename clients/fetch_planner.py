@@ -0,0 +1,118 @@
+# SUPUESTOS UTILIZADOS (estrategia de descarga de tickers):
+# - Buda ofrece /tickers (todos los mercados) y /markets/{id}/ticker (uno).
+# - Se registra qué pares (base, fiat) se consultan; son "calientes" los
+#   usados en los últimos TICKERS_HOT_WINDOW segundos y los fijados por una
+#   suscripción en vivo.
+# - En modo "auto" se descarga por mercado solo si el working set es chico
+#   (TICKERS_PER_MARKET_MAX) y el costo estimado es menor que el de /tickers:
+#   menos bytes y una latencia comparable. Los costos se miden con un
+#   promedio móvil exponencial (EWMA) de cada tipo de descarga.
+# - Mientras no haya mediciones de /tickers se usa /tickers.
+
+import math
+import time
+from typing import Iterable
+
+AUTO = "auto"
+BULK = "bulk"
+PER_MARKET = "per_market"
+
+# Peso de la última observación en los EWMA.
+EWMA_ALPHA = 0.3
+# Latencia aceptada para la descarga por mercado respecto de /tickers: se
+# tolera algo más lenta porque ahorra ancho de banda y parseo.
+LATENCY_SLACK = 1.5
+
+
+class Ewma:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value: float | None = None
+
+    def update(self, sample: float) -> None:
+        self.value = sample if self.value is None else self.value + EWMA_ALPHA * (sample - self.value)
+
+
+class FetchPlanner:
+    """Working set de pares consultados y costo observado de cada descarga."""
+
+    def __init__(self, mode: str, hot_window: float, max_markets: int, concurrency: int):
+        self.mode = mode
+        self.hot_window = hot_window
+        self.max_markets = max_markets
+        self.concurrency = max(1, concurrency)
+        self._demand: dict[tuple[str, str], float] = {}
+        self._pinned: dict[tuple[str, str], int] = {}
+        self.bulk_bytes = Ewma()
+        self.bulk_seconds = Ewma()
+        self.bulk_markets = 0
+        self.market_bytes = Ewma()
+        self.market_seconds = Ewma()
+        self.last_choice = BULK
+
+    def record(self, pairs: Iterable[tuple[str, str]]) -> None:
+        now = time.monotonic()
+        for pair in pairs:
+            self._demand[pair] = now
+
+    def pin(self, pairs: Iterable[tuple[str, str]]) -> None:
+        for pair in pairs:
+            self._pinned[pair] = self._pinned.get(pair, 0) + 1
+
+    def unpin(self, pairs: Iterable[tuple[str, str]]) -> None:
+        for pair in pairs:
+            count = self._pinned.get(pair, 0) - 1
+            if count > 0:
+                self._pinned[pair] = count
+            else:
+                self._pinned.pop(pair, None)
+
+    def hot_pairs(self) -> list[tuple[str, str]]:
+        """Pares calientes; descarta de paso los que salieron de la ventana."""
+        cutoff = time.monotonic() - self.hot_window
+        for pair in [pair for pair, seen in self._demand.items() if seen < cutoff]:
+            del self._demand[pair]
+        return sorted(set(self._demand) | set(self._pinned))
+
+    def observe(self, kind: str, nbytes: int, seconds: float) -> None:
+        if kind == BULK:
+            self.bulk_bytes.update(nbytes)
+            self.bulk_seconds.update(seconds)
+        else:
+            self.market_bytes.update(nbytes)
+            self.market_seconds.update(seconds)
+
+    def choose(self, n_markets: int) -> str:
+        """Estrategia para refrescar `n_markets` mercados calientes."""
+        if n_markets == 0 or self.mode == BULK:
+            choice = BULK
+        elif self.mode == PER_MARKET:
+            choice = PER_MARKET
+        elif n_markets > self.max_markets or self.bulk_bytes.value is None:
+            choice = BULK
+        else:
+            # Sin mediciones por mercado se estima con la porción de /tickers.
+            one_bytes = self.market_bytes.value
+            if one_bytes is None:
+                one_bytes = self.bulk_bytes.value / max(1, self.bulk_markets)
+            one_seconds = self.market_seconds.value
+            if one_seconds is None:
+                one_seconds = self.bulk_seconds.value
+            rounds = math.ceil(n_markets / self.concurrency)
+            cheaper = n_markets * one_bytes < self.bulk_bytes.value
+            fast_enough = rounds * one_seconds <= self.bulk_seconds.value * LATENCY_SLACK
+            choice = PER_MARKET if cheaper and fast_enough else BULK
+        self.last_choice = choice
+        return choice
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "last_choice": self.last_choice,
+            "hot_pairs": len(set(self._demand) | set(self._pinned)),
+            "bulk_bytes": self.bulk_bytes.value,
+            "bulk_seconds": self.bulk_seconds.value,
+            "market_bytes": self.market_bytes.value,
+            "market_seconds": self.market_seconds.value,
+        }
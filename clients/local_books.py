@@ -0,0 +1,253 @@
+# SUPUESTOS UTILIZADOS (order books locales alimentados por un feed push):
+# - Opcional: solo se activa con ORDER_BOOK_FEED_URL. Sin feed, o con el feed
+#   caído, el modo exacto sigue usando /markets/{id}/order_book y su caché.
+# - Mensajes del feed (JSON, uno por mensaje):
+#     {"type": "snapshot", "market_id": "BTC-CLP", "sequence": 10, "bids": [[p, s], ...], "asks": [...]}
+#     {"type": "update", "market_id": "BTC-CLP", "sequence": 11, "bids": [[p, s]], "asks": []}
+#   En un update `s` es el tamaño absoluto del nivel y `s = 0` lo borra. Al
+#   conectar se envía {"type": "subscribe", "markets": [...]}.
+# - Cada libro parte de un snapshot de /markets/{id}/order_book y aplica los
+#   updates en orden. Un update con sequence distinta de anterior + 1 es un
+#   salto: el libro se descarta y se vuelve a pedir el snapshot. Los updates
+#   con sequence <= la del libro (ya incluidos en el snapshot) se ignoran.
+# - Si el snapshot REST no trae `sequence` (Buda no la expone), el primer
+#   update siguiente fija la base de la numeración.
+# - El resnapshot se espera en línea: mientras tanto el feed no se lee (los
+#   mensajes quedan en el buffer del socket) y luego se descartan los que ya
+#   estaban incluidos en el snapshot.
+# - Los niveles se guardan ordenados en `array('d')` (mejor precio primero;
+#   en bids la clave es el precio negado) y se actualizan con bisect. La
+#   vista `OrderBookDepth` para llenar se reconstruye solo si el libro cambió.
+# - Un libro local se usa mientras el feed haya enviado algo en los últimos
+#   ORDER_BOOK_FEED_MAX_SILENCE segundos.
+
+import asyncio
+import json
+import logging
+import time
+from array import array
+from bisect import bisect_left
+from typing import AsyncIterable, Awaitable, Callable, Iterable
+
+from clients.order_book import DepthSide, OrderBookDepth
+
+logger = logging.getLogger(__name__)
+
+
+class SequenceGap(Exception):
+    """Se perdió al menos un update: hay que volver a pedir el snapshot."""
+
+
+class BookSide:
+    """Niveles de un lado del libro ordenados con el mejor precio primero."""
+
+    __slots__ = ("sign", "keys", "sizes")
+
+    def __init__(self, descending: bool):
+        self.sign = -1.0 if descending else 1.0
+        self.keys = array('d')
+        self.sizes = array('d')
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def set(self, price: float, size: float) -> None:
+        """Fija el tamaño del nivel `price` (0 lo borra)."""
+        key = self.sign * price
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            if size > 0:
+                self.sizes[i] = size
+            else:
+                del self.keys[i]
+                del self.sizes[i]
+        elif size > 0:
+            self.keys.insert(i, key)
+            self.sizes.insert(i, size)
+
+    def depth(self) -> DepthSide:
+        return DepthSide.from_levels(zip((self.sign * key for key in self.keys), self.sizes))
+
+
+class LocalOrderBook:
+    """Order book de un mercado mantenido con updates incrementales."""
+
+    def __init__(self, market_id: str, sequence: int | None = None):
+        self.market_id = market_id
+        self.sequence = sequence
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.updates = 0
+        self._depth: OrderBookDepth | None = None
+
+    @classmethod
+    def from_payload(cls, market_id: str, payload: dict) -> "LocalOrderBook":
+        sequence = payload.get("sequence")
+        book = cls(market_id, None if sequence is None else int(sequence))
+        book._set_levels(payload.get("bids", ()), payload.get("asks", ()))
+        return book
+
+    def _set_levels(self, bids: Iterable, asks: Iterable) -> None:
+        for price, size in bids:
+            self.bids.set(float(price), float(size))
+        for price, size in asks:
+            self.asks.set(float(price), float(size))
+        self._depth = None
+
+    def apply(self, update: dict) -> bool:
+        """Aplica `update`; False si ya estaba incluido en el libro.
+
+        Raises:
+            SequenceGap: Si la sequence no es la siguiente esperada.
+        """
+        sequence = int(update["sequence"])
+        if self.sequence is not None:
+            if sequence <= self.sequence:
+                return False
+            if sequence != self.sequence + 1:
+                raise SequenceGap(f"{self.market_id}: se esperaba {self.sequence + 1} y llegó {sequence}")
+        self.sequence = sequence
+        self._set_levels(update.get("bids", ()), update.get("asks", ()))
+        self.updates += 1
+        return True
+
+    def depth(self) -> OrderBookDepth:
+        """Vista para llenar (sumas prefijas), reconstruida solo si hubo cambios."""
+        if self._depth is None:
+            self._depth = OrderBookDepth(self.bids.depth(), self.asks.depth())
+        return self._depth
+
+
+class OrderBookFeed:
+    """Mantiene order books locales para `markets` a partir de un feed push."""
+
+    def __init__(
+        self,
+        fetch_snapshot: Callable[[str], Awaitable[dict]],
+        markets: Iterable[str],
+        max_silence: float,
+    ):
+        self.fetch_snapshot = fetch_snapshot
+        self.markets = frozenset(market.upper() for market in markets)
+        self.max_silence = max_silence
+        self.books: dict[str, LocalOrderBook] = {}
+        self.last_message_at: float | None = None
+        self.snapshots = 0
+        self.gaps = 0
+        self._task: asyncio.Task | None = None
+
+    def depth(self, market_id: str) -> OrderBookDepth | None:
+        """Libro local de `market_id`, o None si no está sincronizado o el feed calla."""
+        book = self.books.get(market_id)
+        if book is None or not self.live():
+            return None
+        return book.depth()
+
+    def live(self) -> bool:
+        return self.last_message_at is not None and time.monotonic() - self.last_message_at < self.max_silence
+
+    def reset(self) -> None:
+        """Descarta todos los libros (p. ej. al perder la conexión)."""
+        self.books.clear()
+        self.last_message_at = None
+
+    async def handle(self, message: dict) -> None:
+        """Procesa un mensaje del feed."""
+        self.last_message_at = time.monotonic()
+        market_id = str(message.get("market_id", "")).upper()
+        if market_id not in self.markets:
+            return
+        if message.get("type") == "snapshot":
+            self.books[market_id] = LocalOrderBook.from_payload(market_id, message)
+            self.snapshots += 1
+            return
+        if message.get("type") != "update":
+            return
+        book = self.books.get(market_id)
+        if book is not None:
+            try:
+                book.apply(message)
+                return
+            except SequenceGap as e:
+                self.gaps += 1
+                logger.warning("Salto de secuencia en el feed de order books: %s", e)
+        book = await self._resnapshot(market_id)
+        if book is None:
+            return
+        try:
+            book.apply(message)
+        except SequenceGap:
+            # El snapshot es anterior a este update: se vuelve a pedir con el
+            # próximo update.
+            del self.books[market_id]
+
+    async def _resnapshot(self, market_id: str) -> LocalOrderBook | None:
+        self.books.pop(market_id, None)
+        try:
+            payload = await self.fetch_snapshot(market_id)
+        except Exception as e:
+            logger.warning("No se pudo obtener el snapshot de %s para el feed: %s", market_id, e)
+            return None
+        book = self.books[market_id] = LocalOrderBook.from_payload(market_id, payload)
+        self.snapshots += 1
+        return book
+
+    async def consume(self, messages: AsyncIterable[dict]) -> None:
+        """Procesa `messages` hasta que se agoten; luego descarta los libros."""
+        try:
+            async for message in messages:
+                await self.handle(message)
+        finally:
+            self.reset()
+
+    async def _websocket_messages(self, url: str):
+        import websockets
+
+        async with websockets.connect(url) as ws:
+            await ws.send(json.dumps({"type": "subscribe", "markets": sorted(self.markets)}))
+            async for raw in ws:
+                yield json.loads(raw)
+
+    async def _run(self, url: str) -> None:
+        delay = 1.0
+        while True:
+            try:
+                await self.consume(self._websocket_messages(url))
+                delay = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Feed de order books desconectado: %s", e)
+            await asyncio.sleep(delay)
+            delay = min(30.0, delay * 2)
+
+    def start(self, url: str) -> bool:
+        """Conecta al feed websocket en segundo plano (requiere `websockets`)."""
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            logger.warning("ORDER_BOOK_FEED_URL requiere el paquete `websockets`; se usa solo REST")
+            return False
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(url))
+        return True
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self.reset()
+
+    def stats(self) -> dict:
+        return {
+            "markets": len(self.markets),
+            "synced": len(self.books),
+            "live": self.live(),
+            "snapshots": self.snapshots,
+            "gaps": self.gaps,
+        }
@@ -0,0 +1,116 @@
+# SUPUESTOS UTILIZADOS (ruteo entre monedas):
+# - El grafo tiene un nodo por moneda y una arista por mercado de Buda
+#   (listado de /markets más los market_id del snapshot de tickers). Cada
+#   mercado se recorre en ambos sentidos: vender base -> quote (× precio) o
+#   comprar quote -> base (÷ precio).
+# - Se admiten rutas directas o con hasta dos monedas intermedias
+#   (MAX_HOPS). Ante empate gana la ruta con menos compras y luego el orden
+#   alfabético de mercados, para que el resultado sea determinista.
+# - La tabla se arma una vez por snapshot, para todos los pares de monedas;
+#   valorizar es una búsqueda en un dict. En modo ticker solo se usan
+#   mercados con `last_price` válido; en modo exacto basta con que el
+#   mercado exista (el precio sale del order book).
+
+from dataclasses import dataclass
+from typing import Iterable
+
+MAX_HOPS = 3
+SELL = "sell"
+BUY = "buy"
+
+
+@dataclass(frozen=True, slots=True)
+class Hop:
+    """Un paso de una ruta: `side` SELL vende la base del mercado, BUY la compra."""
+
+    market_id: str
+    side: str
+
+
+@dataclass(frozen=True, slots=True)
+class Route:
+    """Ruta de conversión y su tasa (None si algún mercado no tiene precio)."""
+
+    hops: tuple[Hop, ...]
+    rate: float | None = None
+
+    @property
+    def markets(self) -> list[str]:
+        return [hop.market_id for hop in self.hops]
+
+
+def split_market(market_id: str) -> tuple[str, str]:
+    base, _, quote = market_id.upper().partition("-")
+    return base, quote
+
+
+class RouteTable:
+    """Mejores rutas entre todas las monedas del grafo para un snapshot."""
+
+    def __init__(
+        self,
+        version: int,
+        priced: dict[tuple[str, str], Route],
+        paths: dict[tuple[str, str], Route],
+    ):
+        self.version = version
+        self.priced = priced
+        self.paths = paths
+        self.currencies = frozenset(currency for pair in paths for currency in pair)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def priced_route(self, source: str, target: str) -> Route | None:
+        """Ruta con tasa del snapshot (modo ticker)."""
+        return self.priced.get((source.upper(), target.upper()))
+
+    def path(self, source: str, target: str) -> Route | None:
+        """Ruta por mercados existentes, tengan o no precio (modo exacto)."""
+        return self.paths.get((source.upper(), target.upper()))
+
+    @classmethod
+    def build(cls, market_ids: Iterable[str], prices: dict[str, float | None], version: int = 0) -> "RouteTable":
+        """Calcula las mejores rutas de hasta MAX_HOPS mercados.
+
+        Args:
+            market_ids: Mercados conocidos ("BASE-QUOTE").
+            prices: Último precio por market_id (None o ausente = sin precio).
+            version: Versión del snapshot del que salen los precios.
+        """
+        edges: dict[str, list[tuple[str, Hop, float | None]]] = {}
+        for market_id in sorted({m.upper() for m in market_ids}):
+            base, quote = split_market(market_id)
+            if not base or not quote:
+                continue
+            price = prices.get(market_id)
+            if price is not None and price <= 0:
+                price = None
+            edges.setdefault(base, []).append((quote, Hop(market_id, SELL), price))
+            edges.setdefault(quote, []).append((base, Hop(market_id, BUY), None if price is None else 1.0 / price))
+
+        priced: dict[tuple[str, str], Route] = {}
+        paths: dict[tuple[str, str], Route] = {}
+        best_priced: dict[tuple[str, str], tuple] = {}
+        best_path: dict[tuple[str, str], tuple] = {}
+
+        def visit(source: str, currency: str, hops: tuple[Hop, ...], rate: float | None, seen: frozenset[str]):
+            for target, hop, factor in edges.get(currency, ()):
+                if target in seen:
+                    continue
+                route_hops = hops + (hop,)
+                route_rate = None if rate is None or factor is None else rate * factor
+                rank = (len(route_hops), sum(h.side == BUY for h in route_hops), [h.market_id for h in route_hops])
+                key = (source, target)
+                if key not in best_path or rank < best_path[key]:
+                    best_path[key] = rank
+                    paths[key] = Route(route_hops, route_rate)
+                if route_rate is not None and (key not in best_priced or rank < best_priced[key]):
+                    best_priced[key] = rank
+                    priced[key] = Route(route_hops, route_rate)
+                if len(route_hops) < MAX_HOPS:
+                    visit(source, target, route_hops, route_rate, seen | {target})
+
+        for source in edges:
+            visit(source, source, (), 1.0, frozenset({source}))
+        return cls(version, priced, paths)
@@ -0,0 +1,133 @@
+# SUPUESTOS UTILIZADOS (profundidad de order book):
+# - Cada lado del libro se parsea una sola vez por descarga a arreglos
+#   contiguos `array('d')` (precio, tamaño, tamaño acumulado y nocional
+#   acumulado). No se agrega NumPy como dependencia.
+# - Los niveles se recorren en el orden que entrega Buda (mejor precio
+#   primero), igual que el loop original de llenado.
+# - Llenar una cantidad es una búsqueda binaria sobre el tamaño acumulado más
+#   una interpolación en el último nivel tocado.
+# - Adaptación deliberada: el resultado no es idéntico bit a bit al del loop
+#   original. Lo pendiente en el último nivel se calcula como
+#   `cantidad - cum_size[k-1]` y no restando nivel por nivel, y el corte usa
+#   EPSILON sobre la suma acumulada; la diferencia queda acotada por
+#   `2 * mejor precio * (EPSILON + niveles * ulp(profundidad total))`
+#   (del orden de 1e-12 relativo). Los niveles completos sí coinciden
+#   exactamente, porque el nocional acumulado se suma en el mismo orden.
+# - Gastar un monto en moneda cotizada (compra contra `asks`, usado en rutas
+#   con moneda intermedia) es la misma búsqueda sobre el nocional acumulado.
+
+from array import array
+from bisect import bisect_left
+
+# Tolerancia del loop original: una cantidad pendiente <= EPSILON se
+# considera cubierta.
+EPSILON = 1e-12
+
+
+class DepthSide:
+    """Un lado del order book (bids o asks) indexado con sumas prefijas."""
+
+    __slots__ = ("prices", "sizes", "cum_size", "cum_notional")
+
+    def __init__(self, prices: array, sizes: array, cum_size: array, cum_notional: array):
+        self.prices = prices
+        self.sizes = sizes
+        self.cum_size = cum_size
+        self.cum_notional = cum_notional
+
+    @classmethod
+    def from_levels(cls, levels) -> "DepthSide":
+        """Construye los arreglos desde la lista `[[precio, tamaño], ...]` de Buda."""
+        prices = array('d')
+        sizes = array('d')
+        cum_size = array('d')
+        cum_notional = array('d')
+        total_size = 0.0
+        total_notional = 0.0
+        for level in levels:
+            price = float(level[0])
+            size = float(level[1])
+            total_size += size
+            total_notional += price * size
+            prices.append(price)
+            sizes.append(size)
+            cum_size.append(total_size)
+            cum_notional.append(total_notional)
+        return cls(prices, sizes, cum_size, cum_notional)
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    @property
+    def total_size(self) -> float:
+        """Profundidad total disponible en este lado del libro."""
+        return self.cum_size[-1] if self.cum_size else 0.0
+
+    def fill(self, quantity: float) -> float | None:
+        """Nocional obtenido al llenar `quantity` contra este lado del libro.
+
+        Devuelve None si la profundidad total no alcanza para cubrir la
+        cantidad (liquidez insuficiente).
+
+        Coincide con el loop original salvo por redondeo en el último nivel
+        tocado (a nivel de ulp de la cantidad; ver SUPUESTOS del módulo).
+        """
+        quantity = float(quantity)
+        if not self.prices:
+            return 0.0 if quantity <= EPSILON else None
+        if quantity - self.total_size > EPSILON:
+            return None
+
+        # Primer nivel tras el cual lo pendiente queda dentro de la tolerancia.
+        k = bisect_left(self.cum_size, quantity - EPSILON)
+        if k == len(self.prices):
+            return None
+        if k == 0:
+            filled_size = 0.0
+            notional = 0.0
+        else:
+            filled_size = self.cum_size[k - 1]
+            notional = self.cum_notional[k - 1]
+        return notional + self.prices[k] * min(self.sizes[k], quantity - filled_size)
+
+    def spend(self, notional: float) -> float | None:
+        """Cantidad base obtenida al gastar `notional` (moneda cotizada) contra este lado.
+
+        Es la operación inversa de `fill`: se usa sobre las `asks` para
+        comprar. Devuelve None si la profundidad total no alcanza.
+        """
+        notional = float(notional)
+        if notional <= EPSILON:
+            return 0.0
+        if not self.prices or notional - self.cum_notional[-1] > EPSILON:
+            return None
+
+        k = bisect_left(self.cum_notional, notional - EPSILON)
+        if k == 0:
+            bought = 0.0
+            spent = 0.0
+        else:
+            bought = self.cum_size[k - 1]
+            spent = self.cum_notional[k - 1]
+        return bought + min(self.sizes[k], (notional - spent) / self.prices[k])
+
+
+class OrderBookDepth:
+    """Order book parseado: `bids` y `asks` como `DepthSide`."""
+
+    __slots__ = ("bids", "asks")
+
+    def __init__(self, bids: DepthSide, asks: DepthSide):
+        self.bids = bids
+        self.asks = asks
+
+    @classmethod
+    def from_payload(cls, order_book: dict) -> "OrderBookDepth":
+        return cls(
+            bids=DepthSide.from_levels(order_book.get('bids', [])),
+            asks=DepthSide.from_levels(order_book.get('asks', [])),
+        )
+
+    @property
+    def levels(self) -> int:
+        return len(self.bids) + len(self.asks)
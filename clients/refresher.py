@@ -0,0 +1,103 @@
+# SUPUESTOS UTILIZADOS (refresco en segundo plano):
+# - Se arranca y detiene desde el lifespan de FastAPI (ver main.py).
+# - Refresca el snapshot de /tickers antes de que expire, así las requests se
+#   sirven siempre desde memoria (stale-while-revalidate).
+# - Si el refresco falla, las requests siguen usando el último snapshot hasta
+#   `max_staleness`; después vuelven a bloquear en un fetch a Buda.
+
+import asyncio
+import logging
+import random
+import time
+
+from clients.buda_client import BudaClient
+
+logger = logging.getLogger(__name__)
+
+
+class TickersRefresher:
+    """Tarea que mantiene caliente el snapshot de tickers de un `BudaClient`."""
+
+    def __init__(self, client: BudaClient, interval: float, jitter: float, max_staleness: float):
+        self.client = client
+        self.interval = interval
+        self.jitter = jitter
+        self.max_staleness = max_staleness
+        self.failure_count = 0
+        self.consecutive_failures = 0
+        self.last_success: float | None = None
+        self.last_error: str | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.client.max_staleness = self.max_staleness
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self.client.max_staleness = None
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def refresh_lag(self) -> float | None:
+        """Edad en segundos del snapshot que se está sirviendo (None si no hay)."""
+        snapshot = self.client.cache.snapshot
+        return None if snapshot is None else snapshot.age()
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "max_staleness": self.max_staleness,
+            "refresh_lag": self.refresh_lag(),
+            "last_success": self.last_success,
+            "failure_count": self.failure_count,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+    def _next_delay(self) -> float:
+        """Segundos hasta el próximo refresco.
+
+        Apunta a que el snapshot tenga `interval` segundos de edad al
+        refrescarse; tras fallos reintenta con backoff exponencial acotado.
+        """
+        if self.consecutive_failures:
+            delay = min(self.interval, 2.0 ** (self.consecutive_failures - 1))
+        else:
+            lag = self.refresh_lag()
+            delay = 0.0 if lag is None else max(0.0, self.interval - lag)
+        if self.jitter:
+            delay += random.uniform(-self.jitter, self.jitter)
+        return max(0.0, delay)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._next_delay())
+            try:
+                # Si otro worker publicó hace poco (backend compartido), se
+                # adopta ese snapshot en vez de descargar otra vez.
+                await self.client.refresh_snapshot(max_age=self.interval / 2)
+                if self.client.markets_expired():
+                    await self.client.load_markets()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failure_count += 1
+                self.consecutive_failures += 1
+                self.last_error = str(e)
+                logger.warning("Fallo al refrescar tickers en segundo plano: %s", e)
+            else:
+                self.consecutive_failures = 0
+                self.last_success = time.time()
@@ -0,0 +1,42 @@
+# SUPUESTOS UTILIZADOS (single-flight):
+# - Un solo proceso/event loop; la deduplicación es por proceso.
+# - Todos los que esperan una misma clave reciben el mismo resultado o la
+#   misma excepción.
+
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """Deduplica llamadas concurrentes por clave.
+
+    Mientras haya una llamada en curso para `key`, los demás llamadores
+    esperan ese mismo future en vez de lanzar una nueva.
+    """
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Ejecuta `fn()` una sola vez por clave entre llamadores concurrentes.
+
+        La tarea compartida se protege con `asyncio.shield`: si un llamador se
+        cancela, la petición sigue en curso para el resto.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Evita el warning "exception was never retrieved" si todos los
+        # llamadores se cancelaron antes de que terminara la tarea.
+        if not task.cancelled():
+            task.exception()
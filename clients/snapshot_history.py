@@ -0,0 +1,268 @@
+# SUPUESTOS UTILIZADOS (historial de snapshots):
+# - Cada snapshot nuevo de tickers se agrega a un archivo mmap de ancho fijo
+#   en disco local: una columna de timestamps y una columna de `last_price`
+#   por mercado (float64, NaN = sin precio). El archivo es un ring: al llenarse
+#   se sobrescribe el registro más antiguo.
+# - Las columnas de mercado se asignan a medida que aparecen, hasta
+#   HISTORY_MAX_MARKETS; los mercados que no caben se ignoran.
+# - Un snapshot parcial (descarga por mercado) arrastra el último precio
+#   registrado de los mercados que no trae; uno completo deja NaN. Una
+#   columna nueva se inicializa en NaN para los registros anteriores.
+# - Los timestamps son crecientes: un snapshot no más nuevo que el último
+#   registrado se descarta (p. ej. el mismo snapshot visto por varios workers).
+# - Varios workers pueden escribir el mismo archivo: cada escritura toma un
+#   `flock` exclusivo. Los lectores no toman locks; con el ring lleno ignoran
+#   el registro más antiguo, que es el que se está sobrescribiendo.
+# - Buscar un instante es una búsqueda binaria sobre la columna de
+#   timestamps; solo se leen las columnas de los mercados consultados.
+# - Como listener de la caché, la escritura (flock bloqueante y, con cada
+#   mercado nuevo, `capacity` NaN) no corre en el event loop: `record`
+#   encola el snapshot y una única tarea lo escribe con `asyncio.to_thread`,
+#   en orden. Con la cola llena (disco muy lento) el snapshot se descarta.
+
+import asyncio
+import bisect
+import fcntl
+import logging
+import math
+import mmap
+import os
+import struct
+
+from clients.buda_client import TickerSnapshot
+
+logger = logging.getLogger(__name__)
+
+_DOUBLE = struct.Struct("<d")
+_NAN_BYTES = _DOUBLE.pack(math.nan)
+
+
+class _Timeline:
+    """Secuencia de timestamps en orden lógico (más antiguo primero) para `bisect`."""
+
+    def __init__(self, history: "SnapshotHistory", start: int, length: int):
+        self.history = history
+        self.start = start
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index: int) -> float:
+        return self.history._timestamp(self.history._slot(self.start + index))
+
+
+class SnapshotHistory:
+    """Ring de snapshots de tickers en un archivo mmap columnar.
+
+    Cabecera fija, directorio de mercados (MARKET_ID_SIZE bytes por columna),
+    columna de timestamps y luego una columna de precios por mercado, todas
+    de `capacity` registros.
+    """
+
+    HEADER = struct.Struct("<8sIIIQ")  # magic, capacidad, máx. mercados, mercados usados, registros escritos
+    MAGIC = b"BUDAHST1"
+    MARKET_ID_SIZE = 24
+    # Snapshots pendientes de escribir antes de empezar a descartar.
+    QUEUE_MAX = 64
+
+    def __init__(self, path: str, capacity: int, max_markets: int):
+        if capacity < 2 or max_markets < 1:
+            raise ValueError("HISTORY_CAPACITY debe ser >= 2 y HISTORY_MAX_MARKETS >= 1")
+        self.path = path
+        self.capacity = capacity
+        self.max_markets = max_markets
+        self._directory_offset = self.HEADER.size
+        self._timestamps_offset = self._directory_offset + max_markets * self.MARKET_ID_SIZE
+        self._prices_offset = self._timestamps_offset + capacity * _DOUBLE.size
+        self.size = self._prices_offset + max_markets * capacity * _DOUBLE.size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            header = os.pread(self._fd, self.HEADER.size, 0)
+            if header.startswith(self.MAGIC):
+                _, file_capacity, file_markets, _, _ = self.HEADER.unpack(header)
+                if (file_capacity, file_markets) != (capacity, max_markets):
+                    raise ValueError(
+                        f"{path} fue creado con capacidad {file_capacity} y {file_markets} mercados; "
+                        "cambiar HISTORY_PATH o borrar el archivo"
+                    )
+            else:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, self.HEADER.pack(self.MAGIC, capacity, max_markets, 0, 0), 0)
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(self._fd, self.size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self._columns: dict[str, int] = {}
+        self.dropped_markets = 0
+        self.dropped_snapshots = 0
+        self._queue: asyncio.Queue | None = None
+        self._writer: asyncio.Task | None = None
+
+    # --- lectura -------------------------------------------------------
+
+    def _header(self) -> tuple[int, int]:
+        """(mercados usados, registros escritos)."""
+        _, _, _, used, count = self.HEADER.unpack_from(self._map, 0)
+        return used, count
+
+    def _slot(self, index: int) -> int:
+        return index % self.capacity
+
+    def _timestamp(self, slot: int) -> float:
+        return _DOUBLE.unpack_from(self._map, self._timestamps_offset + slot * _DOUBLE.size)[0]
+
+    def _price(self, column: int, slot: int) -> float:
+        offset = self._prices_offset + (column * self.capacity + slot) * _DOUBLE.size
+        return _DOUBLE.unpack_from(self._map, offset)[0]
+
+    def _load_columns(self) -> dict[str, int]:
+        """Directorio market_id -> columna; solo relee las columnas nuevas."""
+        used, _ = self._header()
+        for column in range(len(self._columns), min(used, self.max_markets)):
+            offset = self._directory_offset + column * self.MARKET_ID_SIZE
+            market_id = self._map[offset:offset + self.MARKET_ID_SIZE].rstrip(b"\0").decode()
+            self._columns[market_id] = column
+        return self._columns
+
+    def _readable(self) -> tuple[int, int]:
+        """(índice lógico del registro más antiguo legible, cantidad legible)."""
+        _, count = self._header()
+        if count < self.capacity:
+            return 0, count
+        return count - self.capacity + 1, self.capacity - 1
+
+    def __len__(self) -> int:
+        return self._readable()[1]
+
+    def find(self, as_of: float) -> tuple[float, int] | None:
+        """Último registro con timestamp <= `as_of`: (timestamp, slot), o None."""
+        start, length = self._readable()
+        index = bisect.bisect_right(_Timeline(self, start, length), as_of)
+        if index == 0:
+            return None
+        slot = self._slot(start + index - 1)
+        return self._timestamp(slot), slot
+
+    def prices(self, slot: int, market_ids=None) -> dict[str, float]:
+        """Precios del registro `slot` (solo `market_ids` si se indican)."""
+        columns = self._load_columns()
+        selected = columns if market_ids is None else {m: columns[m] for m in market_ids if m in columns}
+        prices = {}
+        for market_id, column in selected.items():
+            price = self._price(column, slot)
+            if not math.isnan(price):
+                prices[market_id] = price
+        return prices
+
+    def stats(self) -> dict:
+        start, length = self._readable()
+        used, _ = self._header()
+        return {
+            "records": length,
+            "capacity": self.capacity,
+            "markets": used,
+            "dropped_markets": self.dropped_markets,
+            "dropped_snapshots": self.dropped_snapshots,
+            "oldest": self._timestamp(self._slot(start)) if length else None,
+            "newest": self._timestamp(self._slot(start + length - 1)) if length else None,
+        }
+
+    # --- escritura -----------------------------------------------------
+
+    def append(self, snapshot: TickerSnapshot) -> bool:
+        """Agrega `snapshot` al ring; False si no es más nuevo que el último registro."""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            used, count = self._header()
+            previous = self._slot(count - 1) if count else None
+            if previous is not None and snapshot.fetched_at <= self._timestamp(previous):
+                return False
+            columns = self._load_columns()
+            for market_id in snapshot.quotes:
+                if market_id in columns:
+                    continue
+                encoded = market_id.encode()
+                if used >= self.max_markets or len(encoded) > self.MARKET_ID_SIZE:
+                    self.dropped_markets += 1
+                    continue
+                offset = self._directory_offset + used * self.MARKET_ID_SIZE
+                self._map[offset:offset + self.MARKET_ID_SIZE] = encoded.ljust(self.MARKET_ID_SIZE, b"\0")
+                # Los registros anteriores a la aparición del mercado quedan
+                # sin precio (NaN), no en 0 como los bytes del archivo.
+                start = self._prices_offset + used * self.capacity * _DOUBLE.size
+                self._map[start:start + self.capacity * _DOUBLE.size] = _NAN_BYTES * self.capacity
+                columns[market_id] = used
+                used += 1
+
+            slot = self._slot(count)
+            for market_id, column in columns.items():
+                quote = snapshot.quotes.get(market_id)
+                if quote is not None and quote.last is not None:
+                    price = quote.last
+                elif snapshot.partial and previous is not None:
+                    price = self._price(column, previous)
+                else:
+                    price = math.nan
+                _DOUBLE.pack_into(self._map, self._prices_offset + (column * self.capacity + slot) * _DOUBLE.size, price)
+            _DOUBLE.pack_into(self._map, self._timestamps_offset + slot * _DOUBLE.size, snapshot.fetched_at)
+            # La cabecera se actualiza al final: los lectores nunca ven el
+            # registro nuevo a medio escribir.
+            self.HEADER.pack_into(self._map, 0, self.MAGIC, self.capacity, self.max_markets, used, count + 1)
+            return True
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def record(self, previous: TickerSnapshot | None, snapshot: TickerSnapshot) -> None:
+        """Listener de `TickersCache`: encola cada snapshot nuevo para escribirlo.
+
+        Sin event loop en curso (scripts, tests sincrónicos) se escribe en el
+        momento.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.append(snapshot)
+            return
+        if self._writer is None or self._writer.done():
+            self._queue = asyncio.Queue(self.QUEUE_MAX)
+            self._writer = loop.create_task(self._write_pending(self._queue))
+        try:
+            self._queue.put_nowait(snapshot)
+        except asyncio.QueueFull:
+            self.dropped_snapshots += 1
+
+    async def _write_pending(self, queue: asyncio.Queue) -> None:
+        while True:
+            snapshot = await queue.get()
+            try:
+                await asyncio.to_thread(self.append, snapshot)
+            except Exception as e:
+                logger.warning("No se pudo registrar el snapshot en %s: %s", self.path, e)
+            finally:
+                queue.task_done()
+
+    async def flush(self) -> None:
+        """Espera a que se escriban los snapshots encolados."""
+        if self._queue is not None and self._writer is not None and not self._writer.done():
+            await self._queue.join()
+
+    async def aclose(self) -> None:
+        """Escribe lo pendiente, detiene la tarea de escritura y cierra el archivo."""
+        await self.flush()
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        self.close()
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
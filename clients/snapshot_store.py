@@ -0,0 +1,287 @@
+# SUPUESTOS UTILIZADOS (almacenamiento compartido de snapshots):
+# - Un snapshot se publica como documento JSON serializable con `version` y
+#   `fetched_at`; el backend asigna la versión para que todos los workers
+#   valoricen contra los mismos datos.
+# - "memory": comportamiento original, por proceso.
+# - "shm": archivo mmap en el host (p. ej. /dev/shm). El worker que gana un
+#   `flock` no bloqueante descarga y publica; el resto mapea el archivo en
+#   solo lectura. El lock se libera solo si el proceso muere. La escritura
+#   (flock bloqueante + copia al mmap) corre en un hilo con
+#   `asyncio.to_thread`; las lecturas que se cruzan con ella reintentan
+#   cediendo el event loop.
+# - "redis": cualquier servidor que hable RESP (Redis, KeyDB, etc.). Se usa
+#   un cliente RESP mínimo sobre asyncio para no agregar dependencias. El
+#   lease de descarga es `SET NX PX` y su liberación no es atómica (GET +
+#   DEL), aceptable porque el lease también expira solo.
+
+import asyncio
+import fcntl
+import json
+import mmap
+import os
+import struct
+import uuid
+from urllib.parse import urlparse
+
+
+class SnapshotStoreError(Exception):
+    """Error del backend compartido; el cliente cae al comportamiento local."""
+
+
+class SnapshotStore:
+    """Interfaz de los backends de snapshots."""
+
+    # Si es False, `TickersCache` no serializa ni consulta el backend.
+    shared = False
+
+    async def load(self, known_version: int = 0) -> dict | None:
+        """Devuelve el documento publicado si su versión es mayor a `known_version`."""
+        raise NotImplementedError
+
+    async def publish(self, document: dict) -> int:
+        """Publica `document` asignándole la siguiente versión y la devuelve."""
+        raise NotImplementedError
+
+    async def acquire_lease(self, ttl: float) -> bool:
+        """Intenta quedar como único descargador durante a lo más `ttl` segundos."""
+        return True
+
+    async def release_lease(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        return None
+
+
+class InProcessSnapshotStore(SnapshotStore):
+    """Backend por proceso (comportamiento original)."""
+
+    def __init__(self):
+        self._document: dict | None = None
+        self._version = 0
+
+    async def load(self, known_version: int = 0) -> dict | None:
+        if self._document is None or self._document["version"] <= known_version:
+            return None
+        return self._document
+
+    async def publish(self, document: dict) -> int:
+        self._version += 1
+        self._document = {**document, "version": self._version}
+        return self._version
+
+
+class SharedMemorySnapshotStore(SnapshotStore):
+    """Snapshot compartido entre workers de un mismo host vía un archivo mmap.
+
+    Cabecera fija seguida del documento JSON. Las escrituras usan un seqlock
+    (contador impar mientras se escribe) para que los lectores, que no toman
+    locks, detecten lecturas a medio escribir y reintenten.
+    """
+
+    shared = True
+    HEADER = struct.Struct("<8sQQI")  # magic, seq, version, largo del payload
+    MAGIC = b"BUDASNP1"
+    # Reintentos de lectura ante una escritura en curso: se cede el event
+    # loop con una espera creciente en lugar de girar en vacío.
+    READ_ATTEMPTS = 20
+    READ_BACKOFF = 0.0005
+    READ_BACKOFF_MAX = 0.02
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            header = os.pread(fd, self.HEADER.size, 0)
+            if not header.startswith(self.MAGIC):
+                os.pwrite(fd, self.HEADER.pack(self.MAGIC, 0, 0, 0), 0)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            self._view = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        self._lease_fd: int | None = None
+
+    def _try_read(self, known_version: int) -> tuple[bool, dict | None]:
+        """(consistente, documento); `consistente` es False si se cruzó con una escritura."""
+        _, seq, version, length = self.HEADER.unpack_from(self._view, 0)
+        if seq % 2:
+            return False, None
+        if version <= known_version:
+            return True, None
+        payload = self._view[self.HEADER.size:self.HEADER.size + length]
+        if self.HEADER.unpack_from(self._view, 0)[1] != seq:
+            return False, None
+        return True, json.loads(payload)
+
+    async def load(self, known_version: int = 0) -> dict | None:
+        delay = self.READ_BACKOFF
+        for attempt in range(self.READ_ATTEMPTS):
+            consistent, document = self._try_read(known_version)
+            if consistent:
+                return document
+            await asyncio.sleep(0 if attempt == 0 else delay)
+            if attempt:
+                delay = min(self.READ_BACKOFF_MAX, delay * 2)
+        raise SnapshotStoreError("No se pudo leer un snapshot consistente")
+
+    def _write(self, document: dict) -> int:
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            with mmap.mmap(fd, self.size) as region:
+                _, seq, version, _ = self.HEADER.unpack_from(region, 0)
+                version += 1
+                payload = json.dumps({**document, "version": version}).encode()
+                if self.HEADER.size + len(payload) > self.size:
+                    raise SnapshotStoreError("Snapshot más grande que SNAPSHOT_SHM_SIZE")
+                self.HEADER.pack_into(region, 0, self.MAGIC, seq + 1, version, len(payload))
+                region[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+                self.HEADER.pack_into(region, 0, self.MAGIC, seq + 2, version, len(payload))
+            return version
+        finally:
+            os.close(fd)
+
+    async def publish(self, document: dict) -> int:
+        # El flock es bloqueante (puede esperar a otro worker): fuera del
+        # event loop.
+        return await asyncio.to_thread(self._write, document)
+
+    async def acquire_lease(self, ttl: float) -> bool:
+        if self._lease_fd is not None:
+            return False
+        fd = os.open(self.path + ".lease", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lease_fd = fd
+        return True
+
+    async def release_lease(self) -> None:
+        if self._lease_fd is not None:
+            os.close(self._lease_fd)
+            self._lease_fd = None
+
+    async def close(self) -> None:
+        await self.release_lease()
+        self._view.close()
+
+
+class RedisSnapshotStore(SnapshotStore):
+    """Snapshot compartido entre réplicas en un servidor que habla RESP."""
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "buda:tickers"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._lock = asyncio.Lock()
+        self._lease_token: str | None = None
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._roundtrip("AUTH", self.password)
+        if self.db:
+            await self._roundtrip("SELECT", str(self.db))
+
+    async def _roundtrip(self, *args: str):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode() if isinstance(arg, str) else arg
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._writer.write(b"".join(parts))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise SnapshotStoreError("Conexión cerrada por el servidor RESP")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise SnapshotStoreError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        raise SnapshotStoreError(f"Respuesta RESP no soportada: {line!r}")
+
+    async def _command(self, *args: str):
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    await self._connect()
+                return await self._roundtrip(*args)
+            except (OSError, asyncio.IncompleteReadError, SnapshotStoreError) as e:
+                await self._disconnect()
+                if isinstance(e, SnapshotStoreError):
+                    raise
+                raise SnapshotStoreError(f"Backend RESP no disponible: {e}") from e
+
+    async def _disconnect(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def load(self, known_version: int = 0) -> dict | None:
+        version = await self._command("GET", f"{self.prefix}:version")
+        if version is None or int(version) <= known_version:
+            return None
+        payload = await self._command("GET", f"{self.prefix}:snapshot")
+        if payload is None:
+            return None
+        document = json.loads(payload)
+        return document if document["version"] > known_version else None
+
+    async def publish(self, document: dict) -> int:
+        version = await self._command("INCR", f"{self.prefix}:version")
+        await self._command("SET", f"{self.prefix}:snapshot", json.dumps({**document, "version": version}))
+        return version
+
+    async def acquire_lease(self, ttl: float) -> bool:
+        token = uuid.uuid4().hex
+        reply = await self._command("SET", f"{self.prefix}:lease", token, "NX", "PX", str(int(ttl * 1000)))
+        if reply != "OK":
+            return False
+        self._lease_token = token
+        return True
+
+    async def release_lease(self) -> None:
+        token, self._lease_token = self._lease_token, None
+        if token is None:
+            return
+        if await self._command("GET", f"{self.prefix}:lease") == token.encode():
+            await self._command("DEL", f"{self.prefix}:lease")
+
+    async def close(self) -> None:
+        async with self._lock:
+            await self._disconnect()
+
+
+def build_snapshot_store(kind: str, shm_path: str, shm_size: int, redis_url: str, redis_prefix: str) -> SnapshotStore:
+    """Crea el backend indicado por `SNAPSHOT_STORE` ("memory", "shm" o "redis")."""
+    if kind == "memory":
+        return InProcessSnapshotStore()
+    if kind == "shm":
+        return SharedMemorySnapshotStore(shm_path, shm_size)
+    if kind == "redis":
+        return RedisSnapshotStore(redis_url, redis_prefix)
+    raise ValueError(f"SNAPSHOT_STORE desconocido: {kind}")
@@ -0,0 +1,95 @@
+# SUPUESTOS UTILIZADOS (presupuesto de llamadas a Buda):
+# - Un token bucket por proceso para todas las llamadas a Buda (incluidos
+#   reintentos y el refresco en segundo plano): `rate` tokens por segundo y
+#   hasta `burst` acumulados.
+# - Sin token disponible, la llamada reserva el siguiente y espera su turno
+#   (orden de llegada). Se rechaza de inmediato si ya hay `max_queue`
+#   llamadas esperando o si el turno llegaría después de `max_wait`
+#   segundos: es preferible responder 429/503 con Retry-After que acumular
+#   latencia hasta que todo expire.
+# - Las respuestas servidas desde caché no llegan acá: no consumen tokens
+#   ni hacen cola.
+# - Un solo event loop por proceso: no se usan locks.
+
+import asyncio
+import time
+
+QUEUE_FULL = "queue_full"
+WAIT_TOO_LONG = "wait_too_long"
+
+
+class UpstreamOverloaded(Exception):
+    """La llamada se rechazó por falta de presupuesto; reintentar tras `retry_after`."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class UpstreamScheduler:
+    def __init__(self, rate: float, burst: float, max_queue: int, max_wait: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        # Puede quedar negativo: cada token "debido" es una llamada en cola.
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def retry_after(self) -> float:
+        """Segundos hasta que una llamada nueva tendría token sin esperar."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    async def acquire(self, max_wait: float | None = None) -> None:
+        """Toma un token, esperando a lo más `max_wait` (o `self.max_wait`).
+
+        Raises:
+            UpstreamOverloaded: Si la cola está llena o la espera sería mayor
+                al máximo; en ese caso no se consume token.
+        """
+        if self.rate <= 0:
+            return
+        self._refill()
+        delay = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        if delay > 0:
+            limit = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+            if self.waiting >= self.max_queue:
+                self.shed += 1
+                raise UpstreamOverloaded(QUEUE_FULL, delay)
+            if delay > limit:
+                self.shed += 1
+                raise UpstreamOverloaded(WAIT_TOO_LONG, delay)
+        self.tokens -= 1
+        self.admitted += 1
+        if delay <= 0:
+            return
+        self.waiting += 1
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            # Se devuelve el turno para que lo aproveche otra llamada.
+            self.tokens += 1
+            raise
+        finally:
+            self.waiting -= 1
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": self.tokens,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
@@ -1,5 +1,15 @@
 # Constantes del proyecto
 
+import os
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 # Respuestas OpenAPI para el endpoint de valorización de portafolios
 RESPONSE_FOR_PORTFOLIO_VALUE = {
     200: {
@@ -29,7 +39,7 @@ RESPONSE_FOR_PORTFOLIO_VALUE = {
 }
 
 # Configuración de Buda
-BASE_URL = "https://www.buda.com/api/v2"
+BASE_URL = os.getenv("BUDA_BASE_URL", "https://www.buda.com/api/v2")
 
 VALID_PAIRS = {
     "BTC": ["CLP", "COP", "PEN"],
@@ -39,3 +49,130 @@ VALID_PAIRS = {
     "USDC": ["CLP", "COP", "PEN"],
     "USDT": ["CLP", "COP", "PEN"],
 }
+
+# Refresco en segundo plano de /tickers (stale-while-revalidate).
+# - Intervalo y jitter en segundos; el refresco ocurre antes del TTL de 30s.
+# - Con el refresco activo se sirve desde memoria mientras el snapshot tenga
+#   menos de TICKERS_MAX_STALENESS segundos; pasado eso se vuelve a bloquear.
+TICKERS_REFRESH_ENABLED = _env_flag("TICKERS_REFRESH_ENABLED")
+TICKERS_REFRESH_INTERVAL = float(os.getenv("TICKERS_REFRESH_INTERVAL", "20"))
+TICKERS_REFRESH_JITTER = float(os.getenv("TICKERS_REFRESH_JITTER", "2"))
+TICKERS_MAX_STALENESS = float(os.getenv("TICKERS_MAX_STALENESS", "120"))
+
+# Máximo de requests concurrentes hacia Buda por proceso (semáforo compartido
+# entre todas las requests entrantes).
+BUDA_MAX_CONCURRENCY = int(os.getenv("BUDA_MAX_CONCURRENCY", "8"))
+
+# Caché de order books (modo exacto): TTL corto en segundos y LRU acotado por
+# cantidad de mercados y por total de niveles (bids + asks) retenidos.
+ORDER_BOOK_CACHE_TTL = float(os.getenv("ORDER_BOOK_CACHE_TTL", "2"))
+ORDER_BOOK_CACHE_MAX_MARKETS = int(os.getenv("ORDER_BOOK_CACHE_MAX_MARKETS", "64"))
+ORDER_BOOK_CACHE_MAX_LEVELS = int(os.getenv("ORDER_BOOK_CACHE_MAX_LEVELS", "50000"))
+
+# Order books locales alimentados por un feed websocket (vacío = deshabilitado).
+# Se mantienen los mercados de ORDER_BOOK_FEED_MARKETS (separados por coma;
+# por defecto los de VALID_PAIRS) y se dejan de usar si el feed no envía nada
+# en ORDER_BOOK_FEED_MAX_SILENCE segundos.
+ORDER_BOOK_FEED_URL = os.getenv("ORDER_BOOK_FEED_URL", "")
+ORDER_BOOK_FEED_MARKETS = [
+    market.strip().upper()
+    for market in os.getenv(
+        "ORDER_BOOK_FEED_MARKETS",
+        ",".join(f"{base}-{quote}" for base, quotes in VALID_PAIRS.items() for quote in quotes),
+    ).split(",")
+    if market.strip()
+]
+ORDER_BOOK_FEED_MAX_SILENCE = float(os.getenv("ORDER_BOOK_FEED_MAX_SILENCE", "30"))
+
+# Ruta rápida del modo exacto: una posición directa que cabe en el mejor bid
+# se valoriza con `max_bid` del snapshot de tickers, sin pedir el order book,
+# si el tamaño de ese nivel se observó en un order book de hace menos de
+# TOP_OF_BOOK_MAX_AGE segundos con el mismo precio (0 = deshabilitado).
+TOP_OF_BOOK_MAX_AGE = float(os.getenv("TOP_OF_BOOK_MAX_AGE", "10"))
+
+# Máximo de portafolios por request en POST /v1/portfolio/value/batch.
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+
+# Respuestas de los endpoints de valorización serializadas directamente (orjson
+# si está instalado, si no pydantic_core) sin re-validar contra el
+# response_model. El esquema OpenAPI no cambia.
+FAST_RESPONSES = _env_flag("FAST_RESPONSES")
+
+# Perfilado opt-in: con PROFILING_ENABLED, un request con el header
+# `X-Profile: 1` recibe el desglose por fase en `Server-Timing` y con
+# `X-Profile: cprofile` además se vuelca un .prof en PROFILING_DIR.
+PROFILING_ENABLED = _env_flag("PROFILING_ENABLED")
+PROFILING_DIR = os.getenv("PROFILING_DIR", "/tmp/buda-profiles")
+
+# Máximo de escenarios por request en POST /v1/portfolio/scenarios.
+SCENARIO_MAX_SCENARIOS = int(os.getenv("SCENARIO_MAX_SCENARIOS", "10000"))
+
+# Máximo de valorizaciones memoizadas (portafolio, fiat, versión del snapshot).
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+
+# Pool de conexiones httpx hacia Buda (se crea y cierra en el lifespan).
+BUDA_POOL_MAX_CONNECTIONS = int(os.getenv("BUDA_POOL_MAX_CONNECTIONS", "20"))
+BUDA_POOL_MAX_KEEPALIVE = int(os.getenv("BUDA_POOL_MAX_KEEPALIVE", "10"))
+BUDA_KEEPALIVE_EXPIRY = float(os.getenv("BUDA_KEEPALIVE_EXPIRY", "30"))
+BUDA_CONNECT_TIMEOUT = float(os.getenv("BUDA_CONNECT_TIMEOUT", "2"))
+BUDA_READ_TIMEOUT = float(os.getenv("BUDA_READ_TIMEOUT", "5"))
+# HTTP/2 requiere el paquete opcional `h2` (pip install "httpx[http2]").
+BUDA_HTTP2 = _env_flag("BUDA_HTTP2")
+# Al arrancar abre conexiones y precarga el snapshot de tickers.
+BUDA_WARMUP = _env_flag("BUDA_WARMUP")
+
+# Estrategia de descarga de tickers: "auto" (elige según working set y costo
+# observado), "bulk" (siempre /tickers) o "per_market" (/markets/{id}/ticker
+# para los mercados calientes). Un mercado es caliente si se consultó en los
+# últimos TICKERS_HOT_WINDOW segundos; con más de TICKERS_PER_MARKET_MAX
+# mercados calientes se usa /tickers.
+TICKERS_FETCH_STRATEGY = os.getenv("TICKERS_FETCH_STRATEGY", "auto").strip().lower()
+TICKERS_HOT_WINDOW = float(os.getenv("TICKERS_HOT_WINDOW", "300"))
+TICKERS_PER_MARKET_MAX = int(os.getenv("TICKERS_PER_MARKET_MAX", "8"))
+
+# Segundos que se reutiliza el listado de /markets (grafo de rutas entre monedas).
+MARKETS_CACHE_TTL = float(os.getenv("MARKETS_CACHE_TTL", "3600"))
+
+# Reintentos ante fallos de disponibilidad de Buda (5xx, 429, timeouts):
+# backoff exponencial con jitter, acotado por un presupuesto total por llamada.
+BUDA_RETRY_ATTEMPTS = int(os.getenv("BUDA_RETRY_ATTEMPTS", "2"))
+BUDA_RETRY_BASE_DELAY = float(os.getenv("BUDA_RETRY_BASE_DELAY", "0.1"))
+BUDA_RETRY_MAX_DELAY = float(os.getenv("BUDA_RETRY_MAX_DELAY", "1"))
+# Igual al timeout único anterior: los reintentos no alargan la peor latencia.
+BUDA_REQUEST_BUDGET = float(os.getenv("BUDA_REQUEST_BUDGET", "5"))
+# Presupuesto de llamadas a Buda (token bucket por proceso): BUDA_RATE_LIMIT
+# llamadas por segundo con ráfagas de hasta BUDA_RATE_BURST (0 = sin límite).
+# Sin presupuesto las llamadas esperan en cola; con más de BUDA_QUEUE_MAX
+# esperando o una espera mayor a BUDA_QUEUE_MAX_WAIT segundos se rechazan con
+# 429/503 y Retry-After.
+BUDA_RATE_LIMIT = float(os.getenv("BUDA_RATE_LIMIT", "20"))
+BUDA_RATE_BURST = float(os.getenv("BUDA_RATE_BURST", "40"))
+BUDA_QUEUE_MAX = int(os.getenv("BUDA_QUEUE_MAX", "200"))
+BUDA_QUEUE_MAX_WAIT = float(os.getenv("BUDA_QUEUE_MAX_WAIT", "2"))
+# Circuit breaker: tras N fallos seguidos deja de llamar a Buda durante
+# BUDA_BREAKER_RESET_TIMEOUT segundos y luego prueba con una sola request.
+BUDA_BREAKER_FAILURE_THRESHOLD = int(os.getenv("BUDA_BREAKER_FAILURE_THRESHOLD", "5"))
+BUDA_BREAKER_RESET_TIMEOUT = float(os.getenv("BUDA_BREAKER_RESET_TIMEOUT", "10"))
+# Con Buda caído se sigue sirviendo el último dato bueno (marcado `stale`)
+# mientras no supere esta edad en segundos.
+BUDA_LAST_KNOWN_GOOD_MAX_AGE = float(os.getenv("BUDA_LAST_KNOWN_GOOD_MAX_AGE", "3600"))
+
+# Historial de snapshots para valorizar en un instante pasado: archivo mmap
+# en disco local (vacío = deshabilitado) con HISTORY_CAPACITY registros (ring)
+# y hasta HISTORY_MAX_MARKETS mercados. Con refrescos cada ~20s, 100000
+# registros cubren unas tres semanas (~50 MB con 64 mercados).
+HISTORY_PATH = os.getenv("HISTORY_PATH", "")
+HISTORY_CAPACITY = int(os.getenv("HISTORY_CAPACITY", "100000"))
+HISTORY_MAX_MARKETS = int(os.getenv("HISTORY_MAX_MARKETS", "64"))
+
+# Backend del snapshot de tickers: "memory" (por proceso), "shm" (archivo
+# mmap compartido entre workers del host) o "redis" (servidor RESP compartido
+# entre réplicas). Con backends compartidos un solo worker descarga /tickers
+# por vez (lease de SNAPSHOT_LEASE_TTL segundos) y el resto lee lo publicado.
+SNAPSHOT_STORE = os.getenv("SNAPSHOT_STORE", "memory").strip().lower()
+SNAPSHOT_SHM_PATH = os.getenv("SNAPSHOT_SHM_PATH", "/dev/shm/buda-tickers.snap")
+SNAPSHOT_SHM_SIZE = int(os.getenv("SNAPSHOT_SHM_SIZE", str(1 << 20)))
+SNAPSHOT_REDIS_URL = os.getenv("SNAPSHOT_REDIS_URL", "redis://localhost:6379/0")
+SNAPSHOT_REDIS_PREFIX = os.getenv("SNAPSHOT_REDIS_PREFIX", "buda:tickers")
+SNAPSHOT_LEASE_TTL = float(os.getenv("SNAPSHOT_LEASE_TTL", "10"))
+SNAPSHOT_POLL_INTERVAL = float(os.getenv("SNAPSHOT_POLL_INTERVAL", "0.05"))
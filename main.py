@@ -9,33 +9,254 @@
 #     necesario).
 # - Ver README para notas de seguridad y despliegue en Railway.
 
-from fastapi import FastAPI, status
-from fastapi.responses import JSONResponse
-from models.portfolio import PortfolioRequest, PortfolioResponse, PortfolioExactResponse
-from services.portfolio_service import PortfolioService
-from clients.buda_client import BudaAPIError
-from config.constants import RESPONSE_FOR_PORTFOLIO_VALUE
+import asyncio
+import json
+import math
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Header, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic_core import to_json
+from starlette.requests import ClientDisconnect
+from models.portfolio import (
+    PortfolioAsOfResponse,
+    PortfolioBatchRequest,
+    PortfolioBatchResponse,
+    PortfolioExactResponse,
+    PortfolioMultiRequest,
+    PortfolioMultiResponse,
+    PortfolioRequest,
+    PortfolioResponse,
+    PortfolioScenarioRequest,
+    PortfolioScenarioResponse,
+)
+from services.portfolio_service import PortfolioService, aiter_ndjson_lines, portfolio_pairs, valuation_key
+from services.subscriptions import SubscriptionHub
+from monitoring.metrics import REGISTRY, Gauge, MetricsMiddleware
+from monitoring.profiling import ProfilingMiddleware, enabled as profiling_enabled, phase, profiled, recent_profiles
+from clients.buda_client import BudaAPIError, track_stale_reads
+from pydantic import ValidationError
+
+from clients.refresher import TickersRefresher
+from clients.snapshot_history import SnapshotHistory
+from clients.snapshot_store import build_snapshot_store
+from config.constants import (
+    BUDA_WARMUP,
+    FAST_RESPONSES,
+    HISTORY_CAPACITY,
+    HISTORY_MAX_MARKETS,
+    HISTORY_PATH,
+    ORDER_BOOK_FEED_MARKETS,
+    ORDER_BOOK_FEED_MAX_SILENCE,
+    ORDER_BOOK_FEED_URL,
+    RESPONSE_FOR_PORTFOLIO_VALUE,
+    SNAPSHOT_REDIS_PREFIX,
+    SNAPSHOT_REDIS_URL,
+    SNAPSHOT_SHM_PATH,
+    SNAPSHOT_SHM_SIZE,
+    SNAPSHOT_STORE,
+    TICKERS_MAX_STALENESS,
+    TICKERS_REFRESH_ENABLED,
+    TICKERS_REFRESH_INTERVAL,
+    TICKERS_REFRESH_JITTER,
+)
 
 import uvicorn
 
+try:
+    import orjson
+except ImportError:  # dependencia opcional
+    orjson = None
+
+service = PortfolioService()
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """`StreamingResponse` que emite mientras todavía se lee el body del request.
+
+    El `StreamingResponse` de Starlette escucha `http.disconnect` en paralelo
+    y consume los mensajes de `receive`, robándole el body al endpoint. Aquí
+    la desconexión se detecta al leer el body (`ClientDisconnect`) o al
+    escribir la respuesta (`OSError`).
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+class FastJSONResponse(JSONResponse):
+    """`JSONResponse` serializada con orjson (o pydantic_core) en una pasada.
+
+    Se devuelve ya construida desde los endpoints, así FastAPI no vuelve a
+    validar el dict contra el `response_model`; el contenido debe tener
+    exactamente la forma del modelo.
+    """
+
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return to_json(content)
+
+
+def _respond(content: dict, response: Response | None = None):
+    """Devuelve `content` tal cual o, con FAST_RESPONSES, ya serializado."""
+    if not FAST_RESPONSES:
+        return content
+    with phase("serialization"):
+        return FastJSONResponse(content, headers=None if response is None else dict(response.headers))
+
+
+refresher = TickersRefresher(
+    service.client,
+    interval=TICKERS_REFRESH_INTERVAL,
+    jitter=TICKERS_REFRESH_JITTER,
+    max_staleness=TICKERS_MAX_STALENESS,
+)
+hub = SubscriptionHub(service, refresher)
+service.client.cache.add_listener(hub.on_snapshot)
+
+
+# Métricas que se leen al momento del scrape (sin costo en el hot path).
+REGISTRY.register(Gauge(
+    "tickers_snapshot_age_seconds", "Edad del snapshot de tickers servido.",
+    fn=lambda: None if service.client.cache.snapshot is None else service.client.cache.snapshot.age()
+))
+REGISTRY.register(Gauge(
+    "tickers_snapshot_version", "Versión del snapshot de tickers servido.",
+    fn=lambda: None if service.client.cache.snapshot is None else service.client.cache.snapshot.version
+))
+REGISTRY.register(Gauge(
+    "tickers_refresher_failures", "Fallos acumulados del refresco en segundo plano.",
+    fn=lambda: refresher.failure_count
+))
+for _stat in ("hits", "misses", "evictions", "markets", "levels"):
+    REGISTRY.register(Gauge(
+        f"order_book_cache_{_stat}", f"Caché de order books: {_stat}.",
+        fn=lambda stat=_stat: service.client.order_books.stats()[stat]
+    ))
+REGISTRY.register(Gauge(
+    "buda_circuit_breaker_open", "1 si el circuit breaker hacia Buda no está cerrado.",
+    fn=lambda: 0 if service.client.breaker.state == "closed" else 1
+))
+REGISTRY.register(Gauge(
+    "buda_upstream_queue", "Llamadas a Buda esperando presupuesto.",
+    fn=lambda: service.client.scheduler.waiting
+))
+REGISTRY.register(Gauge("portfolio_subscriptions", "Suscripciones WebSocket activas.", fn=lambda: len(hub)))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    service.client.cache.store = build_snapshot_store(
+        SNAPSHOT_STORE, SNAPSHOT_SHM_PATH, SNAPSHOT_SHM_SIZE, SNAPSHOT_REDIS_URL, SNAPSHOT_REDIS_PREFIX
+    )
+    if HISTORY_PATH:
+        service.history = SnapshotHistory(HISTORY_PATH, HISTORY_CAPACITY, HISTORY_MAX_MARKETS)
+    await service.client.start()
+    # En segundo plano: con Buda caído los reintentos de /markets no deben
+    # demorar el arranque; mientras tanto las rutas usan solo los tickers.
+    markets_task = asyncio.create_task(service.client.load_markets())
+    if BUDA_WARMUP:
+        await service.client.warm_up()
+    if TICKERS_REFRESH_ENABLED:
+        refresher.start()
+    if ORDER_BOOK_FEED_URL:
+        service.client.start_order_book_feed(ORDER_BOOK_FEED_URL, ORDER_BOOK_FEED_MARKETS, ORDER_BOOK_FEED_MAX_SILENCE)
+    try:
+        yield
+    finally:
+        markets_task.cancel()
+        with suppress(asyncio.CancelledError, Exception):
+            await markets_task
+        await service.client.stop_order_book_feed()
+        await refresher.stop()
+        await service.client.aclose()
+        await service.client.cache.store.close()
+        if service.history is not None:
+            await service.history.aclose()
+            service.history = None
+
+
 app = FastAPI(
     title="Portfolio Valuation API",
     description="API para calcular el valor total de un portafolio de criptomonedas en moneda fiat",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
-service = PortfolioService()
+app.add_middleware(MetricsMiddleware)
+# Sin PROFILING_ENABLED solo agrega un `if` por request.
+app.add_middleware(ProfilingMiddleware)
 
 @app.exception_handler(BudaAPIError)
 async def buda_api_error_handler(request, exc: BudaAPIError):
+    headers = None
+    if exc.retry_after is not None:
+        headers = {"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": str(exc)}
+        content={"detail": str(exc)},
+        headers=headers
     )
 
+def _etag(key: str) -> str:
+    # Débil: el cuerpo puede variar en forma (p. ej. mayúsculas de la fiat o
+    # el flag `stale`) sin cambiar el valor.
+    return f'W/"{key[:32]}"'
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags)
+
+
 @app.get("/", tags=["Health"])
 async def read_root():
     return {"Hello": "Hello Buda!"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/v1/cache/status", tags=["Health"], summary="Estado de la caché de precios")
+async def cache_status():
+    """Edad y versión del snapshot de tickers y estado del refresco en segundo plano."""
+    snapshot = service.client.cache.snapshot
+    return {
+        "tickers": {
+            "store": SNAPSHOT_STORE,
+            "version": None if snapshot is None else snapshot.version,
+            "partial": None if snapshot is None else snapshot.partial,
+            "age": None if snapshot is None else snapshot.age(),
+            "refresher": refresher.stats(),
+        },
+        "fetch_planner": service.client.planner.stats(),
+        "order_books": service.client.order_books.stats(),
+        "order_book_feed": None if service.client.local_books is None else service.client.local_books.stats(),
+        "circuit_breaker": service.client.breaker.stats(),
+        "upstream_scheduler": service.client.scheduler.stats(),
+        "results": service.results.stats(),
+        "history": None if service.history is None else service.history.stats(),
+        "subscriptions": len(hub),
+    }
+
+@app.get("/v1/debug/profiles", include_in_schema=False)
+async def debug_profiles():
+    """Últimos requests perfilados con `X-Profile`; 404 sin PROFILING_ENABLED."""
+    if not profiling_enabled():
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"detail": "Not Found"})
+    return list(recent_profiles)
+
+
 @app.post(
     "/v1/portfolio/value",
     tags=["Portfolio"],
@@ -44,11 +265,27 @@ async def read_root():
     status_code=status.HTTP_200_OK,
     responses=RESPONSE_FOR_PORTFOLIO_VALUE
 )
-async def calculate_portfolio_value(portfolio: PortfolioRequest):
+@profiled
+async def calculate_portfolio_value(
+    portfolio: PortfolioRequest,
+    response: Response,
+    if_none_match: str | None = Header(None),
+):
+    """Valor del portafolio con los últimos precios.
 
-    total_value = await service.calculate_total_value(portfolio)
+    La respuesta lleva un `ETag` que solo cambia con el portafolio o con un
+    snapshot de precios nuevo; con `If-None-Match` igual se responde 304.
+    """
+    stale = track_stale_reads()
+    total_value, key = await service.calculate_total_value_cached(portfolio)
+    etag = _etag(key)
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
 
-    return {"portfolio_value": total_value, "fiat_currency": portfolio.fiat_currency}
+    return _respond(
+        {"portfolio_value": total_value, "fiat_currency": portfolio.fiat_currency, "stale": bool(stale)}, response
+    )
 
 
 @app.post(
@@ -58,13 +295,195 @@ async def calculate_portfolio_value(portfolio: PortfolioRequest):
     response_model=PortfolioExactResponse,
     status_code=status.HTTP_200_OK,
 )
-async def calculate_portfolio_value_exact(portfolio: PortfolioRequest):
+@profiled
+async def calculate_portfolio_value_exact(
+    portfolio: PortfolioRequest,
+    response: Response,
+    if_none_match: str | None = Header(None),
+):
     """Endpoint que calcula el valor exacto para un `PortfolioRequest` (todo el portafolio).
 
     Devuelve el diccionario {"portfolio_value": total, "fiat_currency": fiat, "breakdown": {...}}.
+    El `ETag` se deriva del portafolio y del desglose obtenido (304 con
+    `If-None-Match` igual).
     """
-    total_value, breakdown = await service.calculate_total_value_exact(portfolio)
-    return {"portfolio_value": total_value, "fiat_currency": portfolio.fiat_currency, "breakdown": breakdown}
+    stale = track_stale_reads()
+    routes: dict = {}
+    paths: dict = {}
+    total_value, breakdown = await service.calculate_total_value_exact(portfolio, routes=routes, paths=paths)
+    etag = _etag(valuation_key(portfolio, sorted(breakdown.items()), sorted(routes.items())))
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return _respond({
+        "portfolio_value": total_value,
+        "fiat_currency": portfolio.fiat_currency,
+        "breakdown": breakdown,
+        "paths": paths,
+        "routes": routes,
+        "stale": bool(stale),
+    }, response)
+
+
+@app.post(
+    "/v1/portfolio/value/batch",
+    tags=["Portfolio"],
+    summary="Calcular valor de un lote de portafolios",
+    response_model=PortfolioBatchResponse,
+    status_code=status.HTTP_200_OK,
+)
+@profiled
+async def calculate_portfolio_value_batch(batch: PortfolioBatchRequest):
+    """Valoriza todos los portafolios del lote contra un mismo snapshot de precios.
+
+    Los errores de un ítem (par inválido, cantidad negativa, par inexistente)
+    se informan en ese ítem sin afectar al resto del lote.
+    """
+    stale = track_stale_reads()
+    snapshot, values = await service.calculate_batch_value(batch.items)
+    # Cada ítem lleva todas las claves de `PortfolioBatchItem` para que la
+    # ruta rápida (sin response_model) emita el mismo JSON.
+    results = []
+    for index, (item, value) in enumerate(zip(batch.items, values)):
+        if isinstance(value, BudaAPIError):
+            results.append({
+                "index": index,
+                "portfolio_value": None,
+                "fiat_currency": item.fiat_currency,
+                "error": {"status_code": value.status_code, "detail": str(value)},
+            })
+        else:
+            results.append({"index": index, "portfolio_value": value, "fiat_currency": item.fiat_currency, "error": None})
+    return _respond({"snapshot_version": snapshot.version, "results": results, "stale": bool(stale)})
+
+
+@app.post(
+    "/v1/portfolio/value/multi",
+    tags=["Portfolio"],
+    summary="Calcular valor de portafolio en varias monedas fiat",
+    response_model=PortfolioMultiResponse,
+    status_code=status.HTTP_200_OK,
+)
+@profiled
+async def calculate_portfolio_value_multi(portfolio: PortfolioMultiRequest, exact: bool = False):
+    """Valoriza el portafolio en cada moneda de `fiat_currencies` con una sola
+    validación y un solo snapshot (o, con `exact=true`, llenando contra los
+    order books descargados una vez y en paralelo).
+    """
+    stale = track_stale_reads()
+    values, breakdown = await service.calculate_multi_value(portfolio, exact)
+    return _respond({"values": values, "breakdown": breakdown, "stale": bool(stale)})
+
+
+@app.post(
+    "/v1/portfolio/value/as_of",
+    tags=["Portfolio"],
+    summary="Valor del portafolio en un instante pasado",
+    response_model=PortfolioAsOfResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def calculate_portfolio_value_as_of(portfolio: PortfolioRequest, as_of: datetime):
+    """Valoriza con el último snapshot registrado hasta `as_of` (ISO 8601 o
+    epoch; sin zona horaria se asume UTC). Lee solo el historial en disco
+    (`HISTORY_PATH`), sin llamar a Buda.
+    """
+    if as_of.tzinfo is None:
+        as_of = as_of.replace(tzinfo=timezone.utc)
+    timestamp = as_of.timestamp()
+    total_value, snapshot_at = service.calculate_value_as_of(portfolio, timestamp)
+    return _respond({
+        "portfolio_value": total_value,
+        "fiat_currency": portfolio.fiat_currency,
+        "as_of": timestamp,
+        "snapshot_at": snapshot_at,
+    })
+
+
+@app.post(
+    "/v1/portfolio/scenarios",
+    tags=["Portfolio"],
+    summary="Revalorizar un portafolio bajo escenarios de estrés",
+    response_model=PortfolioScenarioResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def calculate_portfolio_scenarios(scenario: PortfolioScenarioRequest):
+    """Aplica una matriz de shocks (o una grilla) a los precios del snapshot
+    vigente y devuelve el valor en cada escenario más cuantiles, mínimo,
+    máximo y promedio. Con `depth=true` la base es el valor de liquidación
+    contra los order books y se informa el slippage por moneda.
+    """
+    stale = track_stale_reads()
+    result = await service.calculate_scenarios(scenario)
+    result["stale"] = bool(stale)
+    return _respond(result)
+
+
+@app.post(
+    "/v1/portfolio/value/stream",
+    tags=["Portfolio"],
+    summary="Valorizar un stream NDJSON de portafolios",
+    status_code=status.HTTP_200_OK,
+)
+async def calculate_portfolio_value_stream(request: Request, exact: bool = False):
+    """Recibe un body NDJSON (un `PortfolioRequest` por línea, puede venir
+    chunked) y emite un resultado NDJSON por línea a medida que se calcula.
+
+    Todas las líneas usan un mismo snapshot de precios; con `exact=true` se
+    llena contra los order books, descargando cada uno una sola vez.
+    """
+    # El snapshot se obtiene antes de responder para que un error de Buda
+    # llegue como status HTTP y no a mitad del stream.
+    snapshot = None if exact else await service.client.get_snapshot()
+
+    async def results():
+        async for result in service.stream_values(aiter_ndjson_lines(request.stream()), exact, snapshot):
+            yield json.dumps(result) + "\n"
+
+    return DuplexStreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.websocket("/v1/portfolio/ws")
+async def portfolio_value_ws(websocket: WebSocket):
+    """Suscripción en vivo al valor de un portafolio.
+
+    El cliente envía un `PortfolioRequest` (JSON) al conectarse y recibe el
+    valor actual; luego solo recibe un mensaje nuevo cuando un refresco de
+    precios cambia algún mercado de su portafolio.
+    """
+    await websocket.accept()
+    try:
+        portfolio = PortfolioRequest.model_validate_json(await websocket.receive_text())
+        subscription = hub.subscribe(portfolio, await service.client.get_snapshot(portfolio_pairs(portfolio)))
+    except ValidationError as e:
+        await websocket.send_json({"error": {"status_code": 422, "detail": str(e)}})
+        await websocket.close(code=1008)
+        return
+    except BudaAPIError as e:
+        await websocket.send_json({"error": {"status_code": e.status_code, "detail": str(e)}})
+        await websocket.close(code=1008 if e.status_code == 400 else 1011)
+        return
+    except WebSocketDisconnect:
+        return
+
+    async def forward():
+        while True:
+            await websocket.send_json(await subscription.queue.get())
+
+    sender = asyncio.create_task(forward())
+    try:
+        # Solo se espera la desconexión; los mensajes entrantes se ignoran.
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(subscription)
+        sender.cancel()
+        # Se recupera el resultado del sender (cancelado o con el error de
+        # un send_json fallido) para no dejar una excepción sin leer.
+        with suppress(asyncio.CancelledError, Exception):
+            await sender
+        await hub.stop_idle_refresher()
 
 # definir endpoint
 
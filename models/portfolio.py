@@ -1,5 +1,13 @@
-from typing import Dict
-from pydantic import BaseModel, Field, ConfigDict
+from typing import Annotated, Dict, List, Optional
+from pydantic import BaseModel, Field, ConfigDict, model_validator
+
+from config.constants import BATCH_MAX_ITEMS, SCENARIO_MAX_SCENARIOS
+
+# Campo común de las respuestas que pueden servirse con el último dato bueno.
+Stale = Annotated[bool, Field(
+    title="Datos desactualizados",
+    description="True si Buda no respondió y se usó el último dato bueno en caché."
+)]
 
 
 class PortfolioRequest(BaseModel):
@@ -27,13 +35,45 @@ class PortfolioRequest(BaseModel):
     fiat_currency: str = Field(
         ...,
         title="Moneda Fiat",
-        description="Moneda fiat destino. Valores soportados: CLP, COP, PEN, USDC, BTC. La combinación cripto-fiat debe ser válida.",
+        description="Moneda destino: CLP, COP, PEN o cualquier moneda de Buda (p. ej. USDC, BTC). Si no hay mercado directo se valoriza por la mejor ruta con hasta dos monedas intermedias.",
         examples=["CLP"],
         min_length=2,
         max_length=10
     )
 
 
+class PortfolioMultiRequest(BaseModel):
+    """Portafolio a valorizar en varias monedas fiat (solo /v1/portfolio/value/multi)."""
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "portfolio": {"BTC": 0.5, "ETH": 2.0},
+                "fiat_currencies": ["CLP", "COP", "PEN"]
+            }
+        }
+    )
+
+    portfolio: Dict[str, float] = Field(
+        ...,
+        title="Portfolio",
+        description="Objeto con pares criptomoneda:cantidad.",
+        examples=[{"BTC": 0.5, "ETH": 2.0}]
+    )
+    fiat_currencies: List[Annotated[str, Field(min_length=2, max_length=10)]] = Field(
+        ...,
+        title="Monedas Fiat",
+        description="Monedas destino, valorizadas en una sola pasada.",
+        examples=[["CLP", "COP", "PEN"]],
+        min_length=1,
+        max_length=10
+    )
+
+    def fiat_targets(self) -> List[str]:
+        """Monedas destino en mayúsculas, sin repetir y en el orden pedido."""
+        return list(dict.fromkeys(fiat.upper() for fiat in self.fiat_currencies))
+
+
 class PortfolioResponse(BaseModel):
     """Esquema de respuesta para el cálculo de valor de portafolio"""
     
@@ -58,6 +98,43 @@ class PortfolioResponse(BaseModel):
         description="Moneda en la que se calculó el valor total",
         examples=["CLP"]
     )
+    stale: Stale = False
+
+
+class PortfolioMultiResponse(BaseModel):
+    """Valor del portafolio en varias monedas fiat a partir de un mismo snapshot."""
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "values": {"CLP": 46312554.36, "PEN": 183245.1},
+                "breakdown": {
+                    "CLP": {"BTC": 40000000.0, "ETH": 6000000.0, "USDT": 312554.36},
+                    "PEN": {"BTC": 158000.0, "ETH": 23980.0, "USDT": 1265.1},
+                },
+                "stale": False
+            }
+        }
+    )
+
+    values: Dict[str, float] = Field(..., title="Valor por moneda fiat")
+    breakdown: Dict[str, Dict[str, float]] = Field(
+        ..., title="Desglose", description="Por moneda fiat, el valor de cada moneda del portafolio."
+    )
+    stale: Stale = False
+
+
+class PortfolioAsOfResponse(BaseModel):
+    """Valor del portafolio en un instante pasado (historial de snapshots)."""
+
+    portfolio_value: float = Field(..., title="Valor Total")
+    fiat_currency: str = Field(..., title="Moneda Fiat")
+    as_of: float = Field(..., title="Instante solicitado", description="Epoch en segundos.")
+    snapshot_at: float = Field(
+        ...,
+        title="Instante del snapshot",
+        description="Epoch en segundos del último snapshot registrado hasta `as_of`."
+    )
 
 
 class PortfolioExactResponse(BaseModel):
@@ -71,6 +148,14 @@ class PortfolioExactResponse(BaseModel):
                 "breakdown": {
                     "BTC": 30000000.0,
                     "ETH": 1000000.0
+                },
+                "paths": {
+                    "BTC": "order_book",
+                    "ETH": "top_of_book"
+                },
+                "routes": {
+                    "BTC": ["BTC-CLP"],
+                    "ETH": ["ETH-CLP"]
                 }
             }
         }
@@ -79,6 +164,17 @@ class PortfolioExactResponse(BaseModel):
     portfolio_value: float = Field(..., title="Valor Total (Exacto)")
     fiat_currency: str = Field(..., title="Moneda Fiat")
     breakdown: dict = Field(..., title="Desglose por moneda", description="Mapa moneda → valor en fiat")
+    paths: Dict[str, str] = Field(
+        default_factory=dict,
+        title="Fuente por moneda",
+        description="top_of_book (mejor bid del snapshot, sin pedir el libro), local_book (feed), cached_book (caché), order_book (descarga) o identity (la moneda es la fiat)."
+    )
+    routes: Dict[str, List[str]] = Field(
+        default_factory=dict,
+        title="Rutas",
+        description="Mapa moneda → mercados recorridos hasta la fiat (más de uno si no hay mercado directo)."
+    )
+    stale: Stale = False
 
 
 class PortfolioExactRequest(BaseModel):
@@ -104,3 +200,131 @@ class PortfolioExactRequest(BaseModel):
         title="Cantidad",
         description="Cantidad positiva de la moneda base a comprar."
     )
+
+
+class PortfolioBatchRequest(BaseModel):
+    """Lote de portafolios a valorizar contra un mismo snapshot de precios."""
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "items": [
+                    {"portfolio": {"BTC": 0.5, "ETH": 2.0}, "fiat_currency": "CLP"},
+                    {"portfolio": {"USDT": 1000}, "fiat_currency": "PEN"}
+                ]
+            }
+        }
+    )
+
+    items: List[PortfolioRequest] = Field(
+        ...,
+        title="Portafolios",
+        description=f"Lista de portafolios a valorizar (máximo {BATCH_MAX_ITEMS}).",
+        max_length=BATCH_MAX_ITEMS
+    )
+
+
+class PortfolioBatchError(BaseModel):
+    """Error de un ítem del lote (mismo formato que las respuestas de error)."""
+
+    status_code: int = Field(..., title="Código HTTP equivalente")
+    detail: str = Field(..., title="Detalle")
+
+
+class PortfolioBatchItem(BaseModel):
+    """Resultado de un ítem del lote: valor o error, nunca ambos."""
+
+    index: int = Field(..., title="Posición en el lote")
+    portfolio_value: Optional[float] = Field(None, title="Valor Total")
+    fiat_currency: str = Field(..., title="Moneda Fiat")
+    error: Optional[PortfolioBatchError] = Field(None, title="Error")
+
+
+class PortfolioBatchResponse(BaseModel):
+    """Respuesta del lote: un resultado por ítem, en el mismo orden."""
+
+    snapshot_version: int = Field(..., title="Versión del snapshot de precios usado")
+    results: List[PortfolioBatchItem] = Field(..., title="Resultados")
+    stale: Stale = False
+
+
+class ScenarioGrid(BaseModel):
+    """Grilla de shocks uniformes: `steps` escenarios de `start` a `stop`."""
+
+    start: float = Field(..., ge=-1, title="Shock inicial", description="Variación relativa, p. ej. -0.01 = -1%.")
+    stop: float = Field(..., ge=-1, title="Shock final", description="Variación relativa, p. ej. -0.5 = -50%.")
+    steps: int = Field(..., ge=1, le=SCENARIO_MAX_SCENARIOS, title="Cantidad de escenarios")
+    assets: Optional[List[str]] = Field(
+        None,
+        title="Monedas afectadas",
+        description="Monedas a las que se aplica el shock (por defecto todas; el resto queda en 0)."
+    )
+
+
+class PortfolioScenarioRequest(PortfolioRequest):
+    """Portafolio más una matriz de shocks o una grilla para generarla."""
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "portfolio": {"BTC": 0.5, "ETH": 2.0},
+                "fiat_currency": "CLP",
+                "grid": {"start": -0.01, "stop": -0.5, "steps": 50},
+                "quantiles": [0.01, 0.05, 0.5],
+                "depth": False
+            }
+        }
+    )
+
+    shocks: Optional[List[List[float]]] = Field(
+        None,
+        title="Matriz de shocks",
+        description="Una fila por escenario y una columna por moneda, en el orden del portafolio; cada valor es la variación relativa del precio (>= -1).",
+        min_length=1,
+        max_length=SCENARIO_MAX_SCENARIOS
+    )
+    grid: Optional[ScenarioGrid] = Field(None, title="Grilla de shocks")
+    quantiles: List[float] = Field(
+        default=[0.01, 0.05, 0.5, 0.95, 0.99],
+        title="Cuantiles",
+        description="Cuantiles (0-1) de la distribución de valores a reportar."
+    )
+    depth: bool = Field(
+        False,
+        title="Usar profundidad",
+        description="Si es true se parte del valor de liquidación contra el order book (incluye slippage)."
+    )
+
+    @model_validator(mode="after")
+    def check_scenarios(self):
+        if (self.shocks is None) == (self.grid is None):
+            raise ValueError("Se debe indicar exactamente uno de 'shocks' o 'grid'.")
+        if self.shocks is not None:
+            width = len(self.portfolio)
+            for row in self.shocks:
+                if len(row) != width:
+                    raise ValueError(f"Cada fila de 'shocks' debe tener {width} columnas (una por moneda).")
+                if any(shock < -1 for shock in row):
+                    raise ValueError("Los shocks deben ser >= -1.")
+        if any(not 0 <= q <= 1 for q in self.quantiles):
+            raise ValueError("Los cuantiles deben estar entre 0 y 1.")
+        return self
+
+
+class PortfolioScenarioResponse(BaseModel):
+    """Valor del portafolio en cada escenario y su resumen."""
+
+    fiat_currency: str = Field(..., title="Moneda Fiat")
+    base_value: float = Field(..., title="Valor sin shock")
+    positions: Dict[str, float] = Field(
+        ..., title="Valor por moneda", description="Valor sin shock de cada moneda (de liquidación si depth=true)."
+    )
+    slippage: Optional[Dict[str, float]] = Field(
+        None, title="Slippage", description="Diferencia entre valor a último precio y valor de liquidación (solo depth=true)."
+    )
+    values: List[float] = Field(..., title="Valor por escenario")
+    quantiles: Dict[str, float] = Field(..., title="Cuantiles de los valores")
+    min: float = Field(..., title="Mínimo")
+    max: float = Field(..., title="Máximo")
+    mean: float = Field(..., title="Promedio")
+    stale: Stale = False
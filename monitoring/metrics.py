@@ -0,0 +1,237 @@
+# SUPUESTOS UTILIZADOS (métricas):
+# - Formato de texto de Prometheus sin depender de `prometheus_client`.
+# - Pensado para quedar activo a plena carga: los hijos con etiquetas se
+#   crean una sola vez (`labels(...)` se cachea y los del hot path se
+#   pre-ligan a nivel de módulo), así una observación es un bisect y unas
+#   sumas, sin armar dicts de etiquetas por request.
+# - Un solo event loop por proceso: no se usan locks.
+
+import time
+from bisect import bisect_left
+from typing import Callable
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def labels(self, *values) -> object:
+        """Hijo para `values` (en el orden de `labelnames`), creado una sola vez."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in self._children.items():
+            lines.extend(self._render_child(_format_labels(self.labelnames, key), key, child))
+        return lines
+
+    def _render_child(self, labels: str, key: tuple[str, ...], child) -> list[str]:
+        return [f"{self.name}{labels} {child.value}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+
+class Gauge(_Metric):
+    """Gauge normal o calculado al momento del scrape con `fn`."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), fn: Callable[[], float | None] | None = None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def render(self) -> list[str]:
+        if self.fn is None:
+            return super().render()
+        value = self.fn()
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, labels: str, key: tuple[str, ...], child: _HistogramChild) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), child.counts):
+            cumulative += count
+            le = _format_labels(self.labelnames, key, f'le="{bound}"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Registra `metric`; si ya existe una con ese nombre la reemplaza."""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Latencia de requests HTTP por ruta.", ("method", "route")
+))
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "Requests HTTP por ruta y status.", ("method", "route", "status")
+))
+
+TICKERS_CACHE_REQUESTS = REGISTRY.register(Counter(
+    "tickers_cache_requests_total", "Consultas al snapshot de tickers.", ("result",)
+))
+TICKERS_CACHE_HIT = TICKERS_CACHE_REQUESTS.labels("hit")
+TICKERS_CACHE_MISS = TICKERS_CACHE_REQUESTS.labels("miss")
+RESULT_CACHE_REQUESTS = REGISTRY.register(Counter(
+    "valuation_cache_requests_total", "Consultas a la caché de valorizaciones.", ("result",)
+))
+RESULT_CACHE_HIT = RESULT_CACHE_REQUESTS.labels("hit")
+RESULT_CACHE_MISS = RESULT_CACHE_REQUESTS.labels("miss")
+TICKERS_FETCHES = REGISTRY.register(Counter(
+    "tickers_fetches_total", "Descargas de tickers por estrategia (bulk o per_market).", ("strategy",)
+))
+TICKERS_REFRESHES = REGISTRY.register(Counter(
+    "tickers_cache_refreshes_total", "Snapshots de tickers nuevos adoptados."
+)).labels()
+
+EXACT_FILL_PATHS = REGISTRY.register(Counter(
+    "exact_fill_paths_total",
+    "Posiciones del modo exacto por fuente (top_of_book, local_book, cached_book, order_book, identity).",
+    ("path",)
+))
+
+UPSTREAM_DURATION = REGISTRY.register(Histogram(
+    "buda_upstream_request_duration_seconds", "Latencia de requests a Buda.", ("endpoint",)
+))
+UPSTREAM_TICKERS_DURATION = UPSTREAM_DURATION.labels("tickers")
+UPSTREAM_ORDER_BOOK_DURATION = UPSTREAM_DURATION.labels("order_book")
+UPSTREAM_MARKETS_DURATION = UPSTREAM_DURATION.labels("markets")
+UPSTREAM_MARKET_TICKER_DURATION = UPSTREAM_DURATION.labels("ticker")
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "buda_upstream_errors_total", "Errores de requests a Buda por status_code de BudaAPIError.", ("endpoint", "status_code")
+))
+UPSTREAM_RETRIES = REGISTRY.register(Counter(
+    "buda_upstream_retries_total", "Reintentos de requests a Buda.", ("endpoint",)
+))
+STALE_RESPONSES = REGISTRY.register(Counter(
+    "buda_stale_reads_total", "Datos servidos desde el último valor bueno con Buda caído.", ("kind",)
+))
+UPSTREAM_SHED = REGISTRY.register(Counter(
+    "buda_upstream_shed_total", "Llamadas a Buda rechazadas por falta de presupuesto.", ("reason",)
+))
+UPSTREAM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "buda_upstream_in_flight", "Requests a Buda en curso."
+)).labels()
+
+
+class MetricsMiddleware:
+    """Middleware ASGI que mide la latencia de cada request por ruta.
+
+    La ruta es la plantilla (p. ej. `/v1/portfolio/value`), no la URL, para
+    que la cardinalidad quede acotada.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            HTTP_REQUEST_DURATION.labels(method, path).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, path, status_code).inc()
@@ -0,0 +1,172 @@
+# SUPUESTOS UTILIZADOS (perfilado por request):
+# - Opt-in doble: PROFILING_ENABLED en el proceso y el header `X-Profile` en
+#   el request ("1" = solo fases; "cprofile" = además un volcado de cProfile
+#   en PROFILING_DIR, legible con snakeviz, flameprof, py-spy, etc.).
+# - Apagado, el costo es un `if` por request en el middleware y un
+#   `ContextVar.get` por fase instrumentada.
+# - Las fases son planas (no se anidan) y se acumulan por nombre: con
+#   llamadas en paralelo (gather) la suma puede superar el tiempo total.
+#   - validation: desde que llega el request hasta que corre el endpoint
+#     (lectura del body y validación pydantic).
+#   - cache: consultas a las cachés de snapshot, order books y resultados.
+#   - upstream: espera de descargas a Buda (incluye esperar la de otra
+#     corrutina por single-flight).
+#   - fill: productos punto y llenado contra order books.
+#   - serialization: desde que termina el endpoint hasta el inicio de la
+#     respuesta (o el render de la ruta rápida).
+# - El desglose vuelve en el header `Server-Timing` (ms), visible en las
+#   devtools del navegador; los últimos RECENT_MAX quedan en memoria.
+# - cProfile mide todo el hilo: con tráfico concurrente incluye trabajo de
+#   otros requests. Solo un request se perfila con cProfile a la vez.
+
+import cProfile
+import functools
+import os
+import time
+from collections import deque
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from config.constants import PROFILING_DIR, PROFILING_ENABLED
+
+RECENT_MAX = 100
+
+_current: ContextVar["RequestProfile | None"] = ContextVar("request_profile", default=None)
+_NOOP = nullcontext()
+_cprofile_busy = False
+recent_profiles: deque[dict] = deque(maxlen=RECENT_MAX)
+
+
+class RequestProfile:
+    """Fases acumuladas de un request perfilado."""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.endpoint_done: float | None = None
+        self.total: float | None = None
+        self.profile_file: str | None = None
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        entries = [f"{name};dur={1000 * seconds:.3f}" for name, seconds in self.phases.items()]
+        if self.total is not None:
+            entries.append(f"total;dur={1000 * self.total:.3f}")
+        return ", ".join(entries)
+
+    def as_dict(self) -> dict:
+        return {"route": self.route, "total": self.total, "phases": dict(self.phases), "profile_file": self.profile_file}
+
+
+class _Phase:
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile: RequestProfile, name: str):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.profile.add(self.name, time.perf_counter() - self.start)
+
+
+def enabled() -> bool:
+    """True si PROFILING_ENABLED está activo (también habilita /v1/debug/profiles)."""
+    return PROFILING_ENABLED
+
+
+def phase(name: str):
+    """Context manager que acumula el tiempo del bloque en la fase `name`.
+
+    Sin un request perfilado en curso devuelve un context manager vacío.
+    """
+    profile = _current.get()
+    if profile is None:
+        return _NOOP
+    return _Phase(profile, name)
+
+
+def profiled(endpoint):
+    """Marca el inicio y el fin del endpoint para las fases de validación y serialización."""
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return await endpoint(*args, **kwargs)
+        profile.add("validation", time.perf_counter() - profile.started)
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            profile.endpoint_done = time.perf_counter()
+
+    return wrapper
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI que perfila los requests con `X-Profile` si está habilitado."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _cprofile_busy
+        if not PROFILING_ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        mode = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                mode = value.decode("latin-1").strip().lower()
+                break
+        if not mode or mode in ("0", "false", "off"):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["path"])
+        token = _current.set(profile)
+        profiler = None
+        if mode == "cprofile" and PROFILING_DIR and not _cprofile_busy:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                _cprofile_busy = True
+            except ValueError:  # otro profiler activo en el proceso
+                profiler = None
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                now = time.perf_counter()
+                if profile.endpoint_done is not None:
+                    profile.add("serialization", now - profile.endpoint_done)
+                profile.total = now - profile.started
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", profile.server_timing().encode()))
+                if profiler is not None:
+                    profile.profile_file = _profile_path(scope)
+                    headers.append((b"x-profile-file", os.path.basename(profile.profile_file).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if profiler is not None:
+                profiler.disable()
+                _cprofile_busy = False
+                if profile.profile_file is not None:
+                    os.makedirs(PROFILING_DIR, exist_ok=True)
+                    profiler.dump_stats(profile.profile_file)
+            recent_profiles.append(profile.as_dict())
+
+
+def _profile_path(scope) -> str:
+    route = scope["path"].strip("/").replace("/", "_") or "root"
+    return os.path.join(PROFILING_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}-{time.time_ns() % 10**9:09d}-{route}.prof")
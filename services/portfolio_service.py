@@ -1,55 +1,335 @@
 # SUPUESTOS UTILIZADOS (servicio de portafolio):
 # - Valida localmente pares cripto-fiat contra VALID_PAIRS para evitar llamadas
-#   innecesarias a la API externa.
+#   innecesarias a la API externa. Pares fuera de VALID_PAIRS con monedas
+#   conocidas se aceptan y se valorizan por rutas (ver clients/market_graph.py).
 # - No admite cantidades negativas en el portafolio (se consideran inválidas).
 # - Usa BudaClient para consulta de precios y propaga BudaAPIError para que
 #   el handler global de FastAPI genere respuestas HTTP apropiadas.
+# - Las consultas por moneda se lanzan en paralelo (el límite de concurrencia
+#   hacia Buda lo impone BudaClient). Los resultados se combinan siempre en el
+#   orden del portafolio y el primer error cancela las consultas pendientes.
+# - Los lotes (batch y NDJSON) se valorizan contra un único snapshot; en modo
+#   exacto un stream reutiliza cada order book descargado para todas sus
+#   líneas.
+# - Las valorizaciones por ticker se memorizan por (portafolio, fiat,
+#   versión del snapshot) en un LRU acotado que se vacía con cada snapshot
+#   nuevo; la misma clave sirve de ETag en la API.
+# - Los escenarios de estrés aplican shocks relativos a los precios del
+#   snapshot vigente: el valor de cada escenario es base + Σ wᵢ·shockᵢ con
+#   wᵢ el valor de cada posición. Con `depth` wᵢ es el valor de liquidación
+#   contra el order book, de modo que el slippage queda incluido en la base.
+# - En modo exacto, una posición con mercado directo que cabe en el mejor bid
+#   se valoriza con el `max_bid` del snapshot (ruta "top_of_book") si el
+#   order book no está ya en memoria; solo las posiciones mayores piden el
+#   libro completo. Se informa por moneda la fuente usada.
+# - La valorización histórica (`as_of`) usa solo el historial en disco
+#   (clients/snapshot_history.py): no consulta a Buda. Los pares sin mercado
+#   directo se rutean con los precios de ese mismo registro.
 
-from clients.buda_client import BudaClient, BudaAPIError, VALID_PAIRS
-from models.portfolio import PortfolioExactRequest, PortfolioRequest
+import asyncio
+import hashlib
+import json
+import math
+import operator
+from array import array
+from collections import OrderedDict
+from typing import AsyncIterable, AsyncIterator, Awaitable, Iterable
+
+from pydantic import ValidationError
+
+from clients.buda_client import BudaClient, BudaAPIError, TickerSnapshot, VALID_PAIRS
+from clients.market_graph import SELL, Hop, Route, RouteTable, split_market
+from clients.order_book import OrderBookDepth
+from clients.snapshot_history import SnapshotHistory
+from config.constants import RESULT_CACHE_MAX_ENTRIES
+from models.portfolio import PortfolioExactRequest, PortfolioMultiRequest, PortfolioRequest, PortfolioScenarioRequest
+from monitoring.metrics import EXACT_FILL_PATHS, RESULT_CACHE_HIT, RESULT_CACHE_MISS
+from monitoring.profiling import phase
+
+
+async def _gather_ordered(aws: Iterable[Awaitable]) -> list:
+    """Ejecuta `aws` en paralelo y devuelve sus resultados en el mismo orden.
+
+    Ante el primer error cancela las tareas pendientes. Si varias fallaron
+    antes de la cancelación, se propaga el error de la primera en el orden de
+    entrada, para que el resultado no dependa de qué respuesta llegó antes.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    if not tasks:
+        return []
+    try:
+        _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    except BaseException:
+        pending = tasks
+        raise
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+    return [task.result() for task in tasks]
+
+
+async def aiter_ndjson_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Separa un flujo de bytes en líneas NDJSON no vacías.
+
+    Solo se retiene en memoria la línea incompleta en curso.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+def portfolio_pairs(portfolio_data: PortfolioRequest) -> list[tuple[str, str]]:
+    """Pares (base, fiat) que hay que valorizar para `portfolio_data`."""
+    fiat_upper = portfolio_data.fiat_currency.upper()
+    return [(base.upper(), fiat_upper) for base in portfolio_data.portfolio]
+
+
+def valuation_key(portfolio_data: PortfolioRequest, *extra) -> str:
+    """Hash canónico (sha256 hex) del portafolio, su fiat y `extra`.
+
+    No depende del orden de las monedas ni de mayúsculas/minúsculas, así
+    que requests equivalentes comparten clave.
+    """
+    holdings = sorted((base.upper(), float(quantity)) for base, quantity in portfolio_data.portfolio.items())
+    canonical = json.dumps([holdings, portfolio_data.fiat_currency.upper(), *extra], separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ValuationCache:
+    """LRU acotado de valorizaciones por `valuation_key`."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, float] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> float | None:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            RESULT_CACHE_MISS.inc()
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        RESULT_CACHE_HIT.inc()
+        return value
+
+    def set(self, key: str, value: float) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self, *_) -> None:
+        """Vacía la caché; acepta los argumentos de un listener de `TickersCache`."""
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def _quantile(ordered, q: float) -> float:
+    """Cuantil `q` de valores ya ordenados (interpolación lineal)."""
+    position = q * (len(ordered) - 1)
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class _PriceVector:
+    """Vector de precios por mercado armado perezosamente desde un snapshot.
+
+    Cada mercado distinto se consulta una sola vez; los errores de consulta
+    (p. ej. par inexistente) también se memorizan.
+    """
+
+    def __init__(self, client: BudaClient, snapshot: TickerSnapshot):
+        self.client = client
+        self.snapshot = snapshot
+        self.columns: dict[str, int] = {}
+        self.prices: list[float] = []
+        self.errors: dict[str, BudaAPIError] = {}
+
+    def row(self, portfolio_data: PortfolioRequest) -> list[tuple[int, float]]:
+        """Fila dispersa (columna, cantidad) del portafolio.
+
+        Raises:
+            BudaAPIError: Si algún par no tiene precio en el snapshot.
+        """
+        fiat_upper = portfolio_data.fiat_currency.upper()
+        row: list[tuple[int, float]] = []
+        for base_currency, quantity in portfolio_data.portfolio.items():
+            market_id = f"{base_currency.upper()}-{fiat_upper}"
+            column = self.columns.get(market_id)
+            if column is None:
+                if market_id in self.errors:
+                    raise self.errors[market_id]
+                try:
+                    price = self.client.price_from_snapshot(self.snapshot, base_currency, fiat_upper)
+                except BudaAPIError as e:
+                    self.errors[market_id] = e
+                    raise
+                column = self.columns[market_id] = len(self.prices)
+                self.prices.append(price)
+            row.append((column, float(quantity)))
+        return row
+
+    def dot(self, row: list[tuple[int, float]]) -> float:
+        total_value = 0.0
+        for column, quantity in row:
+            total_value += self.prices[column] * quantity
+        return total_value
 
 
 class PortfolioService:
     def __init__(self):
         self.client = BudaClient()
+        self.results = ValuationCache(RESULT_CACHE_MAX_ENTRIES)
+        # Un snapshot nuevo deja obsoletas todas las valorizaciones guardadas.
+        self.client.cache.add_listener(self.results.clear)
+        # Historial en disco; se abre en el lifespan si HISTORY_PATH está definido.
+        self.history: SnapshotHistory | None = None
+        self.client.cache.add_listener(self._record_history)
+
+    def _record_history(self, previous: TickerSnapshot | None, snapshot: TickerSnapshot) -> None:
+        if self.history is not None:
+            self.history.record(previous, snapshot)
 
-    async def calculate_total_value_exact(self, portfolio_data: PortfolioRequest) -> tuple[float, dict]:
+    async def calculate_total_value_exact(
+        self,
+        portfolio_data: PortfolioRequest,
+        books: dict | None = None,
+        routes: dict | None = None,
+        paths: dict | None = None,
+    ) -> tuple[float, dict]:
         """Calcula el valor exacto de TODO un `PortfolioRequest`.
 
         Para cada moneda del `portfolio` solicita el `order_book` al cliente y
-        recorre las `bids` hasta cubrir la cantidad. Devuelve (total_value,
-        breakdown) donde `breakdown` es un mapa base->valor_en_fiat.
+        llena la cantidad contra las `bids` (búsqueda binaria sobre la
+        profundidad acumulada, ver `DepthSide.fill`). Los order books se piden
+        en paralelo; el desglose conserva el orden del portafolio. Devuelve
+        (total_value, breakdown) donde `breakdown` es un mapa
+        base->valor_en_fiat.
+
+        Si se entrega `books` (market_id -> `OrderBookDepth`), se reutilizan
+        los libros ya presentes y se agregan los descargados, de modo que
+        varias valorizaciones compartan las mismas descargas. Si se entrega
+        `routes`, se completa con los mercados recorridos por cada moneda y,
+        si se entrega `paths`, con la fuente de cada valorización
+        ("top_of_book", "local_book", "cached_book", "order_book" o
+        "identity" si la moneda es la misma fiat).
         """
         fiat = portfolio_data.fiat_currency
+        items = list(portfolio_data.portfolio.items())
+
+        values = await _gather_ordered(
+            self._fill_exact(base_currency, quantity, fiat, books, routes, paths) for base_currency, quantity in items
+        )
+
         total_value = 0.0
         breakdown: dict = {}
+        for (base_currency, _), total_quote in zip(items, values):
+            breakdown[base_currency.upper()] = total_quote
+            total_value += total_quote
 
-        for base_currency, quantity in portfolio_data.portfolio.items():
-            # pedir order_book para cada par base-fiat
-            order_book = await self.client.calculate_total_value_exact(base_currency.upper(), fiat.upper())
-            bids = order_book.get('bids', []) if isinstance(order_book, dict) else []
+        return total_value, breakdown
 
-            remaining = float(quantity)
-            total_quote = 0.0
+    async def _fill_exact(
+        self,
+        base_currency: str,
+        quantity: float,
+        fiat: str,
+        books: dict | None = None,
+        routes: dict | None = None,
+        paths: dict | None = None,
+    ) -> float:
+        """Valoriza `quantity` de `base_currency` recorriendo su ruta hasta `fiat`.
 
-            for bid in bids:
-                price = float(bid[0])
-                available = float(bid[1])
+        En cada mercado se vende contra las `bids` o, si la ruta compra la
+        base del mercado, se gasta lo acumulado contra las `asks`. Los libros
+        de la ruta se piden en paralelo. Una venta directa que cabe en el
+        mejor bid conocido no pide el libro (ver `BudaClient.top_of_book_price`).
+        """
+        base_upper = base_currency.upper()
+        route = await self._exact_route(base_upper, fiat.upper())
+        if routes is not None:
+            routes[base_upper] = route.markets
 
-                filled = min(available, remaining)
-                total_quote += price * filled
-                remaining -= filled
+        path = "order_book"
+        if not route.hops:
+            # Moneda igual a la fiat: no hay libro que llenar.
+            path = "identity"
+        elif len(route.hops) == 1 and route.hops[0].side == SELL:
+            market_id = route.hops[0].market_id
+            path = "cached_book" if books is not None and market_id in books else self.client.book_source(market_id)
+            if path == "order_book":
+                price = self.client.top_of_book_price(market_id, quantity)
+                if price is not None:
+                    path = "top_of_book"
+                    EXACT_FILL_PATHS.labels(path).inc()
+                    if paths is not None:
+                        paths[base_upper] = path
+                    return float(quantity) * price
+        EXACT_FILL_PATHS.labels(path).inc()
+        if paths is not None:
+            paths[base_upper] = path
 
-                if remaining <= 1e-12:
-                    break
+        order_books = await _gather_ordered(self._order_book(hop.market_id, books) for hop in route.hops)
+        amount = float(quantity)
+        with phase("fill"):
+            for hop, order_book in zip(route.hops, order_books):
+                offered = amount
+                amount = order_book.bids.fill(offered) if hop.side == SELL else order_book.asks.spend(offered)
+                if amount is None:
+                    # Se informa lo que se ofrecía en este tramo y en su moneda
+                    # (base del mercado al vender, cotizada al comprar).
+                    market_base, market_quote = hop.market_id.split("-", 1)
+                    currency = market_base if hop.side == SELL else market_quote
+                    raise BudaAPIError(
+                        f"Liquidez insuficiente en {hop.market_id} para cantidad {offered} {currency}", status_code=400
+                    )
 
-            if remaining > 1e-12:
-                raise BudaAPIError(f"Liquidez insuficiente en {base_currency.upper()}-{fiat.upper()} para cantidad {quantity}", status_code=400)
+        return amount
 
-            breakdown[base_currency.upper()] = total_quote
-            total_value += total_quote
+    async def _exact_route(self, base_upper: str, fiat_upper: str) -> Route:
+        if fiat_upper in VALID_PAIRS.get(base_upper, ()):
+            # Par directo conocido: no hace falta el grafo (ni el snapshot).
+            return Route((Hop(f"{base_upper}-{fiat_upper}", SELL),))
+        if base_upper == fiat_upper:
+            return Route(())
+        snapshot = await self.client.get_snapshot([(base_upper, fiat_upper)])
+        route = self.client.route_table(snapshot).path(base_upper, fiat_upper)
+        if route is None:
+            raise BudaAPIError(f"No hay mercado ni ruta de conversión para {base_upper}-{fiat_upper}", status_code=404)
+        return route
 
-        return total_value, breakdown
+    async def _order_book(self, market_id: str, books: dict | None = None) -> OrderBookDepth:
+        order_book = None if books is None else books.get(market_id)
+        if order_book is None:
+            # pedir order_book para cada mercado de la ruta
+            order_book = await self.client.calculate_total_value_exact(*split_market(market_id))
+            if not isinstance(order_book, OrderBookDepth):
+                order_book = OrderBookDepth.from_payload(order_book if isinstance(order_book, dict) else {})
+            if books is not None:
+                books[market_id] = order_book
+        return order_book
 
     async def calculate_total_value(self, portfolio_data: PortfolioRequest) -> float:
         """Calcula el valor total del portafolio en la moneda fiat indicada.
@@ -68,7 +348,219 @@ class PortfolioService:
             BudaAPIError: Si hay cantidades negativas o pares no soportados
                 (status_code=400). También propaga errores de BudaClient.
         """
+        self._validate_portfolio(portfolio_data)
+
+        items = list(portfolio_data.portfolio.items())
+        # Con la caché vigente no hay red; si expiró, el refresco single-flight
+        # hace que las consultas en paralelo compartan una sola descarga.
+        prices = await _gather_ordered(
+            self.client.get_current_price(base_currency, portfolio_data.fiat_currency)
+            for base_currency, _ in items
+        )
+
+        total_value = 0.0
+
+        with phase("fill"):
+            for (_, quantity), price in zip(items, prices):
+                total_value += price * float(quantity)
+
+        return total_value
+
+    async def calculate_total_value_cached(self, portfolio_data: PortfolioRequest) -> tuple[float, str]:
+        """Como `calculate_total_value`, pero memoizado por snapshot.
+
+        Se valoriza contra el snapshot vigente y el resultado se guarda bajo
+        `valuation_key(portafolio, digest del snapshot)`: el digest depende
+        solo de los precios, así que la clave (y el ETag derivado) es la misma
+        en todos los workers y no se repite tras un reinicio.
+
+        Returns:
+            tuple: (valor total, clave de la valorización).
+
+        Raises:
+            BudaAPIError: Igual que `calculate_total_value`.
+        """
+        self._validate_portfolio(portfolio_data)
+        snapshot = await self.client.get_snapshot(portfolio_pairs(portfolio_data))
+        key = valuation_key(portfolio_data, snapshot.digest)
+        with phase("cache"):
+            total_value = self.results.get(key)
+        if total_value is None:
+            with phase("fill"):
+                vector = _PriceVector(self.client, snapshot)
+                total_value = vector.dot(vector.row(portfolio_data))
+            self.results.set(key, total_value)
+        return total_value, key
+
+    async def calculate_multi_value(
+        self, portfolio_data: PortfolioMultiRequest, exact: bool = False
+    ) -> tuple[dict[str, float], dict[str, dict[str, float]]]:
+        """Valoriza el portafolio en todas sus monedas destino en una pasada.
+
+        Las monedas destino son `fiat_currencies`.
+        En modo ticker se usa un único snapshot para todos los pares; en modo
+        exacto todos los llenados corren en paralelo y cada order book se
+        descarga una sola vez aunque lo usen varias monedas.
+
+        Returns:
+            tuple: (fiat -> valor total, fiat -> {moneda: valor}).
+
+        Raises:
+            BudaAPIError: Igual que `calculate_total_value` /
+                `calculate_total_value_exact`, para cualquiera de las monedas.
+        """
+        fiats = portfolio_data.fiat_targets()
+        for fiat in fiats:
+            self._validate_portfolio(portfolio_data, fiat)
+        items = [(base_currency.upper(), float(quantity)) for base_currency, quantity in portfolio_data.portfolio.items()]
+
+        if exact:
+            books: dict = {}
+            values = await _gather_ordered(
+                self._fill_exact(base, quantity, fiat, books) for fiat in fiats for base, quantity in items
+            )
+        else:
+            snapshot = await self.client.get_snapshot([(base, fiat) for fiat in fiats for base, _ in items])
+            with phase("fill"):
+                values = [
+                    self.client.price_from_snapshot(snapshot, base, fiat) * quantity
+                    for fiat in fiats
+                    for base, quantity in items
+                ]
+
+        totals: dict[str, float] = {}
+        breakdown: dict[str, dict[str, float]] = {}
+        columns = iter(values)
+        for fiat in fiats:
+            breakdown[fiat] = {base: next(columns) for base, _ in items}
+            totals[fiat] = sum(breakdown[fiat].values())
+        return totals, breakdown
+
+    def calculate_value_as_of(self, portfolio_data: PortfolioRequest, as_of: float) -> tuple[float, float]:
+        """Valoriza el portafolio con el último snapshot registrado hasta `as_of`.
+
+        Args:
+            as_of: Instante (epoch en segundos).
+
+        Returns:
+            tuple: (valor total, epoch del snapshot usado).
+
+        Raises:
+            BudaAPIError: 503 si el historial está deshabilitado; 404 si no
+                hay registros hasta `as_of` o un par no tiene precio en ese
+                registro; 400 igual que `calculate_total_value`.
+        """
+        if self.history is None:
+            raise BudaAPIError("Historial de snapshots deshabilitado (definir HISTORY_PATH)", status_code=503)
+        self._validate_portfolio(portfolio_data)
+        found = self.history.find(as_of)
+        if found is None:
+            raise BudaAPIError(f"No hay snapshots registrados hasta {as_of}", status_code=404)
+        snapshot_at, slot = found
+
         fiat_upper = portfolio_data.fiat_currency.upper()
+        prices = self.history.prices(slot, [f"{base.upper()}-{fiat_upper}" for base in portfolio_data.portfolio])
+        routes = None
+        total_value = 0.0
+        for base_currency, quantity in portfolio_data.portfolio.items():
+            base_upper = base_currency.upper()
+            price = 1.0 if base_upper == fiat_upper else prices.get(f"{base_upper}-{fiat_upper}")
+            if price is None:
+                if routes is None:
+                    recorded = self.history.prices(slot)
+                    routes = RouteTable.build(recorded, recorded)
+                route = routes.priced_route(base_upper, fiat_upper)
+                if route is None:
+                    raise BudaAPIError(
+                        f"Sin precio para {base_upper}-{fiat_upper} en el snapshot de {snapshot_at}", status_code=404
+                    )
+                price = route.rate
+            total_value += price * float(quantity)
+        return total_value, snapshot_at
+
+    async def calculate_scenarios(self, scenario: PortfolioScenarioRequest) -> dict:
+        """Revaloriza el portafolio bajo cada escenario de shocks.
+
+        Con `shocks` cada fila trae una variación relativa por moneda (en el
+        orden del portafolio); con `grid` se genera una variación uniforme de
+        `start` a `stop` aplicada a `assets` (o a todas las monedas). Cada
+        escenario se resuelve con un producto punto contra el vector de
+        valores por posición, sin volver a consultar precios.
+
+        Returns:
+            dict: base_value, positions, slippage (solo con depth), values,
+            quantiles, min, max y mean.
+
+        Raises:
+            BudaAPIError: Igual que `calculate_total_value`; 400 si `grid`
+                menciona monedas que no están en el portafolio o si falta
+                liquidez con `depth`.
+        """
+        self._validate_portfolio(scenario)
+        fiat_upper = scenario.fiat_currency.upper()
+        assets = [base_currency.upper() for base_currency in scenario.portfolio]
+        quantities = [float(quantity) for quantity in scenario.portfolio.values()]
+
+        snapshot = await self.client.get_snapshot(portfolio_pairs(scenario))
+        mark = [
+            self.client.price_from_snapshot(snapshot, base_currency, fiat_upper) * quantity
+            for base_currency, quantity in zip(assets, quantities)
+        ]
+        slippage = None
+        if scenario.depth:
+            books: dict = {}
+            weights = await _gather_ordered(
+                self._fill_exact(base_currency, quantity, fiat_upper, books)
+                for base_currency, quantity in zip(assets, quantities)
+            )
+            slippage = {base: at_mark - fill for base, at_mark, fill in zip(assets, mark, weights)}
+        else:
+            weights = mark
+        base_value = math.fsum(weights)
+
+        values = array("d")
+        if scenario.grid is not None:
+            grid = scenario.grid
+            selected = set(assets) if grid.assets is None else {a.upper() for a in grid.assets}
+            unknown = sorted(selected.difference(assets))
+            if unknown:
+                raise BudaAPIError(f"Monedas de la grilla fuera del portafolio: {', '.join(unknown)}", status_code=400)
+            exposure = math.fsum(w for base, w in zip(assets, weights) if base in selected)
+            step = (grid.stop - grid.start) / (grid.steps - 1) if grid.steps > 1 else 0.0
+            values.extend(base_value + exposure * (grid.start + i * step) for i in range(grid.steps))
+        else:
+            values.extend(base_value + sum(map(operator.mul, weights, row)) for row in scenario.shocks)
+
+        ordered = sorted(values)
+        return {
+            "fiat_currency": fiat_upper,
+            "base_value": base_value,
+            "positions": dict(zip(assets, weights)),
+            "slippage": slippage,
+            "values": values.tolist(),
+            "quantiles": {f"{q:g}": _quantile(ordered, q) for q in scenario.quantiles},
+            "min": ordered[0],
+            "max": ordered[-1],
+            "mean": math.fsum(values) / len(values),
+        }
+
+    def _validate_portfolio(
+        self, portfolio_data: PortfolioRequest | PortfolioMultiRequest, fiat: str | None = None
+    ) -> None:
+        """Valida cantidades no negativas y pares cripto-fiat soportados.
+
+        Se valida contra `fiat` si se indica; si no, contra `fiat_currency`.
+
+        Un par fuera de VALID_PAIRS se acepta si ambas monedas aparecen en
+        algún mercado de Buda; si no existe ruta entre ellas, la valorización
+        responde 404.
+
+        Raises:
+            BudaAPIError: status_code=400 ante cantidades negativas o pares no
+                soportados.
+        """
+        fiat_upper = (fiat or portfolio_data.fiat_currency).upper()
+        known = self.client.known_currencies()
         
         for base_currency, qty in portfolio_data.portfolio.items():
             if qty < 0:
@@ -80,23 +572,111 @@ class PortfolioService:
         for base_currency in portfolio_data.portfolio.keys():
             base_upper = base_currency.upper()
             
-            if base_upper not in VALID_PAIRS:
+            if base_upper not in VALID_PAIRS and base_upper not in known:
                 raise BudaAPIError(
                     f"La moneda base '{base_upper}' no es soportada.",
                     status_code=400
                 )
             
-            if fiat_upper not in VALID_PAIRS[base_upper]:
+            if fiat_upper not in VALID_PAIRS.get(base_upper, ()) and fiat_upper not in known:
                 raise BudaAPIError(
-                    f"El par '{base_upper}-{fiat_upper}' no es válido. Las monedas fiat soportadas para {base_upper} son: {', '.join(VALID_PAIRS[base_upper])}.",
+                    f"El par '{base_upper}-{fiat_upper}' no es válido. Las monedas fiat soportadas para {base_upper} son: {', '.join(VALID_PAIRS.get(base_upper, ()))}.",
                     status_code=400
                 )
-        
-        total_value = 0.0
 
-        for base_currency, quantity in portfolio_data.portfolio.items():
-            price = await self.client.get_current_price(base_currency, portfolio_data.fiat_currency)
+    async def calculate_batch_value(
+        self, portfolios: list[PortfolioRequest]
+    ) -> tuple[TickerSnapshot, list[float | BudaAPIError]]:
+        """Valoriza un lote de portafolios contra un único snapshot de precios.
 
-            total_value += price * float(quantity)
+        Se arma el lote como una matriz dispersa de tenencias (fila =
+        portafolio, columna = mercado) y un vector de precios con una sola
+        consulta por mercado distinto; cada valor es el producto de su fila
+        por ese vector. Los errores (validación o par inexistente) se
+        devuelven por ítem en lugar de abortar el lote.
 
-        return total_value
+        Returns:
+            tuple: (snapshot usado, lista de valores o `BudaAPIError` en el
+                mismo orden que `portfolios`).
+        """
+        # Solo los ítems válidos cuentan como demanda: un par inexistente
+        # marcado como caliente apagaría la descarga por mercado.
+        pairs = set()
+        for portfolio_data in portfolios:
+            try:
+                self._validate_portfolio(portfolio_data)
+            except BudaAPIError:
+                continue
+            pairs.update(portfolio_pairs(portfolio_data))
+        snapshot = await self.client.get_snapshot(pairs)
+        with phase("fill"):
+            return snapshot, self.value_with_snapshot(portfolios, snapshot)
+
+    def value_with_snapshot(
+        self, portfolios: Iterable[PortfolioRequest], snapshot: TickerSnapshot
+    ) -> list[float | BudaAPIError]:
+        """Valoriza `portfolios` contra `snapshot` sin red; errores por ítem."""
+        vector = _PriceVector(self.client, snapshot)
+        results: list[float | BudaAPIError] = []
+
+        for portfolio_data in portfolios:
+            try:
+                self._validate_portfolio(portfolio_data)
+                row = vector.row(portfolio_data)
+            except BudaAPIError as e:
+                results.append(e)
+                continue
+            results.append(vector.dot(row))
+
+        return results
+
+    async def stream_values(
+        self,
+        lines: AsyncIterable[bytes | str],
+        exact: bool = False,
+        snapshot: TickerSnapshot | None = None,
+    ) -> AsyncIterator[dict]:
+        """Valoriza un flujo de portafolios NDJSON, emitiendo un resultado por línea.
+
+        Todas las líneas se valorizan contra un único snapshot de tickers
+        (`snapshot`, o el vigente al iniciar) y, en modo exacto, cada order
+        book se descarga una sola vez por stream. La memoria queda acotada
+        por la línea en curso y los mercados distintos vistos.
+
+        Yields:
+            dict: `{"line", "portfolio_value", "fiat_currency"}` (más
+                `breakdown` en modo exacto) o `{"line", "error"}` si la línea
+                es inválida o no se pudo valorizar.
+        """
+        vector = None
+        books: dict = {}
+        if not exact:
+            vector = _PriceVector(self.client, snapshot or await self.client.get_snapshot())
+
+        line_number = 0
+        async for line in lines:
+            line_number += 1
+            try:
+                portfolio_data = PortfolioRequest.model_validate_json(line)
+            except ValidationError as e:
+                yield {"line": line_number, "error": {"status_code": 422, "detail": str(e)}}
+                continue
+
+            try:
+                self._validate_portfolio(portfolio_data)
+                if exact:
+                    total_value, breakdown = await self.calculate_total_value_exact(portfolio_data, books)
+                else:
+                    total_value = vector.dot(vector.row(portfolio_data))
+            except BudaAPIError as e:
+                yield {"line": line_number, "error": {"status_code": e.status_code, "detail": str(e)}}
+                continue
+
+            result = {
+                "line": line_number,
+                "portfolio_value": total_value,
+                "fiat_currency": portfolio_data.fiat_currency,
+            }
+            if exact:
+                result["breakdown"] = breakdown
+            yield result
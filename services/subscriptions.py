@@ -0,0 +1,130 @@
+# SUPUESTOS UTILIZADOS (suscripciones en vivo):
+# - Un cliente registra su portafolio una vez (WebSocket) y recibe un valor
+#   nuevo solo cuando un refresco de tickers cambia el precio de algún
+#   mercado que su portafolio usa.
+# - Se mantiene un índice market_id -> suscripciones, así cada refresco
+#   recalcula solo las suscripciones afectadas.
+# - Los refrescos los dispara el refresco en segundo plano o cualquier
+#   request. Sin TICKERS_REFRESH_ENABLED el hub arranca el refresco mientras
+#   tenga suscriptores y lo detiene cuando se va el último.
+# - Si el cliente consume lento se conserva solo el valor más reciente.
+# - Los pares suscritos quedan fijados como calientes en el cliente, así un
+#   refresco por mercado (snapshot parcial) siempre los incluye.
+
+import asyncio
+from collections import defaultdict
+
+from clients.buda_client import BudaAPIError, TickerSnapshot
+from clients.refresher import TickersRefresher
+from models.portfolio import PortfolioRequest
+from services.portfolio_service import PortfolioService, portfolio_pairs
+
+
+class Subscription:
+    """Portafolio suscrito y la cola (de un elemento) de valores a enviar."""
+
+    def __init__(self, portfolio: PortfolioRequest, markets: frozenset[str]):
+        self.portfolio = portfolio
+        self.markets = markets
+        self.pairs = portfolio_pairs(portfolio)
+        self.last_message: dict | None = None
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=1)
+
+    def push(self, message: dict) -> None:
+        """Encola `message` reemplazando uno pendiente no enviado."""
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+
+class SubscriptionHub:
+    """Índice de suscripciones por mercado, alimentado por los refrescos de tickers."""
+
+    def __init__(self, service: PortfolioService, refresher: TickersRefresher | None = None):
+        self.service = service
+        self.refresher = refresher
+        # True si el refresco lo arrancó el hub (y no el lifespan).
+        self._owns_refresher = False
+        self._by_market: dict[str, set[Subscription]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len({sub for subs in self._by_market.values() for sub in subs})
+
+    def subscribe(self, portfolio: PortfolioRequest, snapshot: TickerSnapshot) -> Subscription:
+        """Registra `portfolio` y encola su valor inicial según `snapshot`.
+
+        Raises:
+            BudaAPIError: Si el portafolio no pasa la validación (400).
+        """
+        self.service._validate_portfolio(portfolio)
+        client = self.service.client
+        # Con rutas indirectas el valor depende de todos los mercados de la ruta.
+        markets = frozenset(
+            market_id
+            for base in portfolio.portfolio
+            for market_id in client.route_markets(snapshot, base, portfolio.fiat_currency)
+        )
+        subscription = Subscription(portfolio, markets)
+        for market_id in markets:
+            self._by_market[market_id].add(subscription)
+        client.planner.pin(subscription.pairs)
+        if self.refresher is not None and not self.refresher.running:
+            self.refresher.start()
+            self._owns_refresher = True
+        self._publish([subscription], snapshot)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.service.client.planner.unpin(subscription.pairs)
+        for market_id in subscription.markets:
+            subscribers = self._by_market.get(market_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._by_market[market_id]
+
+    async def stop_idle_refresher(self) -> None:
+        """Detiene el refresco arrancado por el hub si ya no quedan suscriptores."""
+        if self._owns_refresher and len(self) == 0:
+            self._owns_refresher = False
+            await self.refresher.stop()
+
+    def on_snapshot(self, previous: TickerSnapshot | None, snapshot: TickerSnapshot) -> None:
+        """Listener de `TickersCache`: recalcula solo las suscripciones afectadas."""
+        affected: set[Subscription] = set()
+        for market_id, subscribers in self._by_market.items():
+            if snapshot.partial and market_id not in snapshot.quotes:
+                continue
+            if previous is None or _last_price(previous, market_id) != _last_price(snapshot, market_id):
+                affected.update(subscribers)
+        if snapshot.partial:
+            # Un snapshot parcial solo sirve para quien tiene todos sus mercados.
+            affected = {sub for sub in affected if sub.markets.issubset(snapshot.quotes)}
+        if affected:
+            self._publish(list(affected), snapshot)
+
+    def _publish(self, subscriptions: list[Subscription], snapshot: TickerSnapshot) -> None:
+        values = self.service.value_with_snapshot((sub.portfolio for sub in subscriptions), snapshot)
+        for subscription, value in zip(subscriptions, values):
+            if isinstance(value, BudaAPIError):
+                message = {"error": {"status_code": value.status_code, "detail": str(value)}}
+            else:
+                message = {
+                    "portfolio_value": value,
+                    "fiat_currency": subscription.portfolio.fiat_currency,
+                    "snapshot_version": snapshot.version,
+                }
+            previous = subscription.last_message
+            if previous is not None and _same_value(previous, message):
+                continue
+            subscription.last_message = message
+            subscription.push(message)
+
+
+def _last_price(snapshot: TickerSnapshot, market_id: str) -> float | None:
+    quote = snapshot.quotes.get(market_id)
+    return None if quote is None else quote.last
+
+
+def _same_value(previous: dict, message: dict) -> bool:
+    return previous.get("portfolio_value") == message.get("portfolio_value") and previous.get("error") == message.get("error")
@@ -0,0 +1,68 @@
+import httpx
+import pytest
+
+import main
+from benchmarks.fake_buda import create_fake_buda_app
+from benchmarks.load_test import percentile, run_suite
+from benchmarks.serialization import build_batch, compare, preload_snapshot
+from clients.order_book import OrderBookDepth
+
+"""
+SUPUESTOS UTILIZADOS:
+- Smoke test del benchmark: la API y el Buda falso corren en memoria
+  (ASGITransport), sin sockets ni subprocesos.
+"""
+
+
+class TestBenchmarkSuite:
+    """Tests del driver de carga y del Buda falso"""
+
+    def test_percentile_interpolates(self):
+        values = [1.0, 2.0, 3.0, 4.0]
+
+        assert percentile(values, 0) == 1.0
+        assert percentile(values, 50) == 2.5
+        assert percentile(values, 100) == 4.0
+        assert percentile([], 99) == 0.0
+
+    @pytest.mark.asyncio
+    async def test_suite_against_fake_buda(self):
+        fake = create_fake_buda_app(depth=5, seed=1)
+        buda = main.service.client
+        buda._http = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake), base_url="http://fake-buda")
+        buda.cache.clear()
+        buda.order_books.clear()
+        try:
+            async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=main.app), base_url="http://api"
+            ) as client:
+                results = await run_suite(client, sizes=[1, 6], concurrencies=[1, 4], total=8)
+        finally:
+            await buda.aclose()
+            buda.cache.clear()
+            buda.order_books.clear()
+
+        assert len(results) == 2 * 2 * 2
+        assert all(row["errors"] == 0 for row in results)
+        assert {row["portfolio_size"] for row in results} == {1, 6}
+        assert all(row["p50_ms"] <= row["p99_ms"] for row in results)
+        assert fake.state.requests >= 1
+
+    @pytest.mark.asyncio
+    async def test_fast_responses_emit_the_same_json(self):
+        preload_snapshot()
+        buda = main.service.client
+        buda.order_books.set("BTC-CLP", OrderBookDepth.from_payload({"bids": [["100", "5"]], "asks": []}))
+        batch = build_batch(3)
+        batch["items"].append({"portfolio": {"XRP": 1.0}, "fiat_currency": "CLP"})
+        try:
+            rows = [
+                await compare("/v1/portfolio/value/batch", batch, requests=2),
+                await compare("/v1/portfolio/value/exact", {"portfolio": {"BTC": 1.0}, "fiat_currency": "CLP"}, 2),
+            ]
+        finally:
+            buda.cache.clear()
+            buda.order_books.clear()
+
+        assert [row["items"] for row in rows] == [4, 1]
+        assert main.FAST_RESPONSES is False
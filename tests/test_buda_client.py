@@ -0,0 +1,252 @@
+import asyncio
+import dataclasses
+import time
+
+import pytest
+from unittest.mock import patch
+
+from clients.buda_client import BudaAPIError, OrderBookCache, TickersCache
+from clients.order_book import OrderBookDepth
+from clients.refresher import TickersRefresher
+from models.portfolio import PortfolioRequest
+from services.portfolio_service import PortfolioService
+
+"""
+SUPUESTOS UTILIZADOS:
+- Se prueba la lógica del cliente sin red (payloads construidos a mano).
+"""
+
+TICKERS_PAYLOAD = {
+    "tickers": [
+        {
+            "market_id": "BTC-CLP",
+            "last_price": ["80000000.0", "CLP"],
+            "max_bid": ["79900000.0", "CLP"],
+            "min_ask": ["80100000.0", "CLP"],
+            "volume": ["12.5", "BTC"],
+        },
+        {"market_id": "ETH-CLP", "last_price": ["abc", "CLP"]},
+        {"market_id": "LTC-CLP", "last_price": []},
+    ]
+}
+
+
+class TestTickersCache:
+    """Tests del snapshot indexado de tickers"""
+
+    def test_set_builds_indexed_snapshot(self):
+        cache = TickersCache()
+
+        snapshot = cache.set(TICKERS_PAYLOAD)
+
+        assert cache.get() is snapshot
+        assert snapshot.version == 1
+        quote = snapshot.quotes["BTC-CLP"]
+        assert quote.last == 80000000.0
+        assert quote.bid == 79900000.0
+        assert quote.ask == 80100000.0
+        assert quote.volume == 12.5
+        assert snapshot.last_price("BTC-CLP") == 80000000.0
+
+    def test_version_increments_per_refresh(self):
+        cache = TickersCache()
+
+        cache.set(TICKERS_PAYLOAD)
+        snapshot = cache.set(TICKERS_PAYLOAD)
+
+        assert snapshot.version == 2
+
+    def test_snapshot_errors(self):
+        snapshot = TickersCache().set(TICKERS_PAYLOAD)
+
+        with pytest.raises(BudaAPIError) as invalid:
+            snapshot.last_price("ETH-CLP")
+        with pytest.raises(BudaAPIError) as missing:
+            snapshot.last_price("LTC-CLP")
+
+        assert invalid.value.status_code == 500
+        assert missing.value.status_code == 404
+
+
+def _expire(cache: TickersCache) -> None:
+    cache.snapshot = dataclasses.replace(cache.snapshot, fetched_at=time.time() - 3600)
+
+
+class TestSingleFlightRefresh:
+    """Tests del refresco single-flight de /tickers"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_valuations_share_one_fetch(self):
+        service = PortfolioService()
+        service.client.cache.set(TICKERS_PAYLOAD)
+        _expire(service.client.cache)
+        calls = 0
+
+        async def fake_fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return TICKERS_PAYLOAD
+
+        with patch.object(service.client, '_fetch_tickers', side_effect=fake_fetch):
+            portfolio = PortfolioRequest(portfolio={"BTC": 0.5}, fiat_currency="CLP")
+            totals = await asyncio.gather(
+                *(service.calculate_total_value(portfolio) for _ in range(50))
+            )
+
+        assert calls == 1
+        assert totals == [40000000.0] * 50
+
+    @pytest.mark.asyncio
+    async def test_concurrent_callers_share_the_error(self):
+        service = PortfolioService()
+        calls = 0
+
+        async def failing_fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise BudaAPIError("Timeout al conectar con API de Buda.com", status_code=504)
+
+        with patch.object(service.client, '_fetch_tickers', side_effect=failing_fetch):
+            results = await asyncio.gather(
+                *(service.client.get_current_price("BTC", "CLP") for _ in range(20)),
+                return_exceptions=True,
+            )
+
+        assert calls == 1
+        assert all(isinstance(r, BudaAPIError) and r.status_code == 504 for r in results)
+
+
+class TestTickersRefresher:
+    """Tests del refresco en segundo plano (stale-while-revalidate)"""
+
+    @pytest.mark.asyncio
+    async def test_serves_stale_snapshot_within_max_staleness(self):
+        client = PortfolioService().client
+        client.cache.set(TICKERS_PAYLOAD)
+        client.cache.snapshot = dataclasses.replace(client.cache.snapshot, fetched_at=time.time() - 60)
+        client.max_staleness = 120
+
+        with patch.object(client, '_fetch_tickers', side_effect=AssertionError("no debe llamar a Buda")):
+            assert await client.get_current_price("BTC", "CLP") == 80000000.0
+
+    @pytest.mark.asyncio
+    async def test_refreshes_in_background_and_counts_failures(self):
+        client = PortfolioService().client
+        refresher = TickersRefresher(client, interval=0.01, jitter=0, max_staleness=120)
+        calls = 0
+
+        async def flaky_fetch():
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise BudaAPIError("API de Buda.com no disponible", status_code=503)
+            return TICKERS_PAYLOAD
+
+        with patch.object(client, '_fetch_tickers', side_effect=flaky_fetch):
+            refresher.start()
+            for _ in range(200):
+                if refresher.last_success is not None:
+                    break
+                await asyncio.sleep(0.01)
+            await refresher.stop()
+
+        assert refresher.failure_count == 1
+        assert refresher.consecutive_failures == 0
+        assert client.cache.snapshot.version >= 1
+        assert client.max_staleness is None
+
+
+class TestOrderBookCache:
+    """Tests de la caché de order books"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_one_fetch_then_hit(self):
+        client = PortfolioService().client
+        calls = 0
+
+        async def fake_fetch(market_id):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"bids": [["100.0", "1"]], "asks": [["101.0", "1"]]}
+
+        with patch.object(client, '_fetch_order_book', side_effect=fake_fetch):
+            books = await asyncio.gather(
+                *(client.calculate_total_value_exact("btc", "clp") for _ in range(10))
+            )
+            await client.calculate_total_value_exact("BTC", "CLP")
+
+        assert calls == 1
+        assert all(book is books[0] for book in books)
+        assert client.order_books.stats()["hits"] == 1
+
+    def test_lru_eviction_by_markets_and_levels(self):
+        cache = OrderBookCache(ttl=60, max_markets=2, max_levels=5)
+        book = OrderBookDepth.from_payload({"bids": [["1", "1"]], "asks": [["2", "1"]]})
+
+        cache.set("BTC-CLP", book)
+        cache.set("ETH-CLP", book)
+        cache.get("BTC-CLP")
+        cache.set("LTC-CLP", book)
+
+        assert cache.peek("ETH-CLP") is None
+        assert cache.peek("BTC-CLP") is book
+
+        cache.set("BCH-CLP", OrderBookDepth.from_payload({"bids": [["1", "1"]] * 4, "asks": []}))
+
+        assert len(cache) == 1
+        assert cache.levels == 4
+        assert cache.evictions == 3
+
+    def test_expired_entry_is_a_miss(self):
+        cache = OrderBookCache(ttl=0, max_markets=2, max_levels=10)
+        cache.set("BTC-CLP", OrderBookDepth.from_payload({"bids": [], "asks": []}))
+
+        assert cache.get("BTC-CLP") is None
+        assert cache.misses == 1
+
+
+class TestHttpClientLifecycle:
+    """Tests del ciclo de vida del pool httpx"""
+
+    @pytest.mark.asyncio
+    async def test_no_http_client_until_started_and_closed_on_shutdown(self):
+        client = PortfolioService().client
+        assert client._http is None
+
+        await client.start()
+        http = client.client
+        assert not http.is_closed
+
+        await client.aclose()
+        assert http.is_closed
+        assert client._http is None
+
+    @pytest.mark.asyncio
+    async def test_warm_up_preloads_snapshot_and_tolerates_errors(self):
+        client = PortfolioService().client
+
+        with patch.object(client, '_fetch_tickers', return_value=TICKERS_PAYLOAD):
+            await client.warm_up()
+        assert client.cache.get() is not None
+
+        with patch.object(client, '_fetch_tickers', side_effect=BudaAPIError("x", status_code=503)):
+            await client.warm_up()
+
+    @pytest.mark.asyncio
+    async def test_lifespan_does_not_wait_for_markets(self):
+        import main
+
+        started = asyncio.Event()
+
+        async def slow_markets():
+            started.set()
+            await asyncio.sleep(60)
+
+        with patch.object(main.service.client, 'load_markets', side_effect=slow_markets):
+            lifespan = main.lifespan(main.app)
+            await asyncio.wait_for(lifespan.__aenter__(), timeout=1)
+            await asyncio.wait_for(started.wait(), timeout=1)
+            await asyncio.wait_for(lifespan.__aexit__(None, None, None), timeout=1)
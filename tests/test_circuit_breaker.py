@@ -0,0 +1,166 @@
+import dataclasses
+import time
+
+import httpx
+import pytest
+from unittest.mock import patch
+
+import clients.buda_client as buda_client
+import main
+from clients.buda_client import BudaAPIError, BudaClient, track_stale_reads
+from clients.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from clients.order_book import OrderBookDepth
+
+"""
+SUPUESTOS UTILIZADOS:
+- Buda se simula con httpx.MockTransport; el backoff se deja en 0 para que
+  los reintentos no agreguen espera a los tests.
+"""
+
+TICKERS_PAYLOAD = {"tickers": [{"market_id": "BTC-CLP", "last_price": ["80000000.0", "CLP"]}]}
+
+
+def make_client(handler) -> BudaClient:
+    client = BudaClient()
+    client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://buda")
+    return client
+
+
+@pytest.fixture(autouse=True)
+def no_backoff():
+    with patch.object(buda_client, "BUDA_RETRY_BASE_DELAY", 0.0):
+        yield
+
+
+class TestCircuitBreaker:
+    """Tests de la máquina de estados del breaker"""
+
+    def test_opens_after_threshold_and_probes_once(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert not breaker.allow()
+        assert breaker.retry_after() > 0
+
+        time.sleep(0.06)
+        assert breaker.allow()
+        assert breaker.state == HALF_OPEN
+        assert not breaker.allow()
+
+        breaker.record_success()
+        assert breaker.state == CLOSED
+        assert breaker.allow()
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+
+        assert breaker.allow()
+        breaker.record_failure()
+
+        assert breaker.state == OPEN
+        assert breaker.open_count == 2
+
+
+class TestRetriesAndFallback:
+    """Tests de reintentos, fail-fast y último dato bueno"""
+
+    @pytest.mark.asyncio
+    async def test_retries_transient_errors(self):
+        calls = 0
+
+        def handler(request):
+            nonlocal calls
+            calls += 1
+            return httpx.Response(503) if calls < 3 else httpx.Response(200, json=TICKERS_PAYLOAD)
+
+        client = make_client(handler)
+        data = await client._fetch_tickers()
+        await client.aclose()
+
+        assert calls == 3
+        assert data == TICKERS_PAYLOAD
+        assert client.breaker.state == CLOSED
+
+    @pytest.mark.asyncio
+    async def test_client_errors_are_not_retried(self):
+        calls = 0
+
+        def handler(request):
+            nonlocal calls
+            calls += 1
+            return httpx.Response(404)
+
+        client = make_client(handler)
+        with pytest.raises(BudaAPIError) as exc_info:
+            await client._fetch_order_book("XXX-CLP")
+        await client.aclose()
+
+        assert exc_info.value.status_code == 404
+        assert calls == 1
+        assert client.breaker.consecutive_failures == 0
+
+    @pytest.mark.asyncio
+    async def test_open_breaker_fails_fast_without_calling_buda(self):
+        calls = 0
+
+        def handler(request):
+            nonlocal calls
+            calls += 1
+            return httpx.Response(502)
+
+        client = make_client(handler)
+        client.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        with pytest.raises(BudaAPIError):
+            await client._fetch_tickers()
+        assert client.breaker.state == OPEN
+
+        calls = 0
+        with pytest.raises(BudaAPIError) as exc_info:
+            await client._fetch_tickers()
+        await client.aclose()
+
+        assert calls == 0
+        assert exc_info.value.status_code == 503
+        assert exc_info.value.retry_after > 0
+
+    @pytest.mark.asyncio
+    async def test_serves_last_known_good_snapshot_and_book(self):
+        client = make_client(lambda request: httpx.Response(503))
+        snapshot = client.cache.set(TICKERS_PAYLOAD)
+        client.cache.snapshot = dataclasses.replace(snapshot, fetched_at=time.time() - 300)
+        book = OrderBookDepth.from_payload({"bids": [["100", "1"]], "asks": []})
+        client.order_books.set("BTC-CLP", book)
+        client.order_books.ttl = 0
+
+        stale = track_stale_reads()
+        price = await client.get_current_price("BTC", "CLP")
+        exact = await client.calculate_total_value_exact("BTC", "CLP")
+        await client.aclose()
+
+        assert price == 80000000.0
+        assert exact is book
+        assert stale == ["tickers", "BTC-CLP"]
+
+    @pytest.mark.asyncio
+    async def test_endpoint_reports_retry_after_without_fallback(self):
+        buda = main.service.client
+        previous_breaker = buda.breaker
+        buda.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        buda.breaker.record_failure()
+        buda.cache.clear()
+        try:
+            async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=main.app), base_url="http://api"
+            ) as api:
+                response = await api.post(
+                    "/v1/portfolio/value", json={"portfolio": {"BTC": 1}, "fiat_currency": "CLP"}
+                )
+        finally:
+            buda.breaker = previous_breaker
+
+        assert response.status_code == 503
+        assert 1 <= int(response.headers["Retry-After"]) <= 30
@@ -0,0 +1,102 @@
+import time
+
+import httpx
+import pytest
+
+from clients.buda_client import BudaAPIError, BudaClient
+from clients.fetch_planner import BULK, PER_MARKET, FetchPlanner
+from models.portfolio import PortfolioRequest
+from services.portfolio_service import PortfolioService
+
+"""
+SUPUESTOS UTILIZADOS:
+- Buda se simula con httpx.MockTransport y se registran las rutas pedidas.
+"""
+
+PRICES = {f"{base}-CLP": 1000.0 * (i + 1) for i, base in enumerate(["BTC", "ETH", "BCH", "LTC", "USDC", "USDT"])}
+
+
+def ticker(market_id: str) -> dict:
+    return {"market_id": market_id, "last_price": [str(PRICES[market_id]), "CLP"], "volume": ["1", "BTC"]}
+
+
+class TestFetchPlanner:
+    """Tests de la elección entre /tickers y descarga por mercado"""
+
+    def test_needs_bulk_measurements_then_compares_costs(self):
+        planner = FetchPlanner("auto", hot_window=60, max_markets=3, concurrency=2)
+        assert planner.choose(2) == BULK
+
+        planner.observe(BULK, 100_000, 0.2)
+        planner.bulk_markets = 100
+        assert planner.choose(2) == PER_MARKET
+        assert planner.choose(4) == BULK
+
+        planner.observe(PER_MARKET, 500, 1.0)
+        assert planner.choose(2) == BULK
+
+    def test_hot_window_expires_but_pins_stay(self):
+        planner = FetchPlanner("auto", hot_window=0.01, max_markets=8, concurrency=8)
+        planner.record([("BTC", "CLP")])
+        planner.pin([("ETH", "CLP")])
+        assert planner.hot_pairs() == [("BTC", "CLP"), ("ETH", "CLP")]
+
+        time.sleep(0.02)
+        assert planner.hot_pairs() == [("ETH", "CLP")]
+        planner.unpin([("ETH", "CLP")])
+        assert planner.hot_pairs() == []
+
+
+class TestAdaptiveRefresh:
+    """Tests del refresco por mercado y su fallback a /tickers"""
+
+    @pytest.mark.asyncio
+    async def test_hot_markets_refresh_individually_and_misses_fall_back_to_bulk(self):
+        paths = []
+
+        def handler(request):
+            paths.append(request.url.path)
+            if request.url.path == "/tickers":
+                return httpx.Response(200, json={"tickers": [ticker(m) for m in PRICES]})
+            market_id = request.url.path.split("/")[2]
+            return httpx.Response(200, json={"ticker": ticker(market_id)})
+
+        client = BudaClient()
+        client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://buda")
+
+        assert await client.get_current_price("BTC", "CLP") == 1000.0
+        assert paths == ["/tickers"]
+
+        snapshot = await client.refresh_snapshot()
+        assert snapshot.partial
+        assert set(snapshot.quotes) == {"BTC-CLP"}
+        assert paths[1:] == ["/markets/BTC-CLP/ticker"]
+
+        assert await client.get_current_price("BTC", "CLP") == 1000.0
+        assert len(paths) == 2
+
+        assert await client.get_current_price("ETH", "CLP") == 2000.0
+        await client.aclose()
+
+        assert paths[2:] == ["/tickers"]
+        assert not client.cache.snapshot.partial
+
+    @pytest.mark.asyncio
+    async def test_invalid_batch_items_are_not_recorded_as_demand(self):
+        def handler(request):
+            return httpx.Response(200, json={"tickers": [ticker(m) for m in PRICES]})
+
+        service = PortfolioService()
+        service.client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://buda")
+        await service.client.get_snapshot()
+
+        _, results = await service.calculate_batch_value([
+            PortfolioRequest(portfolio={"BTC": 1.0}, fiat_currency="ZZZ"),
+            PortfolioRequest(portfolio={"ETH": 1.0}, fiat_currency="CLP"),
+        ])
+        await service.client.get_snapshot([("NOPE", "CLP")])
+        await service.client.aclose()
+
+        assert isinstance(results[0], BudaAPIError)
+        assert results[1] == 2000.0
+        assert service.client.planner.hot_pairs() == [("ETH", "CLP")]
@@ -0,0 +1,153 @@
+import asyncio
+
+import httpx
+import pytest
+
+from clients.buda_client import BudaClient
+from clients.local_books import LocalOrderBook, OrderBookFeed, SequenceGap
+
+"""
+SUPUESTOS UTILIZADOS:
+- `FakeBookPublisher` es un stand-in local del feed: mantiene el libro
+  "verdadero", numera los updates y sirve snapshots con `sequence` como lo
+  haría el endpoint REST.
+- Los mensajes se entregan por una asyncio.Queue que el feed consume.
+"""
+
+
+class FakeBookPublisher:
+    """Publicador en memoria de updates de order book con numeración."""
+
+    def __init__(self, market_id: str, bids: dict, asks: dict):
+        self.market_id = market_id
+        self.bids = dict(bids)
+        self.asks = dict(asks)
+        self.sequence = 0
+        self.snapshot_requests = 0
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def snapshot(self, market_id: str) -> dict:
+        self.snapshot_requests += 1
+        return {
+            "sequence": self.sequence,
+            "bids": sorted(([p, s] for p, s in self.bids.items()), reverse=True),
+            "asks": sorted([p, s] for p, s in self.asks.items()),
+        }
+
+    def publish(self, bids: dict | None = None, asks: dict | None = None, drop: bool = False) -> None:
+        """Aplica el cambio al libro verdadero y lo emite (salvo `drop`, que simula una pérdida)."""
+        self.sequence += 1
+        for side, changes in ((self.bids, bids or {}), (self.asks, asks or {})):
+            for price, size in changes.items():
+                if size:
+                    side[price] = size
+                else:
+                    side.pop(price, None)
+        if not drop:
+            self.queue.put_nowait({
+                "type": "update",
+                "market_id": self.market_id,
+                "sequence": self.sequence,
+                "bids": [[p, s] for p, s in (bids or {}).items()],
+                "asks": [[p, s] for p, s in (asks or {}).items()],
+            })
+
+    def close(self) -> None:
+        self.queue.put_nowait(None)
+
+    async def messages(self):
+        while (message := await self.queue.get()) is not None:
+            yield message
+
+
+async def run_feed(feed: OrderBookFeed, publisher: FakeBookPublisher) -> None:
+    """Procesa todo lo publicado hasta ahora sin cerrar el feed."""
+    while not publisher.queue.empty():
+        await feed.handle(publisher.queue.get_nowait())
+
+
+class TestLocalOrderBook:
+    """Tests del libro local con niveles ordenados"""
+
+    def test_levels_stay_sorted_best_first(self):
+        book = LocalOrderBook.from_payload("BTC-CLP", {"sequence": 1, "bids": [["100", "1"], ["98", "1"]], "asks": [["101", "2"]]})
+        book.apply({"sequence": 2, "bids": [["99", "3"], ["100", "0"]], "asks": [["102", "1"], ["101", "0.5"]]})
+
+        depth = book.depth()
+        assert list(depth.bids.prices) == [99.0, 98.0]
+        assert list(depth.asks.prices) == [101.0, 102.0]
+        assert depth.bids.fill(3.5) == 99.0 * 3 + 98.0 * 0.5
+        assert book.depth() is depth
+        assert not book.apply({"sequence": 2, "bids": [["50", "1"]]})
+        with pytest.raises(SequenceGap):
+            book.apply({"sequence": 4})
+
+
+class TestOrderBookFeed:
+    """Tests del feed: snapshot inicial, updates y resnapshot ante saltos"""
+
+    @pytest.mark.asyncio
+    async def test_tracks_publisher_and_resnapshots_on_gap(self):
+        publisher = FakeBookPublisher("BTC-CLP", bids={100.0: 1.0, 99.0: 2.0}, asks={101.0: 1.0})
+        feed = OrderBookFeed(publisher.snapshot, ["btc-clp"], max_silence=60)
+
+        publisher.publish(bids={100.0: 1.5})
+        await run_feed(feed, publisher)
+        assert publisher.snapshot_requests == 1
+
+        publisher.publish(bids={98.0: 4.0})
+        publisher.publish(bids={100.0: 0}, drop=True)
+        publisher.publish(asks={100.5: 1.0})
+        await run_feed(feed, publisher)
+
+        depth = feed.depth("BTC-CLP")
+        assert feed.gaps == 1
+        assert publisher.snapshot_requests == 2
+        assert list(depth.bids.prices) == [99.0, 98.0]
+        assert list(depth.asks.prices) == [100.5, 101.0]
+        assert depth.bids.fill(3.0) == 99.0 * 2 + 98.0
+
+    @pytest.mark.asyncio
+    async def test_consume_resets_books_when_feed_ends(self):
+        publisher = FakeBookPublisher("BTC-CLP", bids={100.0: 1.0}, asks={})
+        feed = OrderBookFeed(publisher.snapshot, ["BTC-CLP"], max_silence=60)
+        publisher.publish(bids={100.0: 2.0})
+        publisher.close()
+
+        seen = []
+        original = feed.handle
+
+        async def spy(message):
+            await original(message)
+            seen.append(feed.depth("BTC-CLP").bids.total_size)
+
+        feed.handle = spy
+        await feed.consume(publisher.messages())
+
+        assert seen == [2.0]
+        assert feed.depth("BTC-CLP") is None
+
+    @pytest.mark.asyncio
+    async def test_exact_valuation_uses_local_book_without_upstream(self):
+        calls = 0
+
+        def handler(request):
+            nonlocal calls
+            calls += 1
+            return httpx.Response(200, json={"order_book": {"bids": [["1", "100"]], "asks": []}})
+
+        client = BudaClient()
+        client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://buda")
+        publisher = FakeBookPublisher("BTC-CLP", bids={100.0: 1.0}, asks={})
+        client.local_books = OrderBookFeed(publisher.snapshot, ["BTC-CLP"], max_silence=60)
+        publisher.publish(bids={100.0: 3.0})
+        await run_feed(client.local_books, publisher)
+
+        local = await client.calculate_total_value_exact("BTC", "CLP")
+        client.local_books.max_silence = 0
+        fallback = await client.calculate_total_value_exact("BTC", "CLP")
+        await client.aclose()
+
+        assert local.bids.total_size == 3.0
+        assert fallback.bids.total_size == 100.0
+        assert calls == 1
@@ -0,0 +1,103 @@
+import pytest
+from unittest.mock import patch
+
+from clients.buda_client import BudaAPIError
+from clients.market_graph import BUY, SELL, RouteTable
+from clients.order_book import OrderBookDepth
+from models.portfolio import PortfolioRequest
+from services.portfolio_service import PortfolioService
+
+"""
+SUPUESTOS UTILIZADOS:
+- El grafo se arma con snapshots construidos a mano; no hay red.
+"""
+
+TICKERS_PAYLOAD = {
+    "tickers": [
+        {"market_id": "BTC-CLP", "last_price": ["80000000.0", "CLP"]},
+        {"market_id": "USDC-CLP", "last_price": ["1000.0", "CLP"]},
+        {"market_id": "ETH-BTC", "last_price": ["0.05", "BTC"]},
+        {"market_id": "LTC-PEN", "last_price": ["300.0", "PEN"]},
+        {"market_id": "BTC-PEN", "last_price": [], "volume": ["1", "BTC"]},
+    ]
+}
+
+
+class TestRouteTable:
+    """Tests del cálculo de rutas"""
+
+    def test_direct_one_and_two_intermediate_routes(self):
+        prices = {"BTC-CLP": 100.0, "USDC-CLP": 2.0, "ETH-BTC": 0.5}
+        table = RouteTable.build(prices, prices, version=7)
+
+        direct = table.priced_route("btc", "clp")
+        assert direct.markets == ["BTC-CLP"] and direct.rate == 100.0
+
+        via_clp = table.priced_route("BTC", "USDC")
+        assert [(hop.market_id, hop.side) for hop in via_clp.hops] == [("BTC-CLP", SELL), ("USDC-CLP", BUY)]
+        assert via_clp.rate == pytest.approx(50.0)
+
+        two_hops = table.priced_route("ETH", "USDC")
+        assert two_hops.markets == ["ETH-BTC", "BTC-CLP", "USDC-CLP"]
+        assert two_hops.rate == pytest.approx(25.0)
+        assert table.version == 7
+
+    def test_unpriced_markets_only_count_for_exact_paths(self):
+        table = RouteTable.build(["BTC-CLP", "BTC-PEN", "LTC-PEN"], {"BTC-CLP": 100.0, "LTC-PEN": 5.0})
+
+        assert table.priced_route("BTC", "PEN") is None
+        assert table.path("BTC", "PEN").markets == ["BTC-PEN"]
+        assert table.priced_route("LTC", "CLP") is None
+        assert table.path("LTC", "CLP").markets == ["LTC-PEN", "BTC-PEN", "BTC-CLP"]
+
+
+class TestRoutedValuation:
+    """Tests de valorización de pares sin mercado directo"""
+
+    @pytest.mark.asyncio
+    async def test_ticker_value_through_intermediate_currency(self):
+        service = PortfolioService()
+        service.client.cache.set(TICKERS_PAYLOAD)
+
+        with patch.object(service.client, '_fetch_tickers', side_effect=AssertionError("sin red")):
+            total = await service.calculate_total_value(
+                PortfolioRequest(portfolio={"BTC": 0.5, "USDC": 10}, fiat_currency="USDC")
+            )
+
+        assert total == pytest.approx(0.5 * 80000000.0 / 1000.0 + 10)
+
+    @pytest.mark.asyncio
+    async def test_unknown_currency_and_missing_route(self):
+        service = PortfolioService()
+        service.client.cache.set(TICKERS_PAYLOAD)
+
+        with pytest.raises(BudaAPIError) as exc_info:
+            await service.calculate_total_value(PortfolioRequest(portfolio={"BTC": 1}, fiat_currency="USD"))
+        assert exc_info.value.status_code == 400
+
+        with pytest.raises(BudaAPIError) as exc_info:
+            await service.calculate_total_value(PortfolioRequest(portfolio={"LTC": 1}, fiat_currency="CLP"))
+        assert exc_info.value.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_exact_value_sells_then_buys_along_route(self):
+        service = PortfolioService()
+        service.client.cache.set(TICKERS_PAYLOAD)
+        books = {
+            "BTC-CLP": {"bids": [["80000000", "1"]], "asks": []},
+            "USDC-CLP": {"bids": [], "asks": [["1000", "30000"], ["1010", "100000"]]},
+        }
+
+        async def fake_fetch(base, quote):
+            return OrderBookDepth.from_payload(books[f"{base}-{quote}"])
+
+        routes: dict = {}
+        with patch.object(service.client, 'calculate_total_value_exact', side_effect=fake_fetch):
+            total, breakdown = await service.calculate_total_value_exact(
+                PortfolioRequest(portfolio={"BTC": 0.5}, fiat_currency="USDC"), routes=routes
+            )
+
+        expected = 30000 + (40000000 - 30000 * 1000) / 1010
+        assert total == pytest.approx(expected)
+        assert breakdown == {"BTC": total}
+        assert routes == {"BTC": ["BTC-CLP", "USDC-CLP"]}
@@ -0,0 +1,50 @@
+import httpx
+import pytest
+
+from clients.buda_client import BudaAPIError, BudaClient
+from monitoring.metrics import UPSTREAM_ERRORS, Counter, Histogram, Registry
+
+"""
+SUPUESTOS UTILIZADOS:
+- Se valida el formato de texto y la instrumentación del cliente con un
+  transporte httpx falso (sin red).
+"""
+
+
+class TestMetrics:
+    """Tests de las métricas estilo Prometheus"""
+
+    def test_histogram_and_counter_render(self):
+        registry = Registry()
+        histogram = registry.register(Histogram("latency_seconds", "Latencia.", ("route",), buckets=(0.1, 1.0)))
+        counter = registry.register(Counter("hits_total", "Aciertos."))
+        child = histogram.labels("/x")
+
+        child.observe(0.05)
+        child.observe(0.5)
+        child.observe(5.0)
+        counter.labels().inc(3)
+
+        text = registry.render()
+        assert histogram.labels("/x") is child
+        assert 'latency_seconds_bucket{route="/x",le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{route="/x",le="1.0"} 2' in text
+        assert 'latency_seconds_bucket{route="/x",le="+Inf"} 3' in text
+        assert 'latency_seconds_count{route="/x"} 3' in text
+        assert "hits_total 3.0" in text
+
+    @pytest.mark.asyncio
+    async def test_upstream_errors_counted_by_status_code(self):
+        client = BudaClient()
+        client._http = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(502)),
+            base_url="http://buda",
+        )
+        before = UPSTREAM_ERRORS.labels("order_book", 502).value
+
+        with pytest.raises(BudaAPIError) as exc_info:
+            await client._fetch_order_book("BTC-CLP")
+        await client.aclose()
+
+        assert exc_info.value.status_code == 502
+        assert UPSTREAM_ERRORS.labels("order_book", 502).value == before + 1
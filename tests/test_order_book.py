@@ -0,0 +1,96 @@
+import math
+import random
+
+import pytest
+
+from clients.order_book import EPSILON, DepthSide, OrderBookDepth
+
+"""
+SUPUESTOS UTILIZADOS:
+- `reference_fill` es el loop de llenado original de
+  PortfolioService.calculate_total_value_exact y sirve de oráculo: igualdad
+  exacta en bordes de nivel y, en libros aleatorios, la cota de redondeo
+  documentada en clients/order_book.py.
+"""
+
+
+def reference_fill(bids, quantity):
+    remaining = float(quantity)
+    total_quote = 0.0
+
+    for bid in bids:
+        price = float(bid[0])
+        available = float(bid[1])
+
+        filled = min(available, remaining)
+        total_quote += price * filled
+        remaining -= filled
+
+        if remaining <= 1e-12:
+            break
+
+    if remaining > 1e-12:
+        return None
+    return total_quote
+
+
+def random_bids(rng, depth):
+    price = rng.uniform(100, 100000)
+    bids = []
+    for _ in range(depth):
+        price -= rng.uniform(0.01, 50)
+        bids.append([f"{price:.2f}", f"{rng.uniform(0.0001, 5):.8f}"])
+    return bids
+
+
+class TestDepthSide:
+    """Equivalencia del llenado con sumas prefijas vs. el loop original"""
+
+    def test_matches_reference_loop_on_random_books(self):
+        rng = random.Random(1234)
+        for _ in range(300):
+            bids = random_bids(rng, rng.randint(0, 60))
+            side = DepthSide.from_levels(bids)
+            total = sum(float(size) for _, size in bids)
+            quantities = [0.0, 1e-13, rng.uniform(0, total), total, total * 1.01 + 1e-9]
+            quantities += [float(size) for _, size in bids[:3]]
+            for quantity in quantities:
+                expected = reference_fill(bids, quantity)
+                got = side.fill(quantity)
+                if expected is None:
+                    assert got is None
+                else:
+                    # Tolerancia documentada en clients/order_book.py: la resta
+                    # con sumas prefijas redondea distinto que la secuencial.
+                    bound = 2 * max(side.prices, default=0.0) * (EPSILON + len(bids) * math.ulp(total))
+                    assert abs(got - expected) <= bound
+
+    def test_exact_equality_on_level_boundaries(self):
+        bids = [["100.0", "0.5"], ["99.0", "0.25"], ["98.0", "0.125"]]
+        side = DepthSide.from_levels(bids)
+
+        for quantity in (0.25, 0.5, 0.625, 0.75, 0.875):
+            assert side.fill(quantity) == reference_fill(bids, quantity)
+
+    def test_insufficient_liquidity_from_total_depth(self):
+        side = DepthSide.from_levels([["100.0", "0.05"], ["99.0", "0.05"]])
+
+        assert side.total_size == pytest.approx(0.1)
+        assert side.fill(0.2) is None
+        assert DepthSide.from_levels([]).fill(1.0) is None
+        assert DepthSide.from_levels([]).fill(0.0) == 0.0
+
+    def test_order_book_depth_counts_levels(self):
+        book = OrderBookDepth.from_payload({"bids": [["1", "1"]] * 3, "asks": [["2", "1"]]})
+
+        assert book.levels == 4
+        assert len(book.bids) == 3
+
+    def test_spend_is_the_inverse_of_fill(self):
+        asks = [["100.0", "0.5"], ["101.0", "0.25"], ["102.0", "1.0"]]
+        side = DepthSide.from_levels(asks)
+
+        for quantity in (0.1, 0.5, 0.6, 1.75):
+            assert side.spend(side.fill(quantity)) == pytest.approx(quantity, rel=1e-12)
+        assert side.spend(0.0) == 0.0
+        assert side.spend(side.cum_notional[-1] * 1.01) is None
@@ -1,9 +1,17 @@
+import asyncio
+import gc
+
+import httpx
 import pytest
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
 from unittest.mock import AsyncMock, patch
 
+import main
 from clients.buda_client import BudaAPIError
-from models.portfolio import PortfolioRequest, PortfolioExactRequest
+from models.portfolio import PortfolioMultiRequest, PortfolioRequest, PortfolioExactRequest, PortfolioScenarioRequest
 from services.portfolio_service import PortfolioService
+from services.subscriptions import SubscriptionHub
 
 """
 SUPUESTOS UTILIZADOS:
@@ -173,4 +181,439 @@ class TestPortfolioLogic:
 
             assert exc_info.value.status_code == 400
             assert "Liquidez insuficiente" in str(exc_info.value)
-  
\ No newline at end of file
+  
+    @pytest.mark.asyncio
+    async def test_calculate_total_value_exact_fetches_concurrently_in_order(self):
+        service = PortfolioService()
+        in_flight = 0
+        max_in_flight = 0
+
+        async def fake_fetch(base, quote):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            # el primer activo responde último
+            await asyncio.sleep(0.03 if base == "BTC" else 0.01)
+            in_flight -= 1
+            return {"bids": [["100.0", "10"]]}
+
+        with patch.object(service.client, 'calculate_total_value_exact', side_effect=fake_fetch):
+            portfolio = PortfolioRequest(
+                portfolio={"BTC": 1.0, "ETH": 2.0, "LTC": 3.0},
+                fiat_currency="CLP"
+            )
+
+            total, breakdown = await service.calculate_total_value_exact(portfolio)
+
+        assert max_in_flight == 3
+        assert list(breakdown) == ["BTC", "ETH", "LTC"]
+        assert total == 600.0
+
+    @pytest.mark.asyncio
+    async def test_calculate_total_value_exact_first_error_cancels_pending(self):
+        service = PortfolioService()
+        cancelled = []
+
+        async def fake_fetch(base, quote):
+            if base == "ETH":
+                raise BudaAPIError("Error API 503", status_code=503)
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(base)
+                raise
+            return {"bids": [["100.0", "10"]]}
+
+        with patch.object(service.client, 'calculate_total_value_exact', side_effect=fake_fetch):
+            portfolio = PortfolioRequest(
+                portfolio={"BTC": 1.0, "ETH": 2.0, "LTC": 3.0},
+                fiat_currency="CLP"
+            )
+
+            with pytest.raises(BudaAPIError) as exc_info:
+                await service.calculate_total_value_exact(portfolio)
+
+        assert exc_info.value.status_code == 503
+        assert sorted(cancelled) == ["BTC", "LTC"]
+
+    @pytest.mark.asyncio
+    async def test_batch_value_uses_one_snapshot_and_reports_item_errors(self):
+        service = PortfolioService()
+        service.client.cache.set({
+            "tickers": [
+                {"market_id": "BTC-CLP", "last_price": ["80000000.0", "CLP"]},
+                {"market_id": "ETH-CLP", "last_price": ["3000000.0", "CLP"]},
+                {"market_id": "USDT-CLP", "last_price": ["312.554", "CLP"]},
+            ]
+        })
+
+        with patch.object(service.client, '_fetch_tickers', side_effect=AssertionError("sin red")):
+            snapshot, values = await service.calculate_batch_value([
+                PortfolioRequest(portfolio={"BTC": 0.5, "ETH": 2.0, "USDT": 1000}, fiat_currency="CLP"),
+                PortfolioRequest(portfolio={"BTC": 1.0}, fiat_currency="USD"),
+                PortfolioRequest(portfolio={"LTC": 1.0}, fiat_currency="CLP"),
+                PortfolioRequest(portfolio={"ETH": 1.0}, fiat_currency="clp"),
+            ])
+
+        assert snapshot.version == 1
+        assert values[0] == 46312554.0
+        assert values[1].status_code == 400
+        assert values[2].status_code == 404
+        assert values[3] == 3000000.0
+
+    @pytest.mark.asyncio
+    async def test_stream_values_exact_shares_order_books(self):
+        service = PortfolioService()
+        fetched = []
+
+        async def fake_fetch(base, quote):
+            fetched.append(f"{base}-{quote}")
+            return {"bids": [["100.0", "10"]]}
+
+        async def lines():
+            yield b'{"portfolio": {"BTC": 1.0}, "fiat_currency": "CLP"}'
+            yield b'not json'
+            yield b'{"portfolio": {"BTC": 2.0, "ETH": 1.0}, "fiat_currency": "CLP"}'
+
+        with patch.object(service.client, 'calculate_total_value_exact', side_effect=fake_fetch):
+            results = [result async for result in service.stream_values(lines(), exact=True)]
+
+        assert sorted(fetched) == ["BTC-CLP", "ETH-CLP"]
+        assert results[0]["portfolio_value"] == 100.0
+        assert results[1]["error"]["status_code"] == 422
+        assert results[2] == {
+            "line": 3,
+            "portfolio_value": 300.0,
+            "fiat_currency": "CLP",
+            "breakdown": {"BTC": 200.0, "ETH": 100.0},
+        }
+
+    @pytest.mark.asyncio
+    async def test_subscription_hub_pushes_only_affected_portfolios(self):
+        service = PortfolioService()
+        hub = SubscriptionHub(service)
+        service.client.cache.add_listener(hub.on_snapshot)
+        snapshot = service.client.cache.set({
+            "tickers": [
+                {"market_id": "BTC-CLP", "last_price": ["100.0", "CLP"]},
+                {"market_id": "ETH-CLP", "last_price": ["10.0", "CLP"]},
+            ]
+        })
+        btc = hub.subscribe(PortfolioRequest(portfolio={"BTC": 2.0}, fiat_currency="CLP"), snapshot)
+        eth = hub.subscribe(PortfolioRequest(portfolio={"ETH": 1.0}, fiat_currency="CLP"), snapshot)
+        assert btc.queue.get_nowait()["portfolio_value"] == 200.0
+        assert eth.queue.get_nowait()["portfolio_value"] == 10.0
+
+        service.client.cache.set({
+            "tickers": [
+                {"market_id": "BTC-CLP", "last_price": ["100.0", "CLP"], "volume": ["5", "BTC"]},
+                {"market_id": "ETH-CLP", "last_price": ["12.0", "CLP"]},
+            ]
+        })
+
+        assert btc.queue.empty()
+        assert eth.queue.get_nowait() == {"portfolio_value": 12.0, "fiat_currency": "CLP", "snapshot_version": 2}
+
+        hub.unsubscribe(eth)
+        assert len(hub) == 1
+
+    @pytest.mark.asyncio
+    async def test_websocket_retrieves_failed_sender_on_disconnect(self):
+        class FailingWebSocket:
+            def __init__(self):
+                self.incoming = ['{"portfolio": {"BTC": 1.0}, "fiat_currency": "CLP"}']
+                self.sending = asyncio.Event()
+
+            async def accept(self):
+                pass
+
+            async def receive_text(self):
+                if self.incoming:
+                    return self.incoming.pop()
+                await self.sending.wait()
+                raise main.WebSocketDisconnect()
+
+            async def send_json(self, data):
+                # El cliente se desconecta con un envío en curso, que falla
+                # al cancelarlo.
+                self.sending.set()
+                try:
+                    await asyncio.Event().wait()
+                except asyncio.CancelledError:
+                    raise RuntimeError("socket cerrado")
+
+        unhandled = []
+        loop = asyncio.get_running_loop()
+        previous = loop.get_exception_handler()
+        loop.set_exception_handler(lambda loop, context: unhandled.append(context))
+        main.service.client.cache.set({"tickers": [{"market_id": "BTC-CLP", "last_price": ["100.0", "CLP"]}]})
+        try:
+            await main.portfolio_value_ws(FailingWebSocket())
+            gc.collect()
+            await asyncio.sleep(0)
+        finally:
+            loop.set_exception_handler(previous)
+            main.service.client.cache.clear()
+
+        assert unhandled == []
+        assert len(main.hub) == 0
+
+    def test_websocket_pushes_price_change_without_background_refresh(self):
+        prices = iter(["100.0", "120.0"])
+        last = "120.0"
+
+        async def fake_fetch_tickers():
+            nonlocal last
+            last = next(prices, last)
+            return {"tickers": [{"market_id": "BTC-CLP", "last_price": [last, "CLP"]}]}
+
+        assert not main.refresher.running
+        with patch.object(main.service.client, "_fetch_tickers", side_effect=fake_fetch_tickers), \
+                patch.object(main.refresher, "interval", 0.05), patch.object(main.refresher, "jitter", 0):
+            with TestClient(main.app).websocket_connect("/v1/portfolio/ws") as ws:
+                ws.send_text('{"portfolio": {"BTC": 1.0}, "fiat_currency": "CLP"}')
+                initial = ws.receive_json()
+                assert main.refresher.running
+                pushed = ws.receive_json()
+            main.service.client.cache.clear()
+
+        assert initial["portfolio_value"] == 100.0
+        assert pushed["portfolio_value"] == 120.0
+        assert len(main.hub) == 0
+        assert not main.refresher.running
+
+    @pytest.mark.asyncio
+    async def test_cached_value_is_memoized_per_snapshot(self):
+        service = PortfolioService()
+        service.client.cache.set({"tickers": [{"market_id": "BTC-CLP", "last_price": ["100.0", "CLP"]}]})
+
+        first, key = await service.calculate_total_value_cached(
+            PortfolioRequest(portfolio={"BTC": 2.0}, fiat_currency="CLP")
+        )
+        again, same_key = await service.calculate_total_value_cached(
+            PortfolioRequest(portfolio={"btc": 2}, fiat_currency="clp")
+        )
+        assert first == again == 200.0
+        assert key == same_key
+        assert service.results.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+        service.client.cache.set({"tickers": [{"market_id": "BTC-CLP", "last_price": ["110.0", "CLP"]}]})
+        assert len(service.results) == 0
+        updated, new_key = await service.calculate_total_value_cached(
+            PortfolioRequest(portfolio={"BTC": 2.0}, fiat_currency="CLP")
+        )
+        assert updated == 220.0
+        assert new_key != key
+
+    @pytest.mark.asyncio
+    async def test_valuation_key_does_not_depend_on_process_version(self):
+        request = PortfolioRequest(portfolio={"BTC": 1.0}, fiat_currency="CLP")
+        keys = []
+        for price in ("100.0", "101.0", "100.0"):
+            # Un PortfolioService por "worker": todos parten en la versión 1.
+            worker = PortfolioService()
+            worker.client.cache.set({"tickers": [{"market_id": "BTC-CLP", "last_price": [price, "CLP"]}]})
+            assert worker.client.cache.snapshot.version == 1
+            keys.append((await worker.calculate_total_value_cached(request))[1])
+
+        assert keys[0] != keys[1]
+        assert keys[0] == keys[2]
+
+    @pytest.mark.asyncio
+    async def test_value_endpoint_answers_304_for_matching_etag(self):
+        main.service.client.cache.set({"tickers": [{"market_id": "BTC-CLP", "last_price": ["100.0", "CLP"]}]})
+        body = {"portfolio": {"BTC": 1.0}, "fiat_currency": "CLP"}
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://api") as api:
+                first = await api.post("/v1/portfolio/value", json=body)
+                cached = await api.post(
+                    "/v1/portfolio/value", json=body, headers={"If-None-Match": first.headers["ETag"]}
+                )
+                main.service.client.cache.set(
+                    {"tickers": [{"market_id": "BTC-CLP", "last_price": ["101.0", "CLP"]}]}
+                )
+                changed = await api.post(
+                    "/v1/portfolio/value", json=body, headers={"If-None-Match": first.headers["ETag"]}
+                )
+        finally:
+            main.service.client.cache.clear()
+
+        assert first.status_code == 200
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert changed.status_code == 200
+        assert changed.json()["portfolio_value"] == 101.0
+        assert changed.headers["ETag"] != first.headers["ETag"]
+
+    @pytest.mark.asyncio
+    async def test_scenarios_apply_shock_matrix_with_depth_slippage(self):
+        service = PortfolioService()
+        service.client.cache.set({"tickers": [
+            {"market_id": "BTC-CLP", "last_price": ["100.0", "CLP"]},
+            {"market_id": "ETH-CLP", "last_price": ["10.0", "CLP"]},
+        ]})
+
+        async def fake_fetch(base, quote):
+            if base.upper() == "BTC":
+                return {"bids": [["100.0", "1"], ["90.0", "1"]]}
+            return {"bids": [["10.0", "10"]]}
+
+        scenario = PortfolioScenarioRequest(
+            portfolio={"BTC": 2.0, "ETH": 5.0},
+            fiat_currency="CLP",
+            shocks=[[0.0, 0.0], [-0.5, 0.0], [-0.1, -1.0]],
+            quantiles=[0.0, 0.5, 1.0],
+        )
+        plain = await service.calculate_scenarios(scenario)
+        with patch.object(service.client, 'calculate_total_value_exact', side_effect=fake_fetch):
+            deep = await service.calculate_scenarios(scenario.model_copy(update={"depth": True}))
+
+        assert plain["positions"] == {"BTC": 200.0, "ETH": 50.0}
+        assert plain["values"] == [250.0, 150.0, 180.0]
+        assert plain["quantiles"] == {"0": 150.0, "0.5": 180.0, "1": 250.0}
+        assert plain["slippage"] is None
+        assert deep["base_value"] == 240.0
+        assert deep["slippage"] == {"BTC": 10.0, "ETH": 0.0}
+        assert deep["values"] == [240.0, 145.0, 171.0]
+
+    @pytest.mark.asyncio
+    async def test_scenarios_endpoint_builds_grid(self):
+        main.service.client.cache.set({"tickers": [
+            {"market_id": "BTC-CLP", "last_price": ["100.0", "CLP"]},
+            {"market_id": "ETH-CLP", "last_price": ["10.0", "CLP"]},
+        ]})
+        body = {
+            "portfolio": {"BTC": 1.0, "ETH": 10.0},
+            "fiat_currency": "CLP",
+            "grid": {"start": 0.0, "stop": -0.5, "steps": 3, "assets": ["btc"]},
+        }
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://api") as api:
+                response = await api.post("/v1/portfolio/scenarios", json=body)
+                invalid = await api.post(
+                    "/v1/portfolio/scenarios", json={**body, "shocks": [[0.1, 0.1]]}
+                )
+        finally:
+            main.service.client.cache.clear()
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["values"] == [200.0, 175.0, 150.0]
+        assert data["min"] == 150.0 and data["max"] == 200.0 and data["mean"] == 175.0
+        assert invalid.status_code == 422
+
+    @pytest.mark.asyncio
+    async def test_multi_fiat_values_from_one_snapshot(self):
+        service = PortfolioService()
+        service.client.cache.set({"tickers": [
+            {"market_id": "BTC-CLP", "last_price": ["100.0", "CLP"]},
+            {"market_id": "BTC-PEN", "last_price": ["2.0", "PEN"]},
+            {"market_id": "ETH-CLP", "last_price": ["10.0", "CLP"]},
+            {"market_id": "ETH-PEN", "last_price": ["0.5", "PEN"]},
+        ]})
+        portfolio = PortfolioMultiRequest(portfolio={"btc": 1.0, "ETH": 4.0}, fiat_currencies=["clp", "PEN", "CLP"])
+
+        with patch.object(service.client, 'get_snapshot', wraps=service.client.get_snapshot) as get_snapshot:
+            values, breakdown = await service.calculate_multi_value(portfolio)
+
+        assert get_snapshot.call_count == 1
+        assert values == {"CLP": 140.0, "PEN": 4.0}
+        assert breakdown == {"CLP": {"BTC": 100.0, "ETH": 40.0}, "PEN": {"BTC": 2.0, "ETH": 2.0}}
+
+    @pytest.mark.asyncio
+    async def test_multi_fiat_exact_fetches_each_book_once(self):
+        service = PortfolioService()
+        fetched = []
+
+        async def fake_fetch(base, quote):
+            fetched.append(f"{base}-{quote}")
+            await asyncio.sleep(0.01)
+            return {"bids": [["100.0" if quote == "CLP" else "3.0", "10"]]}
+
+        with patch.object(service.client, 'calculate_total_value_exact', side_effect=fake_fetch):
+            values, breakdown = await service.calculate_multi_value(
+                PortfolioMultiRequest(portfolio={"BTC": 1.0, "ETH": 2.0}, fiat_currencies=["CLP", "COP"]), exact=True
+            )
+
+        assert sorted(fetched) == ["BTC-CLP", "BTC-COP", "ETH-CLP", "ETH-COP"]
+        assert values == {"CLP": 300.0, "COP": 9.0}
+        assert breakdown["COP"] == {"BTC": 3.0, "ETH": 6.0}
+
+    @pytest.mark.asyncio
+    async def test_fiat_currencies_only_accepted_by_multi_endpoint(self):
+        with pytest.raises(ValidationError):
+            PortfolioMultiRequest(portfolio={"BTC": 1.0}, fiat_currencies=["C"])
+        with pytest.raises(ValidationError):
+            PortfolioMultiRequest(portfolio={"BTC": 1.0}, fiat_currencies=[])
+
+        body = {"portfolio": {"BTC": 1.0}, "fiat_currencies": ["PEN", "CLP"]}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://api") as api:
+            single = await api.post("/v1/portfolio/value", json=body)
+        schema = main.app.openapi()["components"]["schemas"]
+
+        assert single.status_code == 422
+        assert schema["PortfolioRequest"]["required"] == ["portfolio", "fiat_currency"]
+        assert schema["PortfolioMultiRequest"]["required"] == ["portfolio", "fiat_currencies"]
+
+    @pytest.mark.asyncio
+    async def test_exact_uses_top_of_book_for_positions_inside_best_bid(self):
+        service = PortfolioService()
+        fetched = []
+
+        async def fake_fetch(market_id):
+            fetched.append(market_id)
+            return {"bids": [["100.0", "0.5"], ["90.0", "10"]], "asks": []}
+
+        service.client.cache.set({"tickers": [
+            {"market_id": "BTC-CLP", "last_price": ["101.0", "CLP"], "max_bid": ["100.0", "CLP"]},
+        ]})
+        with patch.object(service.client, '_fetch_order_book', side_effect=fake_fetch):
+            await service.client.calculate_total_value_exact("BTC", "CLP")
+            service.client.order_books.ttl = 0
+
+            small_paths: dict = {}
+            small, _ = await service.calculate_total_value_exact(
+                PortfolioRequest(portfolio={"BTC": 0.4}, fiat_currency="CLP"), paths=small_paths
+            )
+            large_paths: dict = {}
+            large, _ = await service.calculate_total_value_exact(
+                PortfolioRequest(portfolio={"BTC": 1.0}, fiat_currency="CLP"), paths=large_paths
+            )
+            service.client.cache.set({"tickers": [
+                {"market_id": "BTC-CLP", "last_price": ["99.0", "CLP"], "max_bid": ["99.0", "CLP"]},
+            ]})
+            moved_paths: dict = {}
+            await service.calculate_total_value_exact(
+                PortfolioRequest(portfolio={"BTC": 0.4}, fiat_currency="CLP"), paths=moved_paths
+            )
+
+        assert small == 40.0 and small_paths == {"BTC": "top_of_book"}
+        assert large == 50.0 + 45.0 and large_paths == {"BTC": "order_book"}
+        assert moved_paths == {"BTC": "order_book"}
+        assert fetched == ["BTC-CLP"] * 3
+
+    @pytest.mark.asyncio
+    async def test_exact_reports_identity_path_and_failing_hop_amount(self):
+        service = PortfolioService()
+        books = {
+            "BTC-CLP": {"bids": [["100.0", "10"]], "asks": []},
+            "USDC-CLP": {"bids": [], "asks": [["1000.0", "0.01"]]},
+        }
+
+        async def fake_fetch(market_id):
+            return books[market_id]
+
+        service.client.cache.set({"tickers": [
+            {"market_id": "BTC-CLP", "last_price": ["100.0", "CLP"]},
+            {"market_id": "USDC-CLP", "last_price": ["1000.0", "CLP"]},
+        ]})
+        paths: dict = {}
+        with patch.object(service.client, '_fetch_order_book', side_effect=fake_fetch):
+            value, _ = await service.calculate_total_value_exact(
+                PortfolioRequest(portfolio={"CLP": 5.0}, fiat_currency="CLP"), paths=paths
+            )
+            with pytest.raises(BudaAPIError) as exc_info:
+                await service.calculate_total_value_exact(PortfolioRequest(portfolio={"BTC": 2.0}, fiat_currency="USDC"))
+
+        assert value == 5.0 and paths == {"CLP": "identity"}
+        assert "USDC-CLP para cantidad 200.0 CLP" in str(exc_info.value)
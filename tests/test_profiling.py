@@ -0,0 +1,78 @@
+import pstats
+
+import httpx
+import pytest
+from unittest.mock import patch
+
+import main
+import monitoring.profiling as profiling
+
+"""
+SUPUESTOS UTILIZADOS:
+- Se valoriza contra un snapshot precargado: no hay llamadas a Buda, así que
+  la fase `upstream` no aparece.
+- Los volcados de cProfile se escriben en tmp_path.
+"""
+
+TICKERS_PAYLOAD = {"tickers": [{"market_id": "BTC-CLP", "last_price": ["100.0", "CLP"]}]}
+BODY = {"portfolio": {"BTC": 1.0}, "fiat_currency": "CLP"}
+
+
+async def post_value(headers: dict | None = None) -> httpx.Response:
+    main.service.client.cache.set(TICKERS_PAYLOAD)
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://api") as api:
+            return await api.post("/v1/portfolio/value", json=BODY, headers=headers)
+    finally:
+        main.service.client.cache.clear()
+
+
+def timings(response: httpx.Response) -> dict[str, float]:
+    entries = (entry.split(";dur=") for entry in response.headers["Server-Timing"].split(", "))
+    return {name: float(duration) for name, duration in entries}
+
+
+class TestProfiling:
+    """Tests del perfilado opt-in por request"""
+
+    def test_phase_is_noop_without_profiled_request(self):
+        assert profiling.phase("cache") is profiling.phase("fill")
+
+    @pytest.mark.asyncio
+    async def test_disabled_ignores_header(self):
+        response = await post_value({"X-Profile": "1"})
+
+        assert response.status_code == 200
+        assert "Server-Timing" not in response.headers
+
+    @pytest.mark.asyncio
+    async def test_debug_profiles_only_exists_when_enabled(self):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://api") as api:
+            disabled = await api.get("/v1/debug/profiles")
+            with patch.object(profiling, "PROFILING_ENABLED", True):
+                enabled = await api.get("/v1/debug/profiles")
+
+        assert disabled.status_code == 404
+        assert enabled.status_code == 200
+
+    @pytest.mark.asyncio
+    async def test_header_returns_phase_breakdown(self):
+        with patch.object(profiling, "PROFILING_ENABLED", True):
+            plain = await post_value()
+            response = await post_value({"X-Profile": "1"})
+
+        assert "Server-Timing" not in plain.headers
+        phases = timings(response)
+        assert {"validation", "cache", "fill", "serialization", "total"} <= set(phases)
+        assert "upstream" not in phases
+        assert profiling.recent_profiles[-1]["route"] == "/v1/portfolio/value"
+
+    @pytest.mark.asyncio
+    async def test_cprofile_dumps_stats_file(self, tmp_path):
+        with patch.object(profiling, "PROFILING_ENABLED", True), patch.object(profiling, "PROFILING_DIR", str(tmp_path)):
+            response = await post_value({"X-Profile": "cprofile"})
+
+        dump = tmp_path / response.headers["X-Profile-File"]
+        assert dump.exists()
+        stats = pstats.Stats(str(dump))
+        assert any(name == "calculate_total_value_cached" for _, _, name in stats.stats)
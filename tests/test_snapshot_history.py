@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from unittest.mock import patch
+
+import main
+from clients.buda_client import BudaAPIError, TickerSnapshot
+from clients.snapshot_history import SnapshotHistory
+from models.portfolio import PortfolioRequest
+from services.portfolio_service import PortfolioService
+
+"""
+SUPUESTOS UTILIZADOS:
+- El historial se escribe en un archivo temporal (tmp_path) con capacidad
+  chica para ejercitar el ring.
+- Los snapshots se arman con `TickerSnapshot.from_payload` y un fetched_at
+  explícito para controlar los instantes.
+"""
+
+
+def snapshot(fetched_at: float, prices: dict, partial: bool = False) -> TickerSnapshot:
+    payload = {"tickers": [
+        {"market_id": market_id, "last_price": [str(price), market_id.split("-")[1]]}
+        for market_id, price in prices.items()
+    ]}
+    return TickerSnapshot.from_payload(payload, version=int(fetched_at), fetched_at=fetched_at, partial=partial)
+
+
+class TestSnapshotHistory:
+    """Tests del ring mmap de snapshots"""
+
+    def test_find_returns_latest_record_at_or_before(self, tmp_path):
+        history = SnapshotHistory(str(tmp_path / "history.bin"), capacity=8, max_markets=4)
+        for t in (100.0, 200.0, 300.0):
+            assert history.append(snapshot(t, {"BTC-CLP": t}))
+        assert not history.append(snapshot(300.0, {"BTC-CLP": 1.0}))
+
+        assert history.find(99.0) is None
+        at, slot = history.find(250.0)
+        assert at == 200.0
+        assert history.prices(slot) == {"BTC-CLP": 200.0}
+        assert history.find(1e12)[0] == 300.0
+        history.close()
+
+    def test_ring_overwrites_oldest_and_reopens(self, tmp_path):
+        path = str(tmp_path / "history.bin")
+        history = SnapshotHistory(path, capacity=4, max_markets=4)
+        for t in range(1, 11):
+            history.append(snapshot(float(t), {"BTC-CLP": t * 10.0}))
+        history.close()
+
+        reopened = SnapshotHistory(path, capacity=4, max_markets=4)
+        stats = reopened.stats()
+        assert (stats["records"], stats["oldest"], stats["newest"]) == (3, 8.0, 10.0)
+        assert reopened.find(7.5) is None
+        at, slot = reopened.find(9.5)
+        assert (at, reopened.prices(slot)) == (9.0, {"BTC-CLP": 90.0})
+        reopened.close()
+
+        with pytest.raises(ValueError):
+            SnapshotHistory(path, capacity=8, max_markets=4)
+
+    def test_partial_snapshot_carries_forward_missing_markets(self, tmp_path):
+        history = SnapshotHistory(str(tmp_path / "history.bin"), capacity=8, max_markets=2)
+        history.append(snapshot(1.0, {"BTC-CLP": 100.0, "ETH-CLP": 10.0}))
+        history.append(snapshot(2.0, {"BTC-CLP": 110.0}, partial=True))
+        history.append(snapshot(3.0, {"BTC-CLP": 120.0, "LTC-CLP": 5.0}))
+
+        assert history.prices(history.find(2.0)[1]) == {"BTC-CLP": 110.0, "ETH-CLP": 10.0}
+        assert history.prices(history.find(3.0)[1]) == {"BTC-CLP": 120.0}
+        assert history.dropped_markets == 1
+        history.close()
+
+    def test_market_added_later_has_no_price_before_first_record(self, tmp_path):
+        history = SnapshotHistory(str(tmp_path / "history.bin"), capacity=8, max_markets=4)
+        history.append(snapshot(1.0, {"BTC-CLP": 100.0}))
+        history.append(snapshot(2.0, {"BTC-CLP": 110.0, "ETH-CLP": 10.0}))
+
+        assert history.prices(history.find(1.0)[1]) == {"BTC-CLP": 100.0}
+        assert history.prices(history.find(2.0)[1]) == {"BTC-CLP": 110.0, "ETH-CLP": 10.0}
+        history.close()
+
+
+class TestValueAsOf:
+    """Tests de la valorización histórica"""
+
+    @pytest.mark.asyncio
+    async def test_service_values_and_routes_from_history(self, tmp_path):
+        service = PortfolioService()
+        service.history = SnapshotHistory(str(tmp_path / "history.bin"), capacity=8, max_markets=8)
+        service.client.cache._replace(snapshot(1000.0, {"BTC-CLP": 100.0, "USDC-CLP": 900.0, "USDC-COP": 4000.0}))
+        service.client.cache._replace(snapshot(2000.0, {"BTC-CLP": 200.0, "USDC-CLP": 1000.0, "USDC-COP": 4000.0}))
+        await service.history.flush()
+
+        value, at = service.calculate_value_as_of(PortfolioRequest(portfolio={"BTC": 2}, fiat_currency="CLP"), 1500.0)
+        routed, _ = service.calculate_value_as_of(PortfolioRequest(portfolio={"BTC": 1}, fiat_currency="COP"), 2500.0)
+
+        assert (value, at) == (200.0, 1000.0)
+        assert routed == pytest.approx(200.0 / 1000.0 * 4000.0)
+        with pytest.raises(BudaAPIError) as exc_info:
+            service.calculate_value_as_of(PortfolioRequest(portfolio={"BTC": 1}, fiat_currency="CLP"), 10.0)
+        assert exc_info.value.status_code == 404
+        service.client.cache._replace(snapshot(3000.0, {"BTC-CLP": 300.0, "ETH-CLP": 30.0}))
+        await service.history.flush()
+        with pytest.raises(BudaAPIError) as exc_info:
+            service.calculate_value_as_of(PortfolioRequest(portfolio={"ETH": 1}, fiat_currency="CLP"), 2500.0)
+        assert exc_info.value.status_code == 404
+        await service.history.aclose()
+
+    @pytest.mark.asyncio
+    async def test_listener_writes_off_the_event_loop(self, tmp_path):
+        service = PortfolioService()
+        service.history = SnapshotHistory(str(tmp_path / "history.bin"), capacity=8, max_markets=8)
+        append = service.history.append
+
+        def slow_append(snapshot):
+            time.sleep(0.2)  # flock esperando a otro worker, disco lento, etc.
+            return append(snapshot)
+
+        with patch.object(service.history, "append", side_effect=slow_append):
+            started = time.perf_counter()
+            service.client.cache._replace(snapshot(1000.0, {"BTC-CLP": 100.0}))
+            await asyncio.sleep(0.01)
+            elapsed = time.perf_counter() - started
+            assert service.history.find(1000.0) is None
+            await service.history.flush()
+
+        assert elapsed < 0.1
+        assert service.history.find(1000.0)[0] == 1000.0
+        await service.history.aclose()
+
+    @pytest.mark.asyncio
+    async def test_endpoint_without_history_is_unavailable(self):
+        body = {"portfolio": {"BTC": 1.0}, "fiat_currency": "CLP"}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://api") as api:
+            response = await api.post("/v1/portfolio/value/as_of", params={"as_of": "2025-12-01T14:05:00"}, json=body)
+
+        assert response.status_code == 503
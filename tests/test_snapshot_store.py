@@ -0,0 +1,184 @@
+import asyncio
+import mmap
+
+import pytest
+from unittest.mock import patch
+
+from clients.buda_client import BudaClient
+from clients.snapshot_store import (
+    InProcessSnapshotStore,
+    RedisSnapshotStore,
+    SharedMemorySnapshotStore,
+    SnapshotStoreError,
+)
+
+"""
+SUPUESTOS UTILIZADOS:
+- Cada `BudaClient` con su propia instancia de store simula un worker.
+- `FakeRespServer` es un stand-in local mínimo de Redis (GET/SET NX PX/INCR/DEL).
+"""
+
+TICKERS_PAYLOAD = {
+    "tickers": [
+        {"market_id": "BTC-CLP", "last_price": ["80000000.0", "CLP"], "max_bid": ["79900000.0", "CLP"]},
+    ]
+}
+
+
+class FakeRespServer:
+    """Servidor RESP en memoria para pruebas (sin expiración real de leases)."""
+
+    def __init__(self):
+        self.data: dict[bytes, bytes] = {}
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                args = []
+                for _ in range(int(header[1:-2])):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self._execute(args))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def _execute(self, args):
+        command = args[0].upper()
+        if command == b"GET":
+            value = self.data.get(args[1])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == b"SET":
+            if b"NX" in [a.upper() for a in args[3:]] and args[1] in self.data:
+                return b"$-1\r\n"
+            self.data[args[1]] = args[2]
+            return b"+OK\r\n"
+        if command == b"INCR":
+            value = int(self.data.get(args[1], b"0")) + 1
+            self.data[args[1]] = str(value).encode()
+            return b":%d\r\n" % value
+        if command == b"DEL":
+            return b":%d\r\n" % int(self.data.pop(args[1], None) is not None)
+        return b"-ERR unknown command\r\n"
+
+
+async def _fetch_once_across_workers(clients):
+    calls = 0
+
+    async def fake_fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return TICKERS_PAYLOAD
+
+    patches = [patch.object(client, '_fetch_tickers', side_effect=fake_fetch) for client in clients]
+    for p in patches:
+        p.start()
+    try:
+        snapshots = await asyncio.gather(*(client.get_snapshot() for client in clients))
+    finally:
+        for p in patches:
+            p.stop()
+    return calls, snapshots
+
+
+class TestSnapshotStores:
+    """Tests de los backends de snapshots compartidos"""
+
+    @pytest.mark.asyncio
+    async def test_in_process_store_assigns_versions(self):
+        store = InProcessSnapshotStore()
+
+        assert await store.load() is None
+        assert await store.publish({"quotes": {}}) == 1
+        assert (await store.load(0))["version"] == 1
+        assert await store.load(1) is None
+
+    @pytest.mark.asyncio
+    async def test_shared_memory_workers_fetch_once_and_share_version(self, tmp_path):
+        path = str(tmp_path / "tickers.snap")
+        stores = [SharedMemorySnapshotStore(path, 1 << 16) for _ in range(3)]
+        clients = [BudaClient(store=store) for store in stores]
+
+        calls, snapshots = await _fetch_once_across_workers(clients)
+
+        assert calls == 1
+        assert {snapshot.version for snapshot in snapshots} == {1}
+        assert all(s.last_price("BTC-CLP") == 80000000.0 for s in snapshots)
+        assert snapshots[1].quotes["BTC-CLP"].bid == 79900000.0
+        for store in stores:
+            await store.close()
+
+    @pytest.mark.asyncio
+    async def test_shared_memory_lease_is_exclusive(self, tmp_path):
+        path = str(tmp_path / "tickers.snap")
+        first = SharedMemorySnapshotStore(path, 1 << 16)
+        second = SharedMemorySnapshotStore(path, 1 << 16)
+
+        assert await first.acquire_lease(5) is True
+        assert await second.acquire_lease(5) is False
+        await first.release_lease()
+        assert await second.acquire_lease(5) is True
+        await first.close()
+        await second.close()
+
+    @pytest.mark.asyncio
+    async def test_shared_memory_reader_yields_while_write_in_progress(self, tmp_path):
+        path = str(tmp_path / "tickers.snap")
+        store = SharedMemorySnapshotStore(path, 1 << 16)
+        assert await store.publish({"quotes": {}}) == 1
+
+        with open(path, "r+b") as f, mmap.mmap(f.fileno(), 1 << 16) as region:
+            magic, seq, version, length = store.HEADER.unpack_from(region, 0)
+            # Escritura "en curso": seq impar hasta que otra corrutina la cierra.
+            store.HEADER.pack_into(region, 0, magic, seq + 1, version, length)
+
+            async def finish_write():
+                await asyncio.sleep(0.005)
+                store.HEADER.pack_into(region, 0, magic, seq + 2, version, length)
+
+            writer = asyncio.create_task(finish_write())
+            assert (await store.load(0))["version"] == 1
+            await writer
+
+            store.HEADER.pack_into(region, 0, magic, seq + 3, version, length)
+            with patch.object(store, "READ_ATTEMPTS", 3), pytest.raises(SnapshotStoreError):
+                await store.load(0)
+        await store.close()
+
+    @pytest.mark.asyncio
+    async def test_redis_workers_fetch_once_and_share_version(self):
+        server = FakeRespServer()
+        port = await server.start()
+        stores = [RedisSnapshotStore(f"redis://127.0.0.1:{port}/0") for _ in range(3)]
+        clients = [BudaClient(store=store) for store in stores]
+
+        calls, snapshots = await _fetch_once_across_workers(clients)
+
+        assert calls == 1
+        assert {snapshot.version for snapshot in snapshots} == {1}
+        assert b"buda:tickers:lease" not in server.data
+        for store in stores:
+            await store.close()
+        await server.stop()
+
+    @pytest.mark.asyncio
+    async def test_unreachable_redis_falls_back_to_local_fetch(self):
+        client = BudaClient(store=RedisSnapshotStore("redis://127.0.0.1:1/0"))
+
+        with patch.object(client, '_fetch_tickers', return_value=TICKERS_PAYLOAD):
+            snapshot = await client.get_snapshot()
+
+        assert snapshot.last_price("BTC-CLP") == 80000000.0
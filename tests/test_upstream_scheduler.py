@@ -0,0 +1,129 @@
+import asyncio
+
+import httpx
+import pytest
+from unittest.mock import patch
+
+from clients.buda_client import BudaAPIError, BudaClient
+from clients.upstream_scheduler import QUEUE_FULL, WAIT_TOO_LONG, UpstreamOverloaded, UpstreamScheduler
+
+"""
+SUPUESTOS UTILIZADOS:
+- Tasas altas (100-1000/s) para que las esperas de los tests sean de pocos ms.
+- Buda se simula con httpx.MockTransport.
+"""
+
+TICKERS_PAYLOAD = {"tickers": [{"market_id": "BTC-CLP", "last_price": ["100.0", "CLP"]}]}
+
+
+class TestUpstreamScheduler:
+    """Tests del token bucket con cola acotada"""
+
+    @pytest.mark.asyncio
+    async def test_burst_then_queues_in_order(self):
+        scheduler = UpstreamScheduler(rate=100, burst=2, max_queue=10, max_wait=1)
+        order = []
+
+        async def call(i):
+            await scheduler.acquire()
+            order.append(i)
+
+        await scheduler.acquire()
+        await scheduler.acquire()
+        assert scheduler.waiting == 0
+
+        await asyncio.gather(*(call(i) for i in range(3)))
+
+        assert order == [0, 1, 2]
+        assert scheduler.admitted == 5
+        assert scheduler.shed == 0
+
+    @pytest.mark.asyncio
+    async def test_sheds_when_queue_full_or_wait_too_long(self):
+        scheduler = UpstreamScheduler(rate=100, burst=1, max_queue=1, max_wait=0.015)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        assert scheduler.waiting == 1
+
+        with pytest.raises(UpstreamOverloaded) as full:
+            await scheduler.acquire()
+        await waiter
+        await scheduler.acquire()
+        with pytest.raises(UpstreamOverloaded) as slow:
+            await scheduler.acquire(max_wait=0.001)
+
+        assert full.value.reason == QUEUE_FULL
+        assert slow.value.reason == WAIT_TOO_LONG
+        assert 0 < slow.value.retry_after <= 0.03
+        assert scheduler.shed == 2
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_returns_its_turn(self):
+        scheduler = UpstreamScheduler(rate=10, burst=1, max_queue=5, max_wait=1)
+        await scheduler.acquire()
+        tokens = scheduler.tokens
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        assert scheduler.waiting == 0
+        assert scheduler.tokens == pytest.approx(tokens, abs=0.05)
+
+
+class TestClientBudget:
+    """Tests del presupuesto aplicado en BudaClient"""
+
+    @pytest.mark.asyncio
+    async def test_over_budget_fails_fast_but_cache_hits_pass(self):
+        calls = 0
+
+        def handler(request):
+            nonlocal calls
+            calls += 1
+            return httpx.Response(200, json=TICKERS_PAYLOAD)
+
+        client = BudaClient()
+        client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://buda")
+        client.scheduler = UpstreamScheduler(rate=0.5, burst=1, max_queue=10, max_wait=0.1)
+
+        await client.get_snapshot()
+        client.cache.clear()
+        with pytest.raises(BudaAPIError) as exc_info:
+            await client._fetch_tickers()
+        client.cache.set(TICKERS_PAYLOAD)
+        price = await client.get_current_price("BTC", "CLP")
+        await client.aclose()
+
+        assert calls == 1
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.retry_after > 1
+        assert price == 100.0
+        assert client.breaker.consecutive_failures == 0
+
+    @pytest.mark.asyncio
+    async def test_budget_spent_waiting_is_not_a_breaker_failure(self):
+        calls = 0
+
+        def handler(request):
+            nonlocal calls
+            calls += 1
+            return httpx.Response(200, json=TICKERS_PAYLOAD)
+
+        async def slow_acquire(max_wait=None):
+            await asyncio.sleep(0.05)
+
+        client = BudaClient()
+        client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://buda")
+        with patch("clients.buda_client.BUDA_REQUEST_BUDGET", 0.01), patch.object(client.scheduler, "acquire", side_effect=slow_acquire):
+            for _ in range(client.breaker.failure_threshold + 1):
+                with pytest.raises(BudaAPIError) as exc_info:
+                    await client._fetch_tickers()
+                assert exc_info.value.status_code == 504
+        await client.aclose()
+
+        assert calls == 0
+        assert client.breaker.consecutive_failures == 0
+        assert client.breaker.allow()